@@ -1,18 +1,20 @@
 import time
 import uuid
-from flask import Flask, request, jsonify, send_file, session, current_app, send_from_directory
-from handright import Template, handwrite, Feature
+from flask import Flask, request, jsonify, send_file, session, current_app, send_from_directory, Response
+from handright import Template, Feature
 # from threading import Thread
-from PIL import Image, ImageFont, ImageDraw
+from PIL import Image
 from dotenv import load_dotenv
 import psutil
-import unicodedata
 
 load_dotenv()
 import os
 import gc
+import re
 
 import io
+import json
+import hashlib
 import logging
 from flask_cors import CORS
 from datetime import timedelta
@@ -22,68 +24,43 @@ from werkzeug.utils import secure_filename
 # 文件模块
 from docx import Document
 import PyPDF2
-import tempfile
-import shutil
-import zipfile
-from pdf import generate_pdf
+from pdf import write_pdf, PdfWriter, PDF_PROFILES, PDF_PROFILE
+
+# 后台渲染任务队列
+from render_jobs import render_job_queue, QueueFullError, RENDER_JOB_EVENTS_MAX_SECONDS
+
+# 多进程渲染引擎
+from render_engine import render_pages, scale_template, estimate_layout, PageLayout
+from glyph_atlas import glyph_atlas
+from font_pool import font_pool
+from font_store import font_store
+from font_registry import font_registry
+from background_cache import background_cache
+from background_store import background_store
+from page_encoder import page_encoder, image_mimetype, IMAGE_FORMATS, IMAGE_QUALITY
+from page_store import page_store
+from zip_stream import iter_page_zip
+
+# 纸张背景生成
+from paper import create_notebook_image, paper_key, GRID_PAPER_TYPES
+
+# 字体字符覆盖索引
+from font_coverage import font_coverage
+
+# 文本规范化流水线
+from text_pipeline import default_pipeline, english_spacing_pipeline
+
+# 渲染结果缓存
+from render_cache import render_cache, layout_history, render_flight, template_spec, spec_key, seed_from_key
 
 # 图片处理模块
 from identify import identify_distance
 
 
 # 预处理文本：移除可能导致黑色方块的控制字符
-def clean_text_for_handwrite(text):
-    """清理文本中的控制字符，保留换行符"""
-    # 统一换行符
-    text = text.replace('\r\n', '\n').replace('\r', '\n')
-    
-    # 移除零宽字符和不可见字符
-    text = text.replace('\u200b', '')  # 零宽空格
-    text = text.replace('\u200c', '')  # 零宽不连字
-    text = text.replace('\u200d', '')  # 零宽连字
-    text = text.replace('\ufeff', '')  # 零宽无间隔空格 (BOM)
-    text = text.replace('\u00ad', '')  # 软连字符
-    
-    # 移除所有方块符号（Block Elements Unicode范围）
-    # U+2580-259F: Block Elements
-    block_chars = set(chr(i) for i in range(0x2580, 0x25A0))
-    
-    # 移除其他常见的占位符/特殊符号
-    # U+25A0-25FF: Geometric Shapes
-    geometric_chars = set(chr(i) for i in range(0x25A0, 0x2600))
-    
-    # 移除私有使用区字符（Private Use Area）
-    # U+E000-F8FF, U+F0000-FFFFD, U+100000-10FFFD
-    
-    cleaned = []
-    for char in text:
-        if char == '\n':
-            # 保留换行符
-            cleaned.append(char)
-        elif char == '\t':
-            # 将制表符转换为空格
-            cleaned.append('    ')  # 4个空格
-        elif char in block_chars or char in geometric_chars:
-            # 跳过方块字符和几何图形
-            logger.info(f"移除方块/几何字符: '{char}' (U+{ord(char):04X})")
-            continue
-        else:
-            category = unicodedata.category(char)
-            # 过滤控制字符和特殊字符
-            if category not in ('Cc', 'Cf', 'Co', 'Cs', 'Cn'):
-                # Cc=控制字符, Cf=格式字符, Co=私有区, Cs=代理对, Cn=未分配
-                # 额外检查：过滤 emoji 和符号
-                code_point = ord(char)
-                if code_point < 0x1F000 or (0x2000 <= code_point < 0x2100):
-                    # 允许常用字符：中文、英文、数字、常用标点符号
-                    # 但排除私有使用区
-                    if not (0xE000 <= code_point <= 0xF8FF):
-                        cleaned.append(char)
-                    else:
-                        logger.info(f"移除私有区字符: '{char}' (U+{code_point:04X})")
-                # 否则跳过（可能是 emoji 或特殊符号）
-    
-    result = ''.join(cleaned)
+def clean_text_for_handwrite(text, pipeline=default_pipeline):
+    """清理文本中的控制字符，保留换行符，制表符转换为空格"""
+    result = pipeline(text)
     if len(result) != len(text):
         logger.info(f"文本清理：原始长度 {len(text)}, 清理后长度 {len(result)}, 移除了 {len(text) - len(result)} 个字符")
     return result
@@ -92,45 +69,11 @@ def clean_text_for_handwrite(text):
 def filter_unsupported_chars(text, font):
     """
     过滤字体不支持的字符，避免显示黑色方块
-    如果字体不支持某个字符，就用空格替换（而不是跳过）
+    按字体 cmap 建立的覆盖索引查表，不支持的字符直接跳过
     """
-    from PIL import Image, ImageDraw
-    
-    filtered = []
-    for char in text:
-        # 保留换行符
-        if char == '\n':
-            filtered.append(char)
-            continue
-        
-        # 对于空格和制表符，直接保留
-        if char in (' ', '\t'):
-            filtered.append(char)
-            continue
-        
-        try:
-            # 创建一个小的测试图片来检查字符是否能被渲染
-            test_img = Image.new('L', (50, 50), color=255)
-            draw = ImageDraw.Draw(test_img)
-            
-            # 尝试绘制字符
-            draw.text((10, 10), char, font=font, fill=0)
-            
-            # 检查图片是否有变化（如果字体不支持，图片应该全白）
-            bbox = test_img.getbbox()
-            
-            if bbox is not None:
-                # 图片有内容，说明字符被成功渲染
-                filtered.append(char)
-            else:
-                # 图片全白，说明字体不支持该字符，跳过不添加
-                logger.info(f"跳过字体不支持的字符: '{char}' (U+{ord(char):04X})")
-        except Exception as e:
-            # 如果出现任何异常，为了安全起见，跳过该字符
-            logger.warning(f"检查字符时出错，跳过: '{char}' (U+{ord(char):04X}) - {e}")
-    
-    result = ''.join(filtered)
-    logger.info(f"字体过滤：原始长度 {len(text)}, 过滤后长度 {len(result)}")
+    result, removed = font_coverage.filter_text(text, font)
+    if removed:
+        logger.info(f"字体过滤：原始长度 {len(text)}, 过滤后长度 {len(result)}")
     return result
 
 
@@ -261,8 +204,9 @@ def safe_remove_file(file_path, max_retries=3):
 def safe_save_and_close_image(image, image_path):
     """安全保存并关闭图片，确保文件句柄被释放"""
     try:
-        # 保存图片
-        image.save(image_path)
+        # 保存图片（按页面颜色选择最紧凑的 PNG 模式）
+        with open(image_path, "wb") as f:
+            f.write(page_encoder.encode(image))
 
         # 如果图片对象有 close 方法，调用它
         # if hasattr(image, "close"):
@@ -335,7 +279,7 @@ import schedule_clean
 from user_service import (
     wx_code_to_openid, get_or_create_user, check_user_membership,
     get_packages, create_order, complete_order, log_usage,
-    add_watermark_to_image, add_watermark_to_images, FREE_CHAR_LIMIT, APP_NAME,
+    add_watermark_to_image, FREE_CHAR_LIMIT, APP_NAME,
     is_admin, set_user_admin, admin_grant_membership, 
     get_membership_statistics, search_users, get_all_users
 )
@@ -357,6 +301,12 @@ from loveseed_service import (
 # 获取环境变量
 mysql_host = os.getenv("MYSQL_HOST", "db")
 enable_user_auth = os.getenv("ENABLE_USER_AUTH", "false")
+# 预览默认的缩放比例（约 1/3 分辨率，像素数约为 1/9），正式生成始终使用原始分辨率
+PREVIEW_SCALE = float(os.getenv("PREVIEW_SCALE", "0.33"))
+# 正式生成允许的最大页数（按排版估算），0 表示不限制
+RENDER_MAX_PAGES = int(os.getenv("RENDER_MAX_PAGES", "0"))
+# 启动预热：是否用默认参数试渲染一页（gunicorn preload 时在 master 进程中执行，worker fork 后共享）
+WARMUP_RENDER = os.getenv("WARMUP_RENDER", "true").lower() == "true"
 # 获取当前路径
 current_path = os.getcwd()
 # 创建一个子文件夹用于存储输出的图片
@@ -368,12 +318,9 @@ directory = ["./textfileprocess", "imagefileprocess"]
 for directory in directory:
     if not os.path.exists(directory):
         os.makedirs(directory)
-directory = "./font_assets"
-font_file_names = [
-    f
-    for f in os.listdir(directory)
-    if os.path.isfile(os.path.join(directory, f)) and f.endswith(".ttf")
-]
+# 建立（或校验）字体字符覆盖索引，再扫描字体注册表
+font_coverage.load()
+font_registry.refresh(force=True)
 # sentry部分 7.7
 sentry_sdk.init(
     dsn="https://ed22d5c0e3584faeb4ae0f67d19f68aa@o4505255803551744.ingest.sentry.io/4505485583253504",
@@ -457,8 +404,7 @@ limiter = Limiter(
 )
 
 
-# 创建一个新的白色图片，并添加间隔的线条作为背景
-def create_notebook_image(
+def notebook_background(
     width,
     height,
     line_spacing,
@@ -468,54 +414,21 @@ def create_notebook_image(
     right_margin,
     font_size,
     isUnderlined,
-    line_color="red",  # 横线颜色，默认红色
-    paper_type="plain",  # 纸张类型: plain, lined, grid
+    line_color="red",
+    paper_type="plain",
 ):
-    if paper_type == "grid":
-        # 方格纸模式：白色背景 + 青色方格
-        grid_color = (0, 180, 180)  # 青色方格线
-        paper_color = (255, 255, 255)  # 白色纸张
-        image = Image.new("RGB", (width, height), paper_color)
-        draw = ImageDraw.Draw(image)
-        
-        # 计算格子大小（基于字体大小，稍微大一点留边距）
-        cell_size = int(font_size * 1.15)  # 格子比字体稍大15%
-        
-        # 计算起始位置，确保格子从边距开始
-        start_x = left_margin
-        start_y = top_margin
-        
-        # 画竖线
-        x = start_x
-        while x <= width - right_margin:
-            draw.line((x, start_y, x, height - bottom_margin), fill=grid_color, width=1)
-            x += cell_size
-        
-        # 画横线
-        y = start_y
-        while y <= height - bottom_margin:
-            draw.line((start_x, y, width - right_margin, y), fill=grid_color, width=1)
-            y += cell_size
-            
-    elif paper_type == "lined" or isUnderlined == True or isUnderlined == "true":
-        # 显示横线模式：淡黄色纸张 + 彩色加粗横线
-        paper_color = (255, 251, 240)  # 淡黄色纸张
-        image = Image.new("RGB", (width, height), paper_color)
-        draw = ImageDraw.Draw(image)
-        y = top_margin + line_spacing  # 开始的y坐标设为顶部边距加字体大小
-        while (
-            y < height - bottom_margin
-        ):  # 当y坐标小于（图片高度-底部边距）时，继续画线
-            # 画加粗横线（画3条相邻的线模拟加粗效果）
-            draw.line((left_margin, y-1, width - right_margin, y-1), fill=line_color)
-            draw.line((left_margin, y, width - right_margin, y), fill=line_color)
-            draw.line((left_margin, y+1, width - right_margin, y+1), fill=line_color)
-            y += line_spacing  # 每次循环，y坐标增加行间距
-    else:
-        # 不显示横线模式：纯白色纸张
-        image = Image.new("RGB", (width, height), "white")
-    
-    return image
+    """
+    带缓存的 create_notebook_image，参数相同时直接返回之前生成的背景
+    返回的图片被多个请求共享，只能读取
+    """
+    key = paper_key(
+        width, height, line_spacing, top_margin, bottom_margin,
+        left_margin, right_margin, font_size, isUnderlined, line_color, paper_type
+    )
+    return background_cache.get(key, lambda: create_notebook_image(
+        width, height, line_spacing, top_margin, bottom_margin,
+        left_margin, right_margin, font_size, isUnderlined, line_color, paper_type
+    ))
 
 
 def read_docx(file_path):
@@ -651,7 +564,12 @@ def generate_handwriting():
         height = int(data["height"])
         font_size = int(data.get("font_size", 0))
         isUnderlined = data.get("isUnderlined", False)
-        background_image = create_notebook_image(
+        background_key = {
+            "width": width, "height": height, "line_spacing": line_spacing,
+            "margins": [top_margin, bottom_margin, left_margin, right_margin],
+            "font_size": font_size, "isUnderlined": isUnderlined,
+        }
+        background_image = notebook_background(
             width,
             height,
             line_spacing,
@@ -676,7 +594,9 @@ def generate_handwriting():
                 ),
                 400,
             )
-        image_data = io.BytesIO(background_image.read())
+        image_bytes = background_image.read()
+        background_key = {"sha256": hashlib.sha256(image_bytes).hexdigest()}
+        image_data = io.BytesIO(image_bytes)
 
         # 使用 PIL 打开图像
         try:
@@ -693,52 +613,11 @@ def generate_handwriting():
     text_to_generate = data["text"]
     
     # 预处理文本：移除可能导致黑色方块的控制字符
-    text_to_generate = clean_text_for_handwrite(text_to_generate)
-
-    # Conditionally adjust spacing for English text based on user setting
+    # Conditionally adjust spacing for English text based on user setting (Chinese text unchanged)
     if data.get("enableEnglishSpacing", "false").lower() == "true":
-        # Only apply to English words, leave Chinese text unchanged
-        import re
-
-        def replace_english_spaces(text):
-            """Replace single spaces with double spaces only for English text, preserving all other whitespace"""
-            # Pattern to identify English characters (including common punctuation, hyphens, underscores)
-            english_pattern = r'^[a-zA-Z0-9.,!?;:\'\"()\-_]+$'
-
-            # Split by lines to preserve newlines
-            lines = text.split('\n')
-            processed_lines = []
-
-            for line in lines:
-                # Only process spaces within each line, preserve tabs and other whitespace
-                # Split only on spaces (not all whitespace)
-                parts = line.split(' ')
-                if len(parts) <= 1:
-                    # No spaces in this line, keep as is
-                    processed_lines.append(line)
-                    continue
-
-                result = []
-                for i, part in enumerate(parts):
-                    result.append(part)
-
-                    # If this isn't the last part, check if we should add double space
-                    if i < len(parts) - 1:
-                        current_is_english = bool(re.match(english_pattern, part)) if part.strip() else False
-                        next_is_english = bool(re.match(english_pattern, parts[i + 1])) if parts[i + 1].strip() else False
-
-                        # Add double space only if both current and next parts are English
-                        if current_is_english and next_is_english:
-                            result.append('  ')  # Double space
-                        else:
-                            result.append(' ')   # Single space
-
-                processed_lines.append(''.join(result))
-
-            # Rejoin with newlines to preserve line structure
-            return '\n'.join(processed_lines)
-
-        text_to_generate = replace_english_spaces(text_to_generate)
+        text_to_generate = clean_text_for_handwrite(text_to_generate, english_spacing_pipeline)
+    else:
+        text_to_generate = clean_text_for_handwrite(text_to_generate)
 
     # if data["preview"] == "true":
     #     # 截短字符，只生成一面
@@ -748,22 +627,25 @@ def generate_handwriting():
     # 从表单中获取字体文件并处理 7.4
     if "font_file" in request.files:
         font = request.files["font_file"].read()
-        font = ImageFont.truetype(io.BytesIO(font), size=int(data["font_size"]))
+        font_key = {"sha256": hashlib.sha256(font).hexdigest()}
+        font = font_pool.get_bytes(font, int(data["font_size"]))
+    elif data.get("font_hash"):
+        # 之前通过 /api/fonts/upload 上传过的字体
+        font_path = font_store.path(data["font_hash"])
+        if font_path is None:
+            return jsonify({"status": "fail", "message": "字体已过期，请重新上传"}), 404
+        font_key = {"sha256": data["font_hash"]}
+        font = font_pool.get(font_path, int(data["font_size"]))
     else:
         font_option = data["font_option"]
         logger.info(f"font_option: {font_option}")
-        logger.info(f"font_file_names: {font_file_names}")
-        if font_option in font_file_names:
-            # 确定字体文件的完整路径
-            font_path = os.path.join("font_assets", font_option)
+        # 确定字体文件的完整路径（只接受注册表中的字体）
+        font_path = font_registry.path(font_option)
+        if font_path is not None:
             logger.info(f"font_path: {font_path}")
-            # 打开字体文件并读取其内容为字节
-            with open(font_path, "rb") as f:
-                font_content = f.read()
-            # 通过 io.BytesIO 创建一个 BytesIO 对象，然后使用 ImageFont.truetype 从字节中加载字体
-            font = ImageFont.truetype(
-                io.BytesIO(font_content), size=int(data["font_size"])
-            )
+            font_key = {"file": font_option, "mtime": os.path.getmtime(font_path)}
+            # 从字体池取解析好的字体，不再每次读取并解析整个字体文件
+            font = font_pool.get(font_path, int(data["font_size"]))
         else:
             return (
                 jsonify(
@@ -809,100 +691,88 @@ def generate_handwriting():
         ink_depth_sigma=float(data["ink_depth_sigma"]),  # 墨水深度随机扰动
     )
 
+    # 过滤字体不支持的字符
+    text_to_generate = filter_unsupported_chars(text_to_generate, font)
+    layout_spec = {
+        "font": font_key,
+        "background": background_key,
+        "template": template_spec(template),
+    }
+    seed, error = parse_seed(data, layout_spec)
+    if error is not None:
+        return error
+    layout_spec["seed"] = seed
+    if data["pdf_save"] != "true" and data["preview"] == "true":
+        # 预览使用低分辨率渲染；seed 在缩放前确定，与正式生成一致
+        scale, error = parse_preview_scale(data)
+        if error is not None:
+            return error
+        template = scale_template(template, scale, spec_key(background_key))
+        layout_spec["template"] = template_spec(template)
+    else:
+        # 正式生成前按排版估算页数，超出上限时拒绝
+        _, error = check_render_admission(text_to_generate, template)
+        if error is not None:
+            return error
+    layout_key = spec_key(layout_spec)
+    spec = dict(layout_spec, text=text_to_generate)
+
     # 创建一个BytesIO对象，用于保存.zip文件的内容
     logger.info(f"data[pdf_save]: {data['pdf_save']}")
     if not data["pdf_save"] == "true":
-        # 过滤字体不支持的字符
-        text_to_generate = filter_unsupported_chars(text_to_generate, font)
-        images = handwrite(text_to_generate, template)
-        logger.info("handwrite initial images generated successfully")
-        # 创建项目内的临时目录，避免使用系统临时目录
-        project_temp_base = "./temp"
-        os.makedirs(project_temp_base, exist_ok=True)
-        temp_dir = tempfile.mkdtemp(dir=project_temp_base)
-        unique_filename = "images_" + str(time.time())
-        zip_path = f"./temp/{unique_filename}.zip"
-        try:
-            for i, im in enumerate(images):
-                # 保存每张图像到临时目录
-                image_path = os.path.join(temp_dir, f"{i}.png")
-
-                # 使用安全保存函数
-                if safe_save_and_close_image(im, image_path):
-                    logger.info(f"Image {i} saved successfully")
-                else:
-                    logger.error(f"Failed to save image {i}")
-
-                del im  # 释放内存
-
-                if data["preview"] == "true":
-                    # 预览模式：读取文件内容到内存，然后清理临时目录
-
-                    with open(image_path, "rb") as f:
-                        image_data = f.read()
-
-                    # 立即清理整个临时目录
-                    # safe_remove_directory(temp_dir)
-
-                    # 从内存发送文件
-                    return send_file(
-                        io.BytesIO(image_data),
-                        mimetype="image/png",
-                        as_attachment=False,
-                    )
+        if data["preview"] == "true":
+            # 预览模式只需要首页，单独缓存
+            pages, render_info = render_png_pages(
+                text_to_generate, template, seed, spec_key(dict(spec, max_pages=1)), layout_key, max_pages=1
+            )
+            response = send_file(
+                io.BytesIO(list(pages)[0]),
+                mimetype="image/png",
+                as_attachment=False,
+            )
+            response.headers["X-Render-Seed"] = str(seed)
+            response.headers["X-Render-Cache"] = "hit" if render_info["cached"] else "miss"
+            return response
 
-            if not data["preview"] == "true":
-                # 创建ZIP文件
-                shutil.make_archive(zip_path[:-4], "zip", temp_dir)
+        pages, render_info = render_png_pages(text_to_generate, template, seed, spec_key(spec), layout_key)
+        logger.info(f"handwrite images: {render_info}")
 
-                # 读取ZIP文件到内存，然后立即删除文件
-                try:
-                    with open(zip_path, "rb") as f:
-                        zip_data = f.read()
-
-                    # 立即删除ZIP文件
-                    safe_remove_file(zip_path)
-
-                    # 从内存发送文件
-                    response = send_file(
-                        io.BytesIO(zip_data),
-                        download_name="images.zip",
-                        mimetype="application/zip",
-                        as_attachment=True,
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to read ZIP file: {e}")
-                    # 降级到直接发送文件
-                    response = send_file(
-                        zip_path,
-                        download_name="images.zip",
-                        mimetype="application/zip",
-                        as_attachment=True,
-                    )
-            return response
-        finally:
-            # 使用改进的安全删除函数
-            safe_remove_directory(temp_dir)
-            # ZIP文件已在上面删除，这里只是保险
+        def zip_stream():
+            # 渲染出一页就打包一页发送给客户端，不写临时目录，也不在内存中保留整个压缩包
+            try:
+                yield from iter_page_zip(pages)
+            finally:
+                # 客户端断开时关闭渲染迭代器以取消剩余页面
+                pages.close()
+
+        response = Response(
+            zip_stream(),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=images.zip", "X-Accel-Buffering": "no"},
+        )
+        response.headers["X-Render-Seed"] = str(seed)
+        response.headers["X-Render-Cache"] = "hit" if render_info["cached"] else "miss"
+        return response
     else:
         logger.info("PDF generate")
-        temp_pdf_file_path = None  # 初始化变量
-        # 过滤字体不支持的字符
-        text_to_generate = filter_unsupported_chars(text_to_generate, font)
-        images = handwrite(text_to_generate, template)
-        try:
-            temp_pdf_file_path = generate_pdf(images=images)
-            # 将文件路径存储在请求上下文中，以便稍后可以访问它
-            request.temp_file_path = temp_pdf_file_path
-            return send_file(
-                temp_pdf_file_path,
-                download_name="images.pdf",
-                mimetype="application/pdf",
-                as_attachment=True,
-                conditional=True,
-            )
-        finally:
-            pass
+        pdf_profile, error = parse_pdf_profile(data)
+        if error is not None:
+            return error
+        # 与 ZIP 下载共用渲染缓存；print 配置下缓存中的 PNG 页面原样嵌入 PDF，不再解码和重新编码，也不写临时文件
+        pages, render_info = render_png_pages(text_to_generate, template, seed, spec_key(spec), layout_key)
+        logger.info(f"handwrite images: {render_info}")
+        pdf_buffer = io.BytesIO()
+        write_pdf(pages, pdf_buffer, pdf_profile)
+        pdf_buffer.seek(0)
+        response = send_file(
+            pdf_buffer,
+            download_name="images.pdf",
+            mimetype="application/pdf",
+            as_attachment=True,
+        )
+        response.headers["X-Render-Seed"] = str(seed)
+        response.headers["X-Render-Cache"] = "hit" if render_info["cached"] else "miss"
+        return response
         #     if temp_pdf_file_path is not None:  # 检查变量是否已赋值
         #         for _ in range(5):  # 尝试5次
         #             try:
@@ -1051,21 +921,23 @@ def imagefileprocess():
         return jsonify({"error": "Invalid file type"}), 400
 
 
-def get_filenames_in_dir(directory):
-    return [
-        f
-        for f in os.listdir(directory)
-        if os.path.isfile(os.path.join(directory, f)) and f.endswith(".ttf")
-    ]
+def conditional_json(payload, etag):
+    """带 ETag 的 JSON 响应，客户端的 If-None-Match 匹配时返回 304"""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    # 允许缓存，但每次使用前都要向服务端确认
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 
 @app.route("/api/fonts_info", methods=["GET"])
 def get_fonts_info():
-    filenames = get_filenames_in_dir("./font_assets")
+    fonts, etag = font_registry.fonts()
+    filenames = [font["filename"] for font in fonts]
     logger.info(f"filenames: {filenames}")
     if filenames == []:
         return jsonify({"error": "fontfile not found"}), 400
-    return jsonify(filenames)
+    return conditional_json(filenames, etag)
 
 
 def mysql_operation(image_data):
@@ -1206,71 +1078,90 @@ def mysql_operation(image_data):
 import base64
 import uuid
 
-# 存储临时下载文件的字典 {file_id: (file_path, expire_time)}
+# 存储临时下载文件的字典 {file_id: (file_path, expire_time, mimetype)}
 temp_download_files = {}
 
+# 下载文件的 file_id（uuid4）
+DOWNLOAD_FILE_ID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
 
-@app.route("/api/miniprogram/preview", methods=["POST"])
-@limiter.limit("200 per 5 minute")
-@handle_exceptions
-def miniprogram_preview():
+
+def find_download_file(file_id):
     """
-    小程序预览接口 - 返回 base64 编码的图片
-    更适合小程序直接展示
+    查找下载文件；其他 worker 进程生成的文件不在 temp_download_files 中，按文件名在 ./temp 中查找，
+    过期时间按文件修改时间计算
+    :return: (file_path, expire_time, mimetype)，找不到时返回 None
     """
-    cpu_usage = psutil.cpu_percent(interval=1)
-    if cpu_usage > 90:
-        return jsonify({"status": "error", "message": "服务器繁忙，请稍后再试"}), 429
+    entry = temp_download_files.get(file_id)
+    if entry is not None or not DOWNLOAD_FILE_ID_RE.match(file_id):
+        return entry
+    for extension, mimetype in (("pdf", "application/pdf"), ("zip", "application/zip")):
+        file_path = os.path.join("./temp", f"{file_id}.{extension}")
+        try:
+            return file_path, os.path.getmtime(file_path) + 3600, mimetype
+        except OSError:
+            continue
+    return None
 
-    data = request.form
-    
-    # 获取用户信息和会员状态
+
+# 小程序渲染接口的必要参数
+MINIPROGRAM_REQUIRED_FIELDS = [
+    "text", "font_size", "line_spacing", "fill",
+    "left_margin", "top_margin", "right_margin", "bottom_margin",
+    "word_spacing", "line_spacing_sigma", "font_size_sigma",
+    "word_spacing_sigma", "perturb_x_sigma", "perturb_y_sigma", "perturb_theta_sigma"
+]
+
+
+def get_miniprogram_user(data):
+    """
+    获取请求对应的用户和会员状态
+    :return: (openid, user, is_vip)，管理员视为VIP
+    """
     openid = request.headers.get("X-Openid") or data.get("openid")
-    use_free_mode = data.get("use_free_mode", "false") == "true"  # 是否使用免费模式
     
     is_vip = False
     user = None
-    user_is_admin = False
     if openid:
         user = get_or_create_user(openid)
         if user:
             is_vip, _, _ = check_user_membership(user)
             # 管理员视为VIP，无限制使用所有功能
-            user_is_admin = is_admin(openid)
-            if user_is_admin:
+            if is_admin(openid):
                 is_vip = True
-    
-    # 验证必要字段
-    required_fields = [
-        "text", "font_size", "line_spacing", "fill",
-        "left_margin", "top_margin", "right_margin", "bottom_margin",
-        "word_spacing", "line_spacing_sigma", "font_size_sigma",
-        "word_spacing_sigma", "perturb_x_sigma", "perturb_y_sigma", "perturb_theta_sigma"
-    ]
-    
-    for field in required_fields:
+    return openid, user, is_vip
+
+
+def prepare_miniprogram_render(data, files, scale=1.0):
+    """
+    校验小程序渲染参数，清理文本并构建 handright 模板
+    :param data: 表单参数
+    :param files: 上传的文件（font_file / background_image）；已上传过的字体和背景图
+                  可分别用 data["font_hash"]、data["background_hash"] 引用
+    :param scale: 渲染缩放比例，小于 1 时为低分辨率预览
+    :return: (render, error)；error 不为 None 时直接作为响应返回，
+             render 包含 text（已清理和过滤的文本）、template、char_count、
+             seed（随机种子）、layout_key（不含文本的布局键）和 spec_key（渲染缓存键）
+    """
+    for field in MINIPROGRAM_REQUIRED_FIELDS:
         if field not in data:
-            return jsonify({"status": "error", "message": f"缺少必要参数: {field}"}), 400
+            return None, (jsonify({"status": "error", "message": f"缺少必要参数: {field}"}), 400)
     
     text_to_generate = data["text"]
     if not text_to_generate.strip():
-        return jsonify({"status": "error", "message": "请输入要生成的文字"}), 400
+        return None, (jsonify({"status": "error", "message": "请输入要生成的文字"}), 400)
     
     # 预处理文本：移除可能导致黑色方块的控制字符
     text_to_generate = clean_text_for_handwrite(text_to_generate)
     
     # 取消对免费模式的字数限制 — 所有用户均可生成全部内容
     char_count = len(text_to_generate.replace('\n', '').replace(' ', ''))
-    need_watermark = False # 预览不再由后端添加水印，改为前端添加
-    
-    logger.info(f"Preview request: is_vip={is_vip}, need_watermark={need_watermark}")
 
     # 处理背景图片
     paper_type = data.get("paper_type", "plain")
     
     # 获取纸张尺寸参数（必须有）
     if "width" not in data or "height" not in data:
-        return jsonify({"status": "error", "message": "请指定纸张宽高"}), 400
+        return None, (jsonify({"status": "error", "message": "请指定纸张宽高"}), 400)
     
     line_spacing = int(data.get("line_spacing", 30))
     top_margin = int(data.get("top_margin", 0))
@@ -1284,37 +1175,53 @@ def miniprogram_preview():
     line_color = data.get("line_color", "red")
     
     # 优先检查是否有上传的自定义背景图片
-    background_file = request.files.get("background_image")
-    if background_file is not None:
-        # 使用上传的背景图片，缩放到用户选择的纸张尺寸
-        image_data = io.BytesIO(background_file.read())
-        background_image = Image.open(image_data)
-        if background_image.mode in ("RGBA", "LA"):
-            background_image = background_image.convert("RGB")
-        # 缩放图片到用户选择的纸张尺寸
-        background_image = background_image.resize((width, height), Image.Resampling.LANCZOS)
+    background_file = files.get("background_image")
+    background_hash = data.get("background_hash")
+    if background_file is not None or background_hash:
+        # 使用上传的背景图片（或之前上传过的背景图的哈希），缩放到用户选择的纸张尺寸；缩放结果按哈希和尺寸缓存
+        if background_file is not None:
+            background_hash, error = background_store.put(background_file.read())
+            if error:
+                return None, (jsonify({"status": "error", "message": error}), 400)
+        background_image = background_store.get(background_hash, width, height)
+        if background_image is None:
+            return None, (jsonify({"status": "error", "message": "背景图已过期，请重新上传"}), 404)
+        background_key = {"sha256": background_hash}
     else:
-        # 没有上传背景图片，使用 create_notebook_image 生成背景
-        background_image = create_notebook_image(
+        # 没有上传背景图片，使用 create_notebook_image 生成的背景（相同参数复用缓存）
+        background_key = {
+            "paper_type": paper_type, "line_color": line_color, "isUnderlined": isUnderlined,
+            "line_spacing": line_spacing, "margins": [top_margin, bottom_margin, left_margin, right_margin],
+            "font_size": font_size,
+        }
+        background_image = notebook_background(
             width, height, line_spacing, top_margin, bottom_margin,
             left_margin, right_margin, font_size, isUnderlined, line_color, paper_type
         )
     
     # 处理字体
-    if "font_file" in request.files:
-        font_data = request.files["font_file"].read()
-        font = ImageFont.truetype(io.BytesIO(font_data), size=int(data["font_size"]))
+    if "font_file" in files:
+        font_data = files["font_file"].read()
+        font_key = {"sha256": hashlib.sha256(font_data).hexdigest()}
+        font = font_pool.get_bytes(font_data, int(data["font_size"]))
+    elif data.get("font_hash"):
+        font_path = font_store.path(data["font_hash"])
+        if font_path is None:
+            return None, (jsonify({"status": "error", "message": "字体已过期，请重新上传"}), 404)
+        font_key = {"sha256": data["font_hash"]}
+        font = font_pool.get(font_path, int(data["font_size"]))
     elif "font_option" in data and data["font_option"]:
-        font_path = os.path.join("./font_assets", data["font_option"])
-        if os.path.exists(font_path):
-            font = ImageFont.truetype(font_path, size=int(data["font_size"]))
+        font_path = font_registry.path(data["font_option"])
+        if font_path is not None:
+            font_key = {"file": data["font_option"], "mtime": os.path.getmtime(font_path)}
+            font = font_pool.get(font_path, int(data["font_size"]))
         else:
-            return jsonify({"status": "error", "message": f"字体不存在: {data['font_option']}"}), 400
+            return None, (jsonify({"status": "error", "message": f"字体不存在: {data['font_option']}"}), 400)
     else:
-        return jsonify({"status": "error", "message": "请选择字体"}), 400
+        return None, (jsonify({"status": "error", "message": "请选择字体"}), 400)
     
     # 确定是否使用网格布局（方格纸模式）
-    use_grid_layout = paper_type == "grid"
+    use_grid_layout = paper_type in GRID_PAPER_TYPES
     features = {Feature.GRID_LAYOUT} if use_grid_layout else set()
     
     # 方格纸模式下，行间距需要与格子大小一致
@@ -1346,41 +1253,508 @@ def miniprogram_preview():
         features=features,
     )
     
-    # 生成图片
     # 过滤字体不支持的字符
     text_to_generate = filter_unsupported_chars(text_to_generate, font)
-    images = list(handwrite(text_to_generate, template))
+
+    # 规范化的渲染参数：未指定 seed 时由布局参数哈希推导，相同参数总是得到相同结果，便于缓存；
+    # 修改文本不改变 seed，才能沿用未改动的页面
+    layout_spec = {
+        "font": font_key,
+        "background": background_key,
+        "template": template_spec(template),
+    }
+    seed, error = parse_seed(data, layout_spec)
+    if error is not None:
+        return None, error
+    layout_spec["seed"] = seed
+    if scale < 1:
+        # seed 在缩放前确定，预览与正式生成的随机扰动一致
+        template = scale_template(template, scale, spec_key(background_key))
+        layout_spec["template"] = template_spec(template)
+
+    return {
+        "text": text_to_generate,
+        "template": template,
+        "char_count": char_count,
+        "seed": seed,
+        "layout_key": spec_key(layout_spec),
+        "spec_key": spec_key(dict(layout_spec, text=text_to_generate)),
+    }, None
+
+
+def parse_seed(data, spec):
+    """
+    读取请求中的随机种子，未指定时由渲染参数（不含文本）推导
+    :return: (seed, error)
+    """
+    if data.get("seed", "") == "":
+        return seed_from_key(spec_key(spec)), None
+    try:
+        return int(data["seed"]), None
+    except ValueError:
+        return None, (jsonify({"status": "error", "message": "seed 必须是整数"}), 400)
+
+
+def check_render_admission(text, template):
+    """
+    正式生成前按排版估算页数，超过 RENDER_MAX_PAGES 时拒绝
+    :return: (estimate, error)；RENDER_MAX_PAGES 为 0（不限制）时不排版，返回 (None, None)
+    """
+    if not RENDER_MAX_PAGES:
+        return None, None
+    estimate = estimate_layout(text, template)
+    if RENDER_MAX_PAGES and estimate["pages"] > RENDER_MAX_PAGES:
+        message = f"文本过长，预计 {estimate['pages']} 页，超过单次生成上限 {RENDER_MAX_PAGES} 页"
+        return estimate, (jsonify({"status": "error", "message": message, "estimate": estimate}), 413)
+    return estimate, None
+
+
+def parse_preview_scale(data):
+    """
+    读取预览缩放比例 preview_scale，范围 (0, 1]，未指定时使用 PREVIEW_SCALE
+    :return: (scale, error)
+    """
+    if data.get("preview_scale", "") == "":
+        return PREVIEW_SCALE, None
+    try:
+        scale = float(data["preview_scale"])
+    except ValueError:
+        scale = 0
+    if not 0 < scale <= 1:
+        return None, (jsonify({"status": "error", "message": "preview_scale 必须在 0 到 1 之间"}), 400)
+    return scale, None
+
+
+def parse_image_output(data):
+    """
+    读取小程序页面图片的输出格式 image_format（见 IMAGE_FORMATS，默认 png）和有损格式的质量 image_quality；
+    客户端通过请求头 Accept 包含 image/webp 或参数 accept_webp=true 声明支持 WebP，只影响 auto
+    :return: (output, error)，output 为 {"format", "quality", "webp"}
+    """
+    image_format = data.get("image_format", "") or "png"
+    if image_format not in IMAGE_FORMATS:
+        return None, (jsonify({"status": "error", "message": f"image_format 必须是 {'/'.join(IMAGE_FORMATS)} 之一"}), 400)
+    quality = None
+    if image_format in ("webp", "jpeg", "auto"):
+        try:
+            quality = int(data.get("image_quality", "") or IMAGE_QUALITY)
+        except ValueError:
+            quality = 0
+        if not 1 <= quality <= 100:
+            return None, (jsonify({"status": "error", "message": "image_quality 必须在 1 到 100 之间"}), 400)
+    webp = False
+    if image_format == "auto":
+        webp = "image/webp" in request.headers.get("Accept", "") or data.get("accept_webp", "false") == "true"
+    return {"format": image_format, "quality": quality, "webp": webp}, None
+
+
+def parse_pdf_profile(data):
+    """
+    读取 PDF 输出配置 pdf_profile（print / screen / compact，见 pdf.PDF_PROFILES），未指定时使用 PDF_PROFILE
+    :return: (profile, error)
+    """
+    profile = data.get("pdf_profile", "") or PDF_PROFILE
+    if profile not in PDF_PROFILES:
+        return None, (jsonify({"status": "error", "message": f"pdf_profile 必须是 {'/'.join(PDF_PROFILES)} 之一"}), 400)
+    return profile, None
+
+
+def parse_image_delivery(data):
+    """
+    读取页面的返回方式 image_delivery：base64（默认，JSON 中直接返回 data URL）
+    或 url（页面存入 page_store，JSON 中只返回每页的下载地址和元数据）
+    :return: (delivery, error)
+    """
+    delivery = data.get("image_delivery", "") or "base64"
+    if delivery not in ("base64", "url"):
+        return None, (jsonify({"status": "error", "message": "image_delivery 必须是 base64 或 url"}), 400)
+    return delivery, None
+
+
+def page_entry(page):
+    """把编码后的页面存入 page_store，返回下载地址和元数据"""
+    digest = page_store.put(page)
+    return {"url": f"/api/miniprogram/pages/{digest}", "bytes": len(page), "mimetype": image_mimetype(page)}
+
+
+def output_key(key, output):
+    """把输出格式计入渲染缓存键和布局键；PNG 输出沿用原来的键"""
+    if key is None or output is None or output["format"] == "png":
+        return key
+    return spec_key(dict(output, key=key))
+
+
+def encode_page(im, output=None):
+    """按输出格式编码一页图片，output 为 None 时编码为 PNG"""
+    if output is None:
+        return encode_page_png(im)
+    return page_encoder.encode(im, output["format"], output["quality"] or IMAGE_QUALITY, output["webp"])
+
+
+def image_bytes_report(pages):
+    """编码后页面的总字节数，以及同样像素按未压缩 RGB 计算的字节数（仅供参考，不是相对 PNG 的节省）"""
+    encoded = raw = 0
+    for page in pages:
+        width, height = Image.open(io.BytesIO(page)).size
+        encoded += len(page)
+        raw += width * height * 3
+    return {"imageBytes": encoded, "rawImageBytes": raw}
+
+
+def render_png_pages(text, template, seed, cache_key, layout_key=None, max_pages=None, output=None):
+    """
+    逐页渲染并编码（默认为 PNG），完整迭代后写入渲染缓存
+    命中缓存时不再渲染；相同参数正在渲染时等待并共享其结果；否则复用同一布局下最近渲染过的文档中
+    排版不变的前几页，只从第一处改动所在页开始渲染
+    :param layout_key: 不含文本的布局键，为 None 时不做增量渲染
+    :param max_pages: 只渲染前几页（调用方需把它计入 cache_key）
+    :param output: parse_image_output 得到的输出格式（调用方需用 output_key 把它计入 cache_key 和 layout_key）
+    :return: (pages, info)，pages 为逐页编码后数据的迭代器，
+             info 为 {"cached": 是否命中缓存, "coalesced": 是否合并到进行中的渲染, "reused": 复用的页数}
+    """
+    cached_pages = render_cache.get(cache_key)
+    if cached_pages is not None:
+        return (page for page in cached_pages), {"cached": True, "coalesced": False, "reused": len(cached_pages)}
+
+    # 准备工作在加入合并之前完成，出错时不会留下无人结束的渲染
+    layout, reused = None, []
+    if layout_key is not None:
+        layout, reused = layout_history.resume(layout_key, text)
+    if layout is None:
+        layout = PageLayout(text)
+    if max_pages:
+        reused = reused[:max_pages]
+
+    def rendered_pages(flight=None):
+        """从可复用的页面开始渲染，完整迭代后写入缓存；flight 不为 None 时逐页发布给合并的请求"""
+        pages = []
+        for page in reused:
+            pages.append(page)
+            if flight is not None:
+                render_flight.publish(flight, page)
+            yield page
+        if not max_pages or len(pages) < max_pages:
+            images = render_pages(text, template, seed=seed, layout=layout)
+            try:
+                for im in images:
+                    page = encode_page(im, output)
+                    im.close()
+                    pages.append(page)
+                    if flight is not None:
+                        render_flight.publish(flight, page)
+                    yield page
+                    if max_pages and len(pages) >= max_pages:
+                        break
+            finally:
+                images.close()
+        render_cache.put(cache_key, pages)
+        if layout_key is not None:
+            layout_history.put(layout_key, layout, cache_key)
+
+    def flight_pages():
+        # 在迭代开始时才加入合并，加入和结束在同一个 try/finally 中；未开始迭代就关闭的迭代器不会加入
+        flight, leader = render_flight.join(cache_key)
+        if not leader:
+            sent = 0
+            for page in render_flight.follow(flight):
+                sent += 1
+                yield page
+            if not flight.ok:
+                # 负责渲染的请求中途放弃或等待超时，自己渲染剩余的页面（相同 seed 结果一致），不再加入合并
+                pages = rendered_pages()
+                try:
+                    for i, page in enumerate(pages):
+                        if i >= sent:
+                            yield page
+                finally:
+                    pages.close()
+            return
+
+        ok = False
+        try:
+            # 可能在加入前另一个请求刚好完成渲染
+            cached_pages = render_cache.get(cache_key)
+            if cached_pages is None:
+                yield from rendered_pages(flight)
+            else:
+                for page in cached_pages:
+                    render_flight.publish(flight, page)
+            ok = True
+        finally:
+            render_flight.finish(cache_key, flight, ok)
+        if cached_pages is not None:
+            yield from cached_pages
+
+    # coalesced 和 reused 按调用时的状态估计，开始迭代前进行中的渲染可能已经结束
+    coalesced = render_flight.active(cache_key)
+    return flight_pages(), {"cached": False, "coalesced": coalesced, "reused": 0 if coalesced else len(reused)}
+
+
+def encode_page_png(im):
+    """把一页图片编码为 PNG（按页面颜色选择 1 位、调色板、灰度或 RGB 模式）"""
+    return page_encoder.encode(im)
+
+
+def page_data_url(page):
+    """编码后页面的 data URL，MIME 类型按文件头识别"""
+    img_base64 = base64.b64encode(page).decode("utf-8")
+    return f"data:{image_mimetype(page)};base64,{img_base64}"
+
+
+# 预热渲染使用的参数，与小程序和网页版的默认设置一致（A4、红色横线纸、字号 90）
+WARMUP_FORM = {
+    "text": "春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。\nThe quick brown fox jumps over the lazy dog. 0123456789",
+    "width": "2480", "height": "3508", "font_size": "90", "line_spacing": "120", "fill": "(0, 0, 0, 255)",
+    "left_margin": "150", "top_margin": "150", "right_margin": "150", "bottom_margin": "150",
+    "word_spacing": "-10", "line_spacing_sigma": "1", "font_size_sigma": "1", "word_spacing_sigma": "1",
+    "perturb_x_sigma": "1", "perturb_y_sigma": "1", "perturb_theta_sigma": "0.05",
+    "isUnderlined": "true", "line_color": "red", "paper_type": "lined",
+}
+
+
+# 小程序的纸张尺寸和纸张类型预设（与 miniprogram/pages/index/index.js 一致）
+PAPER_SIZES = {
+    "A4": (2480, 3508),
+    "A3": (3508, 4961),
+    "A5": (1748, 2480),
+    "B4": (2953, 4169),
+    "B5": (2079, 2953),
+    "Letter": (2550, 3300),
+}
+PAPER_PRESETS = [
+    {"paper_type": "lined", "line_color": "red", "isUnderlined": "true"},
+    {"paper_type": "lined", "line_color": "green", "isUnderlined": "true"},
+    {"paper_type": "lined", "line_color": "blue", "isUnderlined": "true"},
+    {"paper_type": "grid", "line_color": "red", "isUnderlined": "false"},
+    {"paper_type": "plain", "line_color": "red", "isUnderlined": "false"},
+]
+# 启动时预先生成背景的纸张尺寸（逗号分隔），每种尺寸生成全部纸张类型
+BACKGROUND_PREWARM_SIZES = [
+    size.strip() for size in os.getenv("BACKGROUND_PREWARM_SIZES", "A4").split(",") if size.strip() in PAPER_SIZES
+]
+
+
+def prewarm_backgrounds(sizes=BACKGROUND_PREWARM_SIZES):
+    """按小程序默认的行距、边距和字号生成预设纸张的背景并放入缓存"""
+    for size in sizes:
+        width, height = PAPER_SIZES[size]
+        for preset in PAPER_PRESETS:
+            notebook_background(
+                width, height, int(WARMUP_FORM["line_spacing"]),
+                int(WARMUP_FORM["top_margin"]), int(WARMUP_FORM["bottom_margin"]),
+                int(WARMUP_FORM["left_margin"]), int(WARMUP_FORM["right_margin"]),
+                int(WARMUP_FORM["font_size"]), preset["isUnderlined"], preset["line_color"], preset["paper_type"],
+            )
+
+
+def warm_up(render=WARMUP_RENDER):
+    """
+    启动预热：加载所有预设字体到字体池，编译字符覆盖过滤规则，生成预设纸张背景，
+    并用默认参数试渲染一页（预览和原始分辨率），
+    让字形缓存、handright 和 PNG 编码路径在第一个真实请求之前就绪。
+    使用 gunicorn preload 时在 fork 之前调用：字体文件由 FreeType 通过 mmap 映射，解析好的字体对象和
+    各级缓存在 worker 之间写时复制共享
+    """
+    start = time.time()
+    fonts, _ = font_registry.fonts()
+    font_size = int(WARMUP_FORM["font_size"])
+    for info in fonts:
+        font = font_pool.get(font_registry.path(info["filename"]), font_size)
+        font_coverage.filter_text("", font)
+    prewarm_backgrounds()
+    if render and fonts:
+        form = dict(WARMUP_FORM, font_option=fonts[0]["filename"])
+        with app.app_context():
+            for scale in (PREVIEW_SCALE, 1.0):
+                prepared, error = prepare_miniprogram_render(form, {}, scale=scale)
+                if error:
+                    logger.warning(f"预热渲染参数无效: {error[0].get_json()}")
+                    break
+                for im in render_pages(prepared["text"], prepared["template"], seed=prepared["seed"]):
+                    encode_page_png(im)
+    logger.info(f"预热完成: {len(fonts)} 个字体，耗时 {time.time() - start:.2f} 秒")
+
+
+@app.route("/api/miniprogram/preview", methods=["POST"])
+@limiter.limit("200 per 5 minute")
+@handle_exceptions
+def miniprogram_preview():
+    """
+    小程序预览接口 - 返回 base64 编码的图片
+    更适合小程序直接展示；图片格式由 image_format（png/webp/webp_lossless/jpeg/auto）和 image_quality 指定，
+    返回数据中的 imageBytes 为编码后的总字节数，rawImageBytes 为未压缩 RGB 像素的字节数；
+    image_delivery=url 时不返回 images，改为 pages（每页的 url、bytes、mimetype），图片从 url 单独下载
+    """
+    cpu_usage = psutil.cpu_percent(interval=1)
+    if cpu_usage > 90:
+        return jsonify({"status": "error", "message": "服务器繁忙，请稍后再试"}), 429
+
+    data = request.form
     
-    # 非会员添加水印（实际实现已移除）
-    if need_watermark:
-        images = add_watermark_to_images(images)
+    # 获取用户信息和会员状态
+    openid, user, is_vip = get_miniprogram_user(data)
+
+    # 预览按比例缩小渲染，正式生成时才使用原始分辨率
+    scale, error = parse_preview_scale(data)
+    if error is not None:
+        return error
+    output, error = parse_image_output(data)
+    if error is not None:
+        return error
+    delivery, error = parse_image_delivery(data)
+    if error is not None:
+        return error
+    render, error = prepare_miniprogram_render(data, request.files, scale)
+    if error is not None:
+        return error
+    char_count = render["char_count"]
+    need_watermark = False # 预览不再由后端添加水印，改为前端添加
+    
+    logger.info(f"Preview request: is_vip={is_vip}, need_watermark={need_watermark}")
+    
+    # 生成图片（相同参数直接返回缓存的页面，修改文本后只重新渲染改动所在页及之后的页面）
+    pages, render_info = render_png_pages(
+        render["text"], render["template"], render["seed"],
+        output_key(render["spec_key"], output), output_key(render["layout_key"], output), output=output
+    )
+    pages = list(pages)
     
     # 记录使用日志（has_watermark 固定为 False，因为已移除水印）
     user_id = user['id'] if user else None
     log_usage(user_id, openid, 'preview', char_count, False)
     
-    # 生成所有页面的 base64 图片
-    image_list = []
-    for i, im in enumerate(images):
-        img_buffer = io.BytesIO()
-        im.save(img_buffer, format="PNG")
-        img_buffer.seek(0)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
-        image_list.append(f"data:image/png;base64,{img_base64}")
-        im.close()
-    
-    if image_list:
-        return jsonify({
+    if pages:
+        result = {
             "status": "success",
-            "images": image_list,
-            "total": len(image_list),
+            "total": len(pages),
             "charCount": char_count,
-            "message": f"预览生成成功，共 {len(image_list)} 页"
-        })
+            "seed": render["seed"],
+            "scale": scale,
+            "cached": render_info["cached"],
+            "coalesced": render_info["coalesced"],
+            "reusedPages": render_info["reused"],
+            "imageFormat": output["format"],
+            **image_bytes_report(pages),
+            "message": f"预览生成成功，共 {len(pages)} 页"
+        }
+        if delivery == "url":
+            # 每页单独下载，客户端拿到第一页的地址即可开始加载
+            result["pages"] = [page_entry(page) for page in pages]
+        else:
+            # 生成所有页面的 base64 图片
+            result["images"] = [page_data_url(page) for page in pages]
+        return jsonify(result)
     
     return jsonify({"status": "error", "message": "生成失败"}), 500
 
 
+@app.route("/api/miniprogram/preview/stream", methods=["POST"])
+@limiter.limit("200 per 5 minute")
+@handle_exceptions
+def miniprogram_preview_stream():
+    """
+    小程序流式预览接口 - 每渲染完一页立即推送该页，首页到达时间与文档长度无关
+    默认返回 NDJSON（每行一个 JSON 对象），请求头 Accept 包含 text/event-stream 时返回 SSE
+    消息类型：page（index, image）、done（total, charCount, seed, scale, imageFormat, imageBytes 等）、error（message）
+    图片格式和返回方式参数与预览接口相同（image_format / image_quality / accept_webp / image_delivery），
+    image_delivery=url 时 page 消息不含 image，改为该页的 url、bytes、mimetype
+    客户端断开后停止渲染剩余页面
+    """
+    cpu_usage = psutil.cpu_percent(interval=1)
+    if cpu_usage > 90:
+        return jsonify({"status": "error", "message": "服务器繁忙，请稍后再试"}), 429
+
+    data = request.form
+    openid, user, is_vip = get_miniprogram_user(data)
+
+    scale, error = parse_preview_scale(data)
+    if error is not None:
+        return error
+    output, error = parse_image_output(data)
+    if error is not None:
+        return error
+    delivery, error = parse_image_delivery(data)
+    if error is not None:
+        return error
+    render, error = prepare_miniprogram_render(data, request.files, scale)
+    if error is not None:
+        return error
+    char_count = render["char_count"]
+
+    user_id = user['id'] if user else None
+    log_usage(user_id, openid, 'preview', char_count, False)
+
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+
+    def format_message(message):
+        payload = json.dumps(message, ensure_ascii=False)
+        if use_sse:
+            return f"event: {message['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    def page_stream():
+        pages, render_info = render_png_pages(
+            render["text"], render["template"], render["seed"],
+            output_key(render["spec_key"], output), output_key(render["layout_key"], output), output=output
+        )
+        total = 0
+        sent = []
+        try:
+            for i, page in enumerate(pages):
+                total = i + 1
+                sent.append(page)
+                if delivery == "url":
+                    yield format_message(dict(page_entry(page), type="page", index=i))
+                else:
+                    yield format_message({"type": "page", "index": i, "image": page_data_url(page)})
+            yield format_message({
+                "type": "done", "total": total, "charCount": char_count, "seed": render["seed"], "scale": scale,
+                "cached": render_info["cached"], "coalesced": render_info["coalesced"],
+                "reusedPages": render_info["reused"], "imageFormat": output["format"],
+                **image_bytes_report(sent),
+            })
+        except GeneratorExit:
+            # 客户端已断开，关闭渲染迭代器以取消剩余页面
+            logger.info(f"流式预览客户端断开，已发送 {total} 页")
+            raise
+        except Exception as e:
+            logger.error(f"流式预览生成失败: {e}")
+            yield format_message({"type": "error", "message": f"生成失败: {str(e)}"})
+        finally:
+            pages.close()
+
+    return Response(
+        page_stream(),
+        mimetype="text/event-stream" if use_sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/miniprogram/estimate", methods=["POST"])
+@limiter.limit("300 per 5 minute")
+@handle_exceptions
+def miniprogram_estimate():
+    """
+    小程序估算接口 - 只排版不渲染，返回页数、字数和预计渲染耗时
+    参数与生成接口相同，可用于生成前提示用户和计费
+    """
+    data = request.form
+    render, error = prepare_miniprogram_render(data, request.files)
+    if error is not None:
+        return error
+
+    estimate = estimate_layout(render["text"], render["template"])
+    return jsonify({
+        "status": "success",
+        "pages": estimate["pages"],
+        "lines": estimate["lines"],
+        "charCount": render["char_count"],
+        "estimatedSeconds": estimate["estimated_seconds"],
+        "maxPages": RENDER_MAX_PAGES,
+        "allowed": not RENDER_MAX_PAGES or estimate["pages"] <= RENDER_MAX_PAGES,
+    })
+
+
 @app.route("/api/miniprogram/generate", methods=["POST"])
 @limiter.limit("100 per 5 minute")
 @handle_exceptions
@@ -1396,36 +1770,30 @@ def miniprogram_generate():
     data = request.form
     
     # 获取用户信息和会员状态
-    openid = request.headers.get("X-Openid") or data.get("openid")
+    openid, user, is_vip = get_miniprogram_user(data)
     use_free_mode = data.get("use_free_mode", "false") == "true"  # 是否使用免费模式
-    
-    is_vip = False
-    user = None
-    user_is_admin = False
-    if openid:
-        user = get_or_create_user(openid)
-        if user:
-            is_vip, _, _ = check_user_membership(user)
-            # 管理员视为VIP，无限制使用所有功能
-            user_is_admin = is_admin(openid)
-            if user_is_admin:
-                is_vip = True
-    
-    # 验证必要字段
-    required_fields = [
-        "text", "font_size", "line_spacing", "fill",
-        "left_margin", "top_margin", "right_margin", "bottom_margin",
-        "word_spacing", "line_spacing_sigma", "font_size_sigma",
-        "word_spacing_sigma", "perturb_x_sigma", "perturb_y_sigma", "perturb_theta_sigma"
-    ]
-    
-    for field in required_fields:
-        if field not in data:
-            return jsonify({"status": "error", "message": f"缺少必要参数: {field}"}), 400
-    
-    text_to_generate = data["text"]
-    if not text_to_generate.strip():
-        return jsonify({"status": "error", "message": "请输入要生成的文字"}), 400
+
+    # 图片模式和 ZIP 中页面的图片格式，以及图片模式的返回方式
+    output, error = parse_image_output(data)
+    if error is not None:
+        return error
+    delivery, error = parse_image_delivery(data)
+    if error is not None:
+        return error
+    pdf_profile, error = parse_pdf_profile(data)
+    if error is not None:
+        return error
+    render, error = prepare_miniprogram_render(data, request.files)
+    if error is not None:
+        return error
+    text_to_generate = render["text"]
+    template = render["template"]
+    char_count = render["char_count"]
+
+    # 先估算页数，超出上限时在扣除相思豆之前拒绝
+    estimate, error = check_render_admission(text_to_generate, template)
+    if error is not None:
+        return error
     
     # 验证相思豆（如果提供了）
     loveseed_code = data.get("loveseed_code")
@@ -1435,9 +1803,8 @@ def miniprogram_generate():
             loveseed = verify_loveseed_code(loveseed_code)
             if loveseed:
                 # 扣除次数
-                consume_loveseed_download(loveseed_code, openid, 'generate_pdf' if data.get("pdf_save", "false") == "true" else 'generate_image', len(text_to_generate))
+                consume_loveseed_download(loveseed_code, openid, 'generate_pdf' if data.get("pdf_save", "false") == "true" else 'generate_image', len(data["text"]))
                 is_vip = True  # 相思豆有效，视为VIP（无水印）
-                need_watermark = False
         except Exception as e:
             logger.error(f"相思豆验证失败: {e}")
             return jsonify({"status": "error", "message": str(e)}), 400
@@ -1449,219 +1816,266 @@ def miniprogram_generate():
         if not data.get("preview", "false") == "true": # 如果不是预览
              return jsonify({"status": "error", "message": "请先获取相思豆"}), 402
 
-    # 预处理文本：移除可能导致黑色方块的控制字符
-    text_to_generate = clean_text_for_handwrite(text_to_generate)
-    
-    # 取消对免费模式的字数限制 — 所有用户均可生成全部内容
-    char_count = len(text_to_generate.replace('\n', '').replace(' ', ''))
     need_watermark = not is_vip  # 非会员仍然会看到水印
     
     zip_mode = data.get("zip_save", "false") == "true"
     pdf_mode = data.get("pdf_save", "false") == "true"
-    paper_type = data.get("paper_type", "plain")
-    
-    # 获取纸张尺寸参数（必须有）
-    if "width" not in data or "height" not in data:
-        return jsonify({"status": "error", "message": "请指定纸张宽高"}), 400
-    
-    line_spacing = int(data.get("line_spacing", 30))
-    top_margin = int(data.get("top_margin", 0))
-    bottom_margin = int(data.get("bottom_margin", 0))
-    left_margin = int(data.get("left_margin", 0))
-    right_margin = int(data.get("right_margin", 0))
-    width = int(data["width"])
-    height = int(data["height"])
-    font_size = int(data.get("font_size", 0))
-    isUnderlined = data.get("isUnderlined", "false") == "true"
-    line_color = data.get("line_color", "red")
-    
-    # 优先检查是否有上传的自定义背景图片
-    background_file = request.files.get("background_image")
-    if background_file is not None:
-        # 使用上传的背景图片，缩放到用户选择的纸张尺寸
-        image_data = io.BytesIO(background_file.read())
-        background_image = Image.open(image_data)
-        if background_image.mode in ("RGBA", "LA"):
-            background_image = background_image.convert("RGB")
-        # 缩放图片到用户选择的纸张尺寸
-        background_image = background_image.resize((width, height), Image.Resampling.LANCZOS)
-    else:
-        # 没有上传背景图片，使用 create_notebook_image 生成背景
-        background_image = create_notebook_image(
-            width, height, line_spacing, top_margin, bottom_margin,
-            left_margin, right_margin, font_size, isUnderlined, line_color, paper_type
-        )
-    
-    # 确定是否使用网格布局（方格纸模式）
-    use_grid_layout = paper_type == "grid"
-    features = {Feature.GRID_LAYOUT} if use_grid_layout else set()
-    
-    # 处理字体
-    if "font_file" in request.files:
-        font_data = request.files["font_file"].read()
-        font = ImageFont.truetype(io.BytesIO(font_data), size=int(data["font_size"]))
-    elif "font_option" in data and data["font_option"]:
-        font_path = os.path.join("./font_assets", data["font_option"])
-        if os.path.exists(font_path):
-            font = ImageFont.truetype(font_path, size=int(data["font_size"]))
-        else:
-            return jsonify({"status": "error", "message": f"字体不存在: {data['font_option']}"}), 400
-    else:
-        return jsonify({"status": "error", "message": "请选择字体"}), 400
-    
-    # 方格纸模式下，行间距需要与格子大小一致
-    grid_cell_size = int(int(data["font_size"]) * 1.15) if use_grid_layout else int(data["line_spacing"])
-    
-    # 创建模板
-    template = Template(
-        background=background_image,
-        font=font,
-        line_spacing=grid_cell_size,
-        left_margin=int(data["left_margin"]),
-        top_margin=int(data["top_margin"]),
-        right_margin=int(data["right_margin"]) - int(data.get("word_spacing", 0)) * 2 if not use_grid_layout else int(data["right_margin"]),
-        bottom_margin=int(data["bottom_margin"]),
-        word_spacing=int(data.get("word_spacing", 0)) if not use_grid_layout else 0,
-        line_spacing_sigma=int(data["line_spacing_sigma"]) if not use_grid_layout else 0,
-        font_size_sigma=int(data["font_size_sigma"]) if not use_grid_layout else 0,
-        word_spacing_sigma=int(data["word_spacing_sigma"]) if not use_grid_layout else 0,
-        end_chars="，。" if not use_grid_layout else "",
-        perturb_x_sigma=int(data["perturb_x_sigma"]) if not use_grid_layout else 2,
-        perturb_y_sigma=int(data["perturb_y_sigma"]) if not use_grid_layout else 2,
-        perturb_theta_sigma=float(data["perturb_theta_sigma"]),
-        strikethrough_probability=float(data.get("strikethrough_probability", 0)),
-        strikethrough_length_sigma=float(data.get("strikethrough_length_sigma", 0)),
-        strikethrough_width_sigma=float(data.get("strikethrough_width_sigma", 0)),
-        strikethrough_angle_sigma=float(data.get("strikethrough_angle_sigma", 0)),
-        strikethrough_width=float(data.get("strikethrough_width", 1)),
-        ink_depth_sigma=float(data.get("ink_depth_sigma", 0)),
-        features=features,
-    )
-    
-    # 生成图片
-    # 过滤字体不支持的字符
-    text_to_generate = filter_unsupported_chars(text_to_generate, font)
-    images = list(handwrite(text_to_generate, template))
-    
-    # 非会员添加水印（实际实现已移除）
-    if need_watermark:
-        images = add_watermark_to_images(images)
 
     # 记录使用日志（has_watermark 固定为 False，因为已移除水印）
     user_id = user['id'] if user else None
     action_type = 'generate_pdf' if data.get("pdf_save", "false") == "true" else 'generate_image'
     log_usage(user_id, openid, action_type, char_count, False)
-    
-    # 创建临时目录
-    project_temp_base = "./temp"
-    os.makedirs(project_temp_base, exist_ok=True)
-    temp_dir = tempfile.mkdtemp(dir=project_temp_base)
-    
-    try:
-        image_paths = []
-        for i, im in enumerate(images):
-            image_path = os.path.join(temp_dir, f"{i}.png")
-            if safe_save_and_close_image(im, image_path):
-                image_paths.append(image_path)
-            del im
-        
-        # 生成文件ID
-        file_id = str(uuid.uuid4())
-        
-        if pdf_mode:
-            # 生成 PDF
-            pdf_path = os.path.join(project_temp_base, f"{file_id}.pdf")
-            generate_pdf(image_paths, pdf_path)
-            file_path = pdf_path
-            file_type = "pdf"
-            mimetype = "application/pdf"
-            
-            # 存储文件信息（1小时后过期）
-            expire_time = time.time() + 3600
-            temp_download_files[file_id] = (file_path, expire_time, mimetype)
-            
-            # 清理临时图片目录
-            safe_remove_directory(temp_dir)
-            
-            return jsonify({
-                "status": "success",
-                "file_id": file_id,
-                "file_type": file_type,
-                "download_url": f"/api/miniprogram/download/{file_id}",
-                "page_count": len(image_paths),
-                "expires_in": 3600,
-                "message": "PDF生成成功，请在1小时内下载"
-            })
-        elif zip_mode:
-            # 生成 ZIP
-            zip_path = os.path.join(project_temp_base, f"{file_id}.zip")
-            with zipfile.ZipFile(zip_path, 'w') as zf:
-                for i, image_path in enumerate(image_paths):
-                    zf.write(image_path, f"page_{i+1}.png")
-            
-            file_path = zip_path
-            file_type = "zip"
-            mimetype = "application/zip"
-            
-            # 存储文件信息（1小时后过期）
-            expire_time = time.time() + 3600
-            temp_download_files[file_id] = (file_path, expire_time, mimetype)
-            
-            # 清理临时图片目录
-            safe_remove_directory(temp_dir)
-            
-            return jsonify({
-                "status": "success",
-                "file_id": file_id,
-                "file_type": file_type,
-                "download_url": f"/api/miniprogram/download/{file_id}",
-                "page_count": len(image_paths),
-                "expires_in": 3600,
-                "message": "图片打包成功，请在1小时内下载"
-            })
+
+    def render_output(job=None):
+        # 生成图片；后台任务模式下不限制提前排版的页数，以便尽早确定总页数上报进度
+        if job is not None:
+            images = render_pages(
+                text_to_generate, template, seed=render["seed"], lookahead=0, on_total=job.set_total
+            )
         else:
-            # 返回 base64 图片数组（用于保存到相册）
-            image_list = []
-            for image_path in image_paths:
-                with open(image_path, "rb") as f:
-                    img_base64 = base64.b64encode(f.read()).decode("utf-8")
-                    image_list.append(f"data:image/png;base64,{img_base64}")
-            
-            # 清理临时图片目录
-            safe_remove_directory(temp_dir)
-            
-            return jsonify({
-                "status": "success",
-                "images": image_list,
-                "page_count": len(image_list),
-                "message": f"图片生成成功，共 {len(image_list)} 页"
-            })
-        
+            images = render_pages(text_to_generate, template, seed=render["seed"])
+
+        # 非会员添加水印（实际实现已移除）
+        if need_watermark:
+            images = (add_watermark_to_image(im) for im in images)
+
+        on_page = job.advance if job is not None else None
+        return build_miniprogram_output(
+            images, pdf_mode, zip_mode, on_page=on_page, output=output, delivery=delivery,
+            pdf_profile=pdf_profile
+        )
+
+    # 异步模式：提交到后台渲染队列，立即返回任务ID
+    if data.get("async", "false") == "true":
+        if estimate is None:
+            # 未限制页数时准入检查没有排版，返回的预计页数和耗时在这里估算
+            estimate = estimate_layout(text_to_generate, template)
+        try:
+            job = render_job_queue.submit(render_output)
+        except QueueFullError:
+            return jsonify({"status": "error", "message": "服务器繁忙，请稍后再试"}), 429
+        return jsonify({
+            "status": "success",
+            "job_id": job.id,
+            "state": job.state,
+            "status_url": f"/api/miniprogram/jobs/{job.id}",
+            "events_url": f"/api/miniprogram/jobs/{job.id}/events",
+            "estimate": estimate,
+            "message": "任务已提交，正在生成"
+        }), 202
+
+    try:
+        return jsonify(render_output())
     except Exception as e:
-        safe_remove_directory(temp_dir)
         logger.error(f"生成失败: {e}")
         return jsonify({"status": "error", "message": f"生成失败: {str(e)}"}), 500
 
 
+def build_miniprogram_output(images, pdf_mode, zip_mode, on_page=None, output=None, delivery="base64",
+                             pdf_profile=PDF_PROFILE):
+    """
+    把渲染好的页面打包为小程序接口的返回数据
+    :param images: 页面图片的可迭代对象
+    :param pdf_mode: 生成 PDF 下载链接
+    :param zip_mode: 生成 ZIP 下载链接
+    :param on_page: 每保存一页后的回调，用于上报进度
+    :param output: 返回图片和 ZIP 中页面的输出格式（见 parse_image_output），为 None 时为 PNG
+    :param delivery: 返回图片的方式（见 parse_image_delivery）
+    :param pdf_profile: PDF 的输出配置（见 parse_pdf_profile）
+    :return: 可直接 jsonify 的 dict，PDF/ZIP 文件登记到 temp_download_files
+    """
+    project_temp_base = "./temp"
+    os.makedirs(project_temp_base, exist_ok=True)
+    # 生成文件ID
+    file_id = str(uuid.uuid4())
+
+    if pdf_mode:
+        # 生成 PDF：页面渲染出来就写入，不再先保存为图片文件
+        pdf_path = os.path.join(project_temp_base, f"{file_id}.pdf")
+        try:
+            with open(pdf_path, "wb") as f:
+                writer = PdfWriter(f, pdf_profile)
+                for im in images:
+                    writer.add_page(im)
+                    del im
+                    if on_page is not None:
+                        on_page()
+                writer.close()
+        except Exception:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+            raise
+        file_path = pdf_path
+        file_type = "pdf"
+        mimetype = "application/pdf"
+
+        # 存储文件信息（1小时后过期）
+        expire_time = time.time() + 3600
+        temp_download_files[file_id] = (file_path, expire_time, mimetype)
+
+        return {
+            "status": "success",
+            "file_id": file_id,
+            "file_type": file_type,
+            "download_url": f"/api/miniprogram/download/{file_id}",
+            "page_count": writer.page_count,
+            "pdf_profile": pdf_profile,
+            "file_size": os.path.getsize(pdf_path),
+            "expires_in": 3600,
+            "message": "PDF生成成功，请在1小时内下载"
+        }
+
+    if not zip_mode:
+        # 返回图片数组（用于保存到相册），每页按输出格式编码一次
+        pages = []
+        for im in images:
+            pages.append(encode_page(im, output))
+            del im
+            if on_page is not None:
+                on_page()
+        result = {
+            "status": "success",
+            "page_count": len(pages),
+            "imageFormat": output["format"] if output is not None else "png",
+            **image_bytes_report(pages),
+            "message": f"图片生成成功，共 {len(pages)} 页"
+        }
+        if delivery == "url":
+            result["pages"] = [page_entry(page) for page in pages]
+        else:
+            result["images"] = [page_data_url(page) for page in pages]
+        return result
+
+    # 生成 ZIP：页面渲染出来就编码并写入下载文件，不再先保存为图片文件；图片已压缩，直接存储
+    zip_path = os.path.join(project_temp_base, f"{file_id}.zip")
+    page_count = 0
+
+    def zip_pages():
+        nonlocal page_count
+        for im in images:
+            page = encode_page(im, output)
+            del im
+            page_count += 1
+            if on_page is not None:
+                on_page()
+            yield page
+
+    try:
+        with open(zip_path, "wb") as f:
+            for chunk in iter_page_zip(zip_pages()):
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+        raise
+
+    file_path = zip_path
+    file_type = "zip"
+    mimetype = "application/zip"
+
+    # 存储文件信息（1小时后过期）
+    expire_time = time.time() + 3600
+    temp_download_files[file_id] = (file_path, expire_time, mimetype)
+
+    return {
+        "status": "success",
+        "file_id": file_id,
+        "file_type": file_type,
+        "download_url": f"/api/miniprogram/download/{file_id}",
+        "page_count": page_count,
+        "expires_in": 3600,
+        "message": "图片打包成功，请在1小时内下载"
+    }
+
+
+@app.route("/api/miniprogram/jobs/<job_id>", methods=["GET"])
+@limiter.limit("600 per 5 minute")
+def miniprogram_job_status(job_id):
+    """
+    查询后台渲染任务的状态和进度（轮询）
+    完成后 result 字段与同步生成接口的返回数据一致
+    """
+    job = render_job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "任务不存在或已过期"}), 404
+    return jsonify({"status": "success", "data": job.to_dict()})
+
+
+@app.route("/api/miniprogram/jobs/<job_id>/events", methods=["GET"])
+@limiter.limit("60 per 5 minute")
+def miniprogram_job_events(job_id):
+    """
+    订阅后台渲染任务的进度（Server-Sent Events）
+    每次进度变化推送一条 progress 事件，结束时推送 done 或 failed 事件；
+    连接超过 RENDER_JOB_EVENTS_MAX_SECONDS 时推送 timeout 事件并关闭，客户端改为轮询或重新订阅
+    """
+    job = render_job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "任务不存在或已过期"}), 404
+
+    def event_stream():
+        version = -1
+        deadline = time.time() + RENDER_JOB_EVENTS_MAX_SECONDS
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                payload = json.dumps(job.to_dict(), ensure_ascii=False)
+                yield f"event: timeout\ndata: {payload}\n\n"
+                return
+            new_version = job.wait_for_update(version, min(15, remaining))
+            if new_version == version and not job.is_finished():
+                # 超时无更新，发送注释行保持连接
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            payload = json.dumps(job.to_dict(), ensure_ascii=False)
+            if job.is_finished():
+                yield f"event: {job.state}\ndata: {payload}\n\n"
+                return
+            yield f"event: progress\ndata: {payload}\n\n"
+
+    return Response(
+        event_stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/miniprogram/pages/<digest>", methods=["GET"])
+def miniprogram_page(digest):
+    """
+    下载 image_delivery=url 时返回的单页图片
+    地址由页面内容的哈希决定，内容不会改变，允许客户端在有效期内直接使用缓存
+    """
+    page = page_store.get(digest)
+    if page is None:
+        return jsonify({"status": "error", "message": "页面不存在或已过期，请重新生成"}), 404
+    response = Response(page, mimetype=image_mimetype(page))
+    response.set_etag(digest)
+    response.headers["Cache-Control"] = f"private, max-age={page_store.ttl}, immutable"
+    return response.make_conditional(request)
+
+
 @app.route("/api/miniprogram/download/<file_id>", methods=["GET"])
 def miniprogram_download(file_id):
     """
     小程序下载接口 - 根据 file_id 下载生成的文件
     """
-    if file_id not in temp_download_files:
+    entry = find_download_file(file_id)
+    if entry is None:
         return jsonify({"status": "error", "message": "文件不存在或已过期"}), 404
     
-    file_path, expire_time, mimetype = temp_download_files[file_id]
+    file_path, expire_time, mimetype = entry
     
     # 检查是否过期
     if time.time() > expire_time:
         # 清理过期文件
         safe_remove_file(file_path)
-        del temp_download_files[file_id]
+        temp_download_files.pop(file_id, None)
         return jsonify({"status": "error", "message": "文件已过期，请重新生成"}), 410
     
     if not os.path.exists(file_path):
-        del temp_download_files[file_id]
+        temp_download_files.pop(file_id, None)
         return jsonify({"status": "error", "message": "文件不存在"}), 404
     
     # 确定文件名
@@ -1683,21 +2097,53 @@ def miniprogram_fonts():
     """
     获取可用字体列表（小程序专用）
     """
-    directory = "./font_assets"
-    fonts = []
-    
-    if os.path.exists(directory):
-        for f in os.listdir(directory):
-            if os.path.isfile(os.path.join(directory, f)) and f.lower().endswith(".ttf"):
-                fonts.append({
-                    "name": f[:-4],  # 去掉后缀
-                    "filename": f
-                })
-    
-    return jsonify({
+    # name 为去掉后缀的文件名；family/glyphs 无法读取时为 null，coverage 无法读取 cmap 时为 null
+    fonts, etag = font_registry.fonts()
+    return conditional_json({
         "status": "success",
         "fonts": fonts
-    })
+    }, etag)
+
+
+@app.route("/api/fonts/upload", methods=["POST"])
+@app.route("/api/miniprogram/fonts/upload", methods=["POST"])
+@limiter.limit("30 per 5 minute")
+def upload_font():
+    """
+    上传自定义字体，按内容哈希保存；之后的预览和生成请求传 font_hash 即可，不必重复上传字体文件
+    若客户端已知哈希，可先传 font_hash 检查服务端是否仍保存着该字体
+    """
+    font_hash = request.form.get("font_hash")
+    if "font_file" not in request.files:
+        if font_hash and font_store.path(font_hash):
+            return jsonify({"status": "success", "font_hash": font_hash})
+        return jsonify({"status": "error", "message": "请上传字体文件"}), 400
+
+    # 最多读取上限加一个字节，过大的文件不再读入内存
+    font_hash, error = font_store.put(request.files["font_file"].read(font_store.max_bytes + 1))
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
+    return jsonify({"status": "success", "font_hash": font_hash})
+
+
+@app.route("/api/backgrounds/upload", methods=["POST"])
+@app.route("/api/miniprogram/backgrounds/upload", methods=["POST"])
+@limiter.limit("100 per 5 minute")
+def upload_background():
+    """
+    上传自定义背景图，按内容哈希保存；之后的预览和生成请求传 background_hash 即可，不必重复上传图片
+    若客户端已知哈希，可先传 background_hash 检查服务端是否仍保存着该背景图
+    """
+    background_hash = request.form.get("background_hash")
+    if "background_image" not in request.files:
+        if background_hash and background_store.path(background_hash):
+            return jsonify({"status": "success", "background_hash": background_hash})
+        return jsonify({"status": "error", "message": "请上传背景图片"}), 400
+
+    background_hash, error = background_store.put(request.files["background_image"].read())
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
+    return jsonify({"status": "success", "background_hash": background_hash})
 
 
 # ==================== 用户认证与会员接口 ====================
@@ -2269,6 +2715,37 @@ def consume_loveseed():
         return jsonify({"status": "error", "message": "消耗失败"}), 500
 
 
+# ==================== 管理员渲染服务API ====================
+
+@app.route("/api/admin/render/stats", methods=["GET"])
+@limiter.limit("30 per minute")
+def admin_render_stats():
+    """
+    渲染服务统计（管理员）：渲染缓存命中、增量渲染复用、合并请求节省的渲染、字形缓存、后台任务
+    """
+    admin_token = request.headers.get("X-Admin-Token") or request.args.get("admin_token")
+
+    if not LOCAL_TEST_MODE and admin_token != os.getenv("ADMIN_TOKEN", "admin123"):
+        return jsonify({"status": "error", "message": "权限不足"}), 403
+
+    return jsonify({
+        "status": "success",
+        "data": {
+            "cache": render_cache.stats(),
+            "history": layout_history.stats(),
+            "single_flight": render_flight.stats(),
+            "glyph_atlas": glyph_atlas.stats(),
+            "font_pool": font_pool.stats(),
+            "font_store": font_store.stats(),
+            "backgrounds": background_cache.stats(),
+            "background_store": background_store.stats(),
+            "page_encoder": page_encoder.stats(),
+            "page_store": page_store.stats(),
+            "jobs": render_job_queue.stats(),
+        }
+    })
+
+
 # ==================== 管理员相思豆管理API ====================
 
 @app.route("/api/admin/loveseed/orders", methods=["GET"])
@@ -0,0 +1,73 @@
+"""
+纸张背景缓存模块
+信纸、方格纸背景由少数几组参数（纸张尺寸、纸张类型、线条颜色、行距、边距）决定，
+每次请求都重新绘制一张 A4 原始分辨率的背景既慢又浪费。这里按规范化后的参数缓存生成好的背景图，
+按像素字节预算做 LRU 淘汰；缓存中的图片被多个请求共享，使用方只能读取（handright 绘制时会先复制背景）
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 背景图缓存的内存预算（字节），一张 A4 RGB 背景约 26 MB
+BACKGROUND_CACHE_BYTES = int(os.getenv("BACKGROUND_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+
+def image_nbytes(im):
+    """图片像素数据占用的大致字节数"""
+    return im.width * im.height * len(im.getbands())
+
+
+class BackgroundCache(object):
+    """
+    按键缓存背景图，未命中时调用 build 生成；返回的图片是共享的，不能修改
+    """
+
+    def __init__(self, budget=BACKGROUND_CACHE_BYTES):
+        self.budget = budget
+        self._images = OrderedDict()  # key -> (image, nbytes)
+        self._used = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, key, build):
+        """
+        :param key: 可哈希的规范化参数
+        :param build: 无参数函数，返回新生成的背景图
+        """
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is not None:
+                self._images.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+            self._stats["misses"] += 1
+
+        image = build()
+        nbytes = image_nbytes(image)
+        if nbytes > self.budget:
+            return image
+        # 缓存的图片只读，提前加载像素数据，避免多个线程同时触发延迟加载
+        image.load()
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is not None:
+                # 并发生成了同一背景，使用先放入的
+                return entry[0]
+            self._images[key] = (image, nbytes)
+            self._used += nbytes
+            while self._used > self.budget:
+                _, (_, evicted) = self._images.popitem(last=False)
+                self._used -= evicted
+        return image
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"images": len(self._images), "bytes": self._used, "budget": self.budget})
+            return data
+
+
+background_cache = BackgroundCache()
@@ -0,0 +1,103 @@
+"""
+上传背景图存储模块
+用户上传的背景图按内容的 SHA-256 保存到磁盘，之后的预览和生成请求可以用哈希引用，不必重复上传；
+解码、去除 Alpha 通道并 LANCZOS 缩放到纸张尺寸后的结果同时缓存在内存（background_cache）和磁盘（原始像素文件）中，
+同一张背景图以同一纸张尺寸再次使用时不再解码和缩放。两类文件共享一个磁盘配额，按 LRU 淘汰
+"""
+import os
+import io
+import re
+import hashlib
+import logging
+
+from PIL import Image
+
+from content_store import ContentStore, HASH_RE
+from background_cache import background_cache
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_UPLOAD_DIR = os.getenv("BACKGROUND_UPLOAD_DIR", "./cache/backgrounds")
+# 上传背景图（含缩放后的像素文件）的磁盘配额（字节），一张 A4 RGB 像素文件约 26 MB
+BACKGROUND_UPLOAD_QUOTA_BYTES = int(os.getenv("BACKGROUND_UPLOAD_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+
+# <sha256>.img 为上传的原图，<sha256>-<宽>x<高>-<模式>.raw 为缩放后的像素数据
+_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.img|-\d+x\d+-[A-Z]+\.raw)$")
+
+
+def _raw_name(digest, width, height, mode):
+    return f"{digest}-{width}x{height}-{mode}.raw"
+
+
+class BackgroundStore(object):
+    """
+    按内容哈希保存的上传背景图及其缩放结果
+    """
+
+    def __init__(self, directory=BACKGROUND_UPLOAD_DIR, quota=BACKGROUND_UPLOAD_QUOTA_BYTES):
+        self._files = ContentStore(directory, quota, _NAME_RE)
+
+    def put(self, data):
+        """
+        保存上传的背景图
+        :param data: 图片文件内容
+        :return: (sha256, error)；图片无法解析或超过配额时 sha256 为 None
+        """
+        if len(data) > self._files.quota:
+            return None, "背景图片过大"
+        digest = hashlib.sha256(data).hexdigest()
+        if self.path(digest) is not None:
+            return digest, None
+        try:
+            Image.open(io.BytesIO(data)).verify()
+        except Exception:
+            return None, "无法识别的背景图片"
+        if self._files.put(digest + ".img", data) is None:
+            return None, "保存背景图片失败"
+        return digest, None
+
+    def path(self, digest):
+        """
+        哈希对应的原图路径并刷新最近使用时间
+        :return: 路径；哈希无效或图片已被淘汰时返回 None（客户端需要重新上传）
+        """
+        if not isinstance(digest, str) or not HASH_RE.match(digest):
+            return None
+        return self._files.path(digest + ".img")
+
+    def get(self, digest, width, height, mode="RGB"):
+        """
+        缩放到纸张尺寸的背景图；返回的图片是共享的，不能修改
+        :param mode: 输出的图片模式
+        :return: 图片；哈希无效或原图已被淘汰时返回 None
+        """
+        path = self.path(digest)
+        if path is None:
+            return None
+        return background_cache.get(
+            ("upload", digest, width, height, mode),
+            lambda: self._prepare(digest, path, width, height, mode),
+        )
+
+    def _prepare(self, digest, path, width, height, mode):
+        name = _raw_name(digest, width, height, mode)
+        raw_path = self._files.path(name)
+        if raw_path is not None:
+            try:
+                with open(raw_path, "rb") as f:
+                    return Image.frombytes(mode, (width, height), f.read())
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取缩放后的背景图失败: {raw_path} - {e}")
+
+        image = Image.open(path)
+        if image.mode != mode:
+            image = image.convert(mode)
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+        self._files.put(name, image.tobytes())
+        return image
+
+    def stats(self):
+        return self._files.stats()
+
+
+background_store = BackgroundStore()
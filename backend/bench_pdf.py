@@ -0,0 +1,136 @@
+"""
+PDF 生成基准：对比重构前的 generate_pdf（页面先存为 PNG 文件，再逐页重新编码为 JPEG 临时文件后由 PyMuPDF 插入）
+与流式写入器（PIL 页面编码一次后嵌入；渲染缓存中的 PNG 原样嵌入；screen 和 compact 配置），并检查页数一致
+用法：python bench_pdf.py [页数]
+"""
+import os
+import io
+import sys
+import time
+import shutil
+import tempfile
+import fitz  # PyMuPDF
+from PIL import Image, ImageFont
+from handright import Template
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from paper import create_notebook_image
+from render_engine import render_pages
+from page_encoder import page_encoder
+from pdf import write_pdf
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "font_assets", "神韵英子楷书.ttf")
+TEMP_BASE = "./temp"
+
+
+def legacy_generate_pdf(image_sources, output_path):
+    """重构前 pdf.generate_pdf 的实现（去掉日志）"""
+    os.makedirs(TEMP_BASE, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=TEMP_BASE)
+    try:
+        pdf_document = fitz.open()
+        for i, source in enumerate(image_sources):
+            if isinstance(source, str):
+                img = Image.open(source)
+                should_close = True
+            else:
+                img = source
+                should_close = False
+            width, height = img.size
+            temp_img_path = os.path.join(temp_dir, f'image{i}.jpg')
+            img.save(temp_img_path, format="JPEG", quality=95)
+            if should_close:
+                img.close()
+            pdf_page = pdf_document.new_page(width=width, height=height)
+            pdf_page.insert_image(fitz.Rect(0, 0, width, height), filename=temp_img_path)
+        pdf_document.save(output_path)
+        pdf_document.close()
+        return output_path
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def legacy_miniprogram_pdf(images):
+    """重构前小程序生成 PDF 的流程：先把每页保存为 PNG 文件，再把文件路径交给 generate_pdf"""
+    temp_dir = tempfile.mkdtemp(dir=TEMP_BASE)
+    try:
+        paths = []
+        for i, im in enumerate(images):
+            path = os.path.join(temp_dir, f"{i}.png")
+            im.save(path)
+            paths.append(path)
+        output_path = os.path.join(temp_dir, "out.pdf")
+        legacy_generate_pdf(paths, output_path)
+        with open(output_path, "rb") as f:
+            return f.read()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def legacy_pdf(images):
+    """重构前网页版生成 PDF 的流程：PIL 页面直接交给 generate_pdf"""
+    output_path = os.path.join(TEMP_BASE, "bench.pdf")
+    try:
+        legacy_generate_pdf(images, output_path)
+        with open(output_path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(output_path)
+
+
+def make_pages(count):
+    width, height = 2480, 3508
+    template = Template(
+        background=create_notebook_image(width, height, 120, 150, 150, 150, 150, 90, "true", "red", "lined"),
+        font=ImageFont.truetype(FONT_PATH, 90),
+        line_spacing=120, left_margin=150, top_margin=150, right_margin=150, bottom_margin=150,
+        word_spacing=-10, line_spacing_sigma=1, font_size_sigma=1, word_spacing_sigma=1,
+        perturb_x_sigma=1, perturb_y_sigma=1, perturb_theta_sigma=0.05,
+    )
+    text = "春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。The quick brown fox jumps over the lazy dog. " * 60
+    pages = []
+    for im in render_pages(text, template, seed=1):
+        pages.append(im)
+        if len(pages) >= count:
+            break
+    return pages
+
+
+def bench(name, func, repeat=3):
+    best, data = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    pages = fitz.open(stream=data, filetype="pdf").page_count
+    print(f"{name:<36} {best * 1000:8.1f} ms {len(data) / 1024:9.0f} KB  {pages} pages")
+    return pages
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    os.makedirs(TEMP_BASE, exist_ok=True)
+    images = make_pages(count)
+    png_pages = [page_encoder.encode(im) for im in images]
+    print(f"{len(images)} pages of {images[0].width}x{images[0].height}")
+
+    def streaming(sources, profile="print"):
+        buffer = io.BytesIO()
+        write_pdf(sources, buffer, profile)
+        return buffer.getvalue()
+
+    counts = {
+        bench("legacy (PNG files -> JPEG files)", lambda: legacy_miniprogram_pdf(images)),
+        bench("legacy (PIL images -> JPEG files)", lambda: legacy_pdf(images)),
+        bench("streaming (PIL images)", lambda: streaming(images)),
+        bench("streaming (cached PNG passthrough)", lambda: streaming(png_pages)),
+        bench("streaming, screen profile", lambda: streaming(images, "screen")),
+        bench("streaming, compact profile", lambda: streaming(images, "compact")),
+    }
+    assert counts == {len(images)}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+文本规范化流水线基准：1 MB 输入上对比逐字处理的旧实现，并检查输出一致
+用法：python bench_text_pipeline.py
+"""
+import os
+import re
+import sys
+import time
+import random
+import unicodedata
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from text_pipeline import default_pipeline, english_spacing_pipeline
+
+INPUT_BYTES = 1024 * 1024
+
+
+def legacy_clean_text(text):
+    """重构前 app.clean_text_for_handwrite 的逐字实现（去掉日志）"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    for char in ('\u200b', '\u200c', '\u200d', '\ufeff', '\u00ad'):
+        text = text.replace(char, '')
+    block_chars = set(chr(i) for i in range(0x2580, 0x25A0))
+    geometric_chars = set(chr(i) for i in range(0x25A0, 0x2600))
+    cleaned = []
+    for char in text:
+        if char == '\n':
+            cleaned.append(char)
+        elif char == '\t':
+            cleaned.append('    ')
+        elif char in block_chars or char in geometric_chars:
+            continue
+        else:
+            category = unicodedata.category(char)
+            if category not in ('Cc', 'Cf', 'Co', 'Cs', 'Cn'):
+                code_point = ord(char)
+                if code_point < 0x1F000 or (0x2000 <= code_point < 0x2100):
+                    if not (0xE000 <= code_point <= 0xF8FF):
+                        cleaned.append(char)
+    return ''.join(cleaned)
+
+
+def legacy_replace_english_spaces(text):
+    """重构前 generate_handwriting 中的 replace_english_spaces"""
+    english_pattern = r'^[a-zA-Z0-9.,!?;:\'\"()\-_]+$'
+    processed_lines = []
+    for line in text.split('\n'):
+        parts = line.split(' ')
+        if len(parts) <= 1:
+            processed_lines.append(line)
+            continue
+        result = []
+        for i, part in enumerate(parts):
+            result.append(part)
+            if i < len(parts) - 1:
+                current_is_english = bool(re.match(english_pattern, part)) if part.strip() else False
+                next_is_english = bool(re.match(english_pattern, parts[i + 1])) if parts[i + 1].strip() else False
+                result.append('  ' if current_is_english and next_is_english else ' ')
+        processed_lines.append(''.join(result))
+    return '\n'.join(processed_lines)
+
+
+def make_input(size=INPUT_BYTES, seed=0):
+    """中英混排文本，夹杂 CRLF、制表符、零宽字符、方块符号、私有区字符和 emoji"""
+    rand = random.Random(seed)
+    pieces = [
+        "我能吞下玻璃而不伤身体。", "春眠不觉晓，处处闻啼鸟。", "Hello", "world,", "it's", "(ok)",
+        "v1.2", "foo-bar_baz", "Done!", " ", "  ", "\n", "\r\n", "\r", "\t", "\u200b", "\ufeff",
+        "\u00ad", "\u2588", "\u25a0", "\ue000", "\U0001F600", "\x07", "中文 English", "１２３",
+    ]
+    weights = [12, 12, 8, 6, 4, 3, 2, 2, 2, 20, 3, 5, 2, 1, 2, 1, 1, 1, 1, 1, 1, 1, 1, 4, 1]
+    out = []
+    length = 0
+    while length < size:
+        piece = rand.choices(pieces, weights)[0]
+        out.append(piece)
+        length += len(piece.encode("utf-8"))
+    return "".join(out)
+
+
+def bench(name, func, text, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<28} {best * 1000:8.1f} ms")
+    return result, best
+
+
+if __name__ == "__main__":
+    text = make_input()
+    print(f"input: {len(text.encode('utf-8'))} bytes, {len(text)} chars")
+
+    expected, legacy = bench("legacy clean", legacy_clean_text, text)
+    result, compiled = bench("pipeline clean", default_pipeline, text)
+    assert result == expected
+    print(f"speedup {legacy / compiled:.1f}x")
+
+    expected, legacy = bench("legacy clean + spacing",
+                             lambda t: legacy_replace_english_spaces(legacy_clean_text(t)), text)
+    result, compiled = bench("pipeline clean + spacing", english_spacing_pipeline, text)
+    assert result == expected
+    print(f"speedup {legacy / compiled:.1f}x")
+
+    ascii_text = re.sub(r"[^\x00-\x7f]", "", text)
+    expected, legacy = bench("legacy ascii", legacy_clean_text, ascii_text)
+    result, compiled = bench("pipeline ascii", default_pipeline, ascii_text)
+    assert result == expected
+    print(f"speedup {legacy / compiled:.1f}x")
@@ -0,0 +1,128 @@
+"""
+磁盘文件存储模块
+在一个目录中按名称保存文件，总大小超过配额时按最近使用时间（LRU）淘汰，多个 worker 进程共享同一目录。
+上传字体、上传背景图等按内容哈希保存的数据都以此为基础
+"""
+import os
+import re
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 内容哈希（sha256 十六进制）
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ContentStore(object):
+    """
+    文件名 -> 文件的磁盘存储；文件的访问时间记录最近使用，淘汰时先删最久未用的。
+    只刷新访问时间、不改修改时间，以路径和修改时间为键的其他缓存因此保持有效
+    """
+
+    def __init__(self, directory, quota, name_re):
+        """
+        :param directory: 存储目录
+        :param quota: 磁盘配额（字节）
+        :param name_re: 合法文件名的正则，扫描目录和查找时忽略其他文件
+        """
+        self.directory = directory
+        self.quota = quota
+        self.name_re = name_re
+        self._index = None  # name -> [size, last_used]
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _load_index_locked(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._used = 0
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not self.name_re.match(name):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            self._index[name] = [st.st_size, max(st.st_atime, st.st_mtime)]
+            self._used += st.st_size
+
+    def put(self, name, data):
+        """
+        原子地写入文件，必要时淘汰最久未用的其他文件
+        :return: 文件路径；超过配额或写入失败时返回 None
+        """
+        if len(data) > self.quota:
+            return None
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入文件失败: {path} - {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        with self._lock:
+            self._load_index_locked()
+            old = self._index.get(name)
+            if old is not None:
+                self._used -= old[0]
+            self._index[name] = [len(data), time.time()]
+            self._used += len(data)
+            evicted = []
+            if self._used > self.quota:
+                for old_name, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+                    if self._used <= self.quota:
+                        break
+                    if old_name == name:
+                        continue
+                    evicted.append(old_name)
+                    self._used -= self._index.pop(old_name)[0]
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+        if evicted:
+            logger.info(f"{self.directory} 超出配额，淘汰 {len(evicted)} 个文件")
+        return path
+
+    def path(self, name):
+        """
+        文件路径并刷新最近使用时间
+        :return: 路径；名称不合法或文件已被淘汰时返回 None
+        """
+        if not isinstance(name, str) or not self.name_re.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            st = os.stat(path)
+            now = time.time()
+            os.utime(path, ns=(int(now * 1e9), st.st_mtime_ns))
+        except OSError:
+            return None
+        with self._lock:
+            self._load_index_locked()
+            entry = self._index.get(name)
+            if entry is None:
+                # 其他 worker 进程写入的文件
+                self._index[name] = [st.st_size, now]
+                self._used += st.st_size
+            else:
+                entry[1] = now
+        return path
+
+    def stats(self):
+        with self._lock:
+            self._load_index_locked()
+            return {"files": len(self._index), "bytes": self._used, "quota": self.quota}
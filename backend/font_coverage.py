@@ -0,0 +1,390 @@
+"""
+字体字符覆盖索引模块
+从字体文件的 cmap 表读取支持的码位，启动时为 font_assets 中的字体建立索引并保存到磁盘，
+字体文件变化（修改时间或大小不同）时重建；过滤不支持的字符只需查集合，不再逐字绘制检查
+"""
+import os
+import re
+import json
+import struct
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+FONT_ASSETS_DIR = "./font_assets"
+# 覆盖索引文件，与字体放在一起
+FONT_COVERAGE_INDEX = os.getenv("FONT_COVERAGE_INDEX", os.path.join(FONT_ASSETS_DIR, ".coverage.json"))
+# 缓存的上传字体覆盖集合数
+FONT_COVERAGE_UPLOADS = 8
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+# 始终保留的空白字符，由排版自己处理
+_WHITESPACE_RANGES = [(0x09, 0x0A), (0x20, 0x20)]
+
+
+class FontFormatError(Exception):
+    """字体文件无法解析"""
+    pass
+
+
+def _sfnt_offset(data, index):
+    if data[:4] == b"ttcf":
+        (count,) = struct.unpack_from(">I", data, 8)
+        if index >= count:
+            raise FontFormatError(f"font index {index} out of range ({count} fonts)")
+        (offset,) = struct.unpack_from(">I", data, 12 + 4 * index)
+        return offset
+    return 0
+
+
+def _find_table(data, tag, index=0):
+    base = _sfnt_offset(data, index)
+    (num_tables,) = struct.unpack_from(">H", data, base + 4)
+    for i in range(num_tables):
+        record = base + 12 + 16 * i
+        if data[record:record + 4] == tag:
+            _, offset, length = struct.unpack_from(">III", data, record + 4)
+            return offset, length
+    return None
+
+
+def _format4_ranges(data, offset):
+    (seg_count_x2,) = struct.unpack_from(">H", data, offset + 6)
+    seg_count = seg_count_x2 // 2
+    ends = struct.unpack_from(f">{seg_count}H", data, offset + 14)
+    starts_at = offset + 16 + seg_count_x2
+    starts = struct.unpack_from(f">{seg_count}H", data, starts_at)
+    deltas = struct.unpack_from(f">{seg_count}h", data, starts_at + seg_count_x2)
+    range_offsets_at = starts_at + 2 * seg_count_x2
+    range_offsets = struct.unpack_from(f">{seg_count}H", data, range_offsets_at)
+
+    ranges = []
+    for i in range(seg_count):
+        start, end, delta, range_offset = starts[i], ends[i], deltas[i], range_offsets[i]
+        if start == 0xFFFF:
+            continue
+        if range_offset == 0:
+            # 直接映射：只有映射到 0 号字形（.notdef）的码位不受支持
+            missing = (-delta) & 0xFFFF
+            if start <= missing <= end:
+                if start < missing:
+                    ranges.append((start, missing - 1))
+                if missing < end:
+                    ranges.append((missing + 1, end))
+            else:
+                ranges.append((start, end))
+            continue
+        glyphs_at = range_offsets_at + 2 * i + range_offset
+        for code in range(start, end + 1):
+            at = glyphs_at + 2 * (code - start)
+            if at + 2 > len(data):
+                break
+            (glyph,) = struct.unpack_from(">H", data, at)
+            if glyph and (glyph + delta) & 0xFFFF:
+                ranges.append((code, code))
+    return ranges
+
+
+def _format12_ranges(data, offset):
+    (num_groups,) = struct.unpack_from(">I", data, offset + 12)
+    ranges = []
+    for i in range(num_groups):
+        start, end, start_glyph = struct.unpack_from(">III", data, offset + 16 + 12 * i)
+        if start_glyph == 0:
+            start += 1
+        if start <= end:
+            ranges.append((start, end))
+    return ranges
+
+
+def _byte_table_ranges(data, offset, first, count, width):
+    fmt = ">B" if width == 1 else ">H"
+    ranges = []
+    for i in range(count):
+        (glyph,) = struct.unpack_from(fmt, data, offset + width * i)
+        if glyph:
+            ranges.append((first + i, first + i))
+    return ranges
+
+
+def read_cmap_ranges(data, index=0):
+    """
+    读取字体 cmap 表中 Unicode 子表覆盖的码位
+    :param data: 字体文件内容（TrueType / OpenType / TrueType Collection）
+    :param index: 字体集合中的字体序号
+    :return: 合并后的 [(start, end), ...]；没有 Unicode 子表时返回 None
+    """
+    try:
+        table = _find_table(data, b"cmap", index)
+        if table is None:
+            raise FontFormatError("no cmap table")
+        cmap, _ = table
+        (num_subtables,) = struct.unpack_from(">H", data, cmap + 2)
+        ranges = []
+        found = False
+        seen = set()
+        for i in range(num_subtables):
+            platform, encoding, sub_offset = struct.unpack_from(">HHI", data, cmap + 4 + 8 * i)
+            # Unicode 平台，或 Windows 平台的 BMP / 完整 Unicode 编码
+            if not (platform == 0 or (platform == 3 and encoding in (1, 10))):
+                continue
+            offset = cmap + sub_offset
+            if offset in seen:
+                continue
+            seen.add(offset)
+            (fmt,) = struct.unpack_from(">H", data, offset)
+            if fmt == 4:
+                ranges.extend(_format4_ranges(data, offset))
+            elif fmt == 12:
+                ranges.extend(_format12_ranges(data, offset))
+            elif fmt == 0:
+                ranges.extend(_byte_table_ranges(data, offset + 6, 0, 256, 1))
+            elif fmt == 6:
+                first, count = struct.unpack_from(">HH", data, offset + 6)
+                ranges.extend(_byte_table_ranges(data, offset + 10, first, count, 2))
+            else:
+                continue
+            found = True
+    except struct.error as e:
+        raise FontFormatError(f"invalid cmap: {e}")
+    if not found:
+        return None
+    return _merge_ranges(ranges)
+
+
+def read_glyph_count(data, index=0):
+    """
+    读取字体 maxp 表中的字形数
+    :return: 字形数；没有 maxp 表时返回 None
+    """
+    try:
+        table = _find_table(data, b"maxp", index)
+        if table is None:
+            return None
+        (num_glyphs,) = struct.unpack_from(">H", data, table[0] + 4)
+    except struct.error as e:
+        raise FontFormatError(f"invalid maxp: {e}")
+    return num_glyphs
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def ranges_char_class(ranges, negate=False):
+    """由码位区间构建正则字符集"""
+    parts = []
+    for start, end in ranges:
+        if start == end:
+            parts.append(re.escape(chr(start)))
+        else:
+            parts.append(f"{re.escape(chr(start))}-{re.escape(chr(end))}")
+    return "[" + ("^" if negate else "") + "".join(parts) + "]"
+
+
+def _ranges_to_set(ranges):
+    codepoints = set()
+    for start, end in ranges:
+        codepoints.update(range(start, end + 1))
+    return frozenset(codepoints)
+
+
+def _gb2312_hanzi():
+    # GB2312 一、二级汉字区：0xB0A1 - 0xF7FE
+    chars = set()
+    for high in range(0xB0, 0xF8):
+        for low in range(0xA1, 0xFF):
+            try:
+                chars.add(ord(bytes((high, low)).decode("gb2312")))
+            except UnicodeDecodeError:
+                pass
+    return frozenset(chars)
+
+
+_GB2312_HANZI = _gb2312_hanzi()
+
+
+class FontCoverage(object):
+    """
+    字体覆盖索引：font_assets 中的字体在启动时建立并持久化，上传的字体按内容哈希缓存
+    """
+
+    def __init__(self, font_dir=FONT_ASSETS_DIR, index_path=FONT_COVERAGE_INDEX):
+        self.font_dir = font_dir
+        self.index_path = index_path
+        self._index = {}  # filename -> {"mtime_ns", "size", "ranges"}
+        self._sets = {}  # filename -> frozenset
+        self._patterns = {}  # filename 或上传字体的哈希 -> 匹配不支持字符的正则
+        self._uploads = OrderedDict()  # 上传字体的哈希或文件标识 -> ranges 或 None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """读取磁盘上的索引，为新增或变化的字体重建，删除已不存在的字体"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        index = {}
+        changed = False
+        names = []
+        if os.path.isdir(self.font_dir):
+            names = [
+                f for f in os.listdir(self.font_dir)
+                if f.lower().endswith(FONT_EXTENSIONS) and os.path.isfile(os.path.join(self.font_dir, f))
+            ]
+        for name in names:
+            st = os.stat(os.path.join(self.font_dir, name))
+            entry = saved.get(name)
+            if entry and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+                index[name] = entry
+                continue
+            index[name] = self._build_entry(name, st)
+            changed = True
+        if set(saved) != set(index):
+            changed = True
+        with self._lock:
+            self._index = index
+            self._sets = {}
+            self._patterns = {}
+        if changed:
+            self._save(index)
+        logger.info(f"字体覆盖索引已加载: {len(index)} 个字体")
+
+    def _build_entry(self, name, st):
+        with open(os.path.join(self.font_dir, name), "rb") as f:
+            data = f.read()
+        try:
+            ranges = read_cmap_ranges(data)
+        except FontFormatError as e:
+            logger.warning(f"无法读取字体 cmap: {name} - {e}")
+            ranges = None
+        logger.info(f"建立字体覆盖索引: {name}")
+        return {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "ranges": ranges}
+
+    def _save(self, index):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"保存字体覆盖索引失败: {e}")
+
+    def _asset_ranges(self, name):
+        path = os.path.join(self.font_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._index.get(name)
+        if entry is None or entry["mtime_ns"] != st.st_mtime_ns or entry["size"] != st.st_size:
+            # 运行中字体文件发生了变化
+            entry = self._build_entry(name, st)
+            with self._lock:
+                self._index[name] = entry
+                self._sets.pop(name, None)
+                self._patterns.pop(name, None)
+                index = dict(self._index)
+            self._save(index)
+        return entry["ranges"]
+
+    def _font_ranges(self, font):
+        """:return: (key, ranges)，key 用于缓存派生数据"""
+        path = font.path
+        if isinstance(path, str):
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.font_dir):
+                name = os.path.basename(path)
+                return name, self._asset_ranges(name)
+            # 其他目录中的字体文件（如按哈希保存的上传字体）按路径和修改时间缓存，命中时不必读取文件
+            st = os.stat(path)
+            key = f"{os.path.abspath(path)}:{st.st_mtime_ns}:{st.st_size}:{font.index}"
+            data = None
+        else:
+            data = font.font_bytes
+            key = hashlib.sha1(data).hexdigest() + f":{font.index}"
+        with self._lock:
+            if key in self._uploads:
+                self._uploads.move_to_end(key)
+                return key, self._uploads[key]
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        try:
+            ranges = read_cmap_ranges(data, font.index)
+        except FontFormatError as e:
+            logger.warning(f"无法读取上传字体的 cmap: {e}")
+            ranges = None
+        with self._lock:
+            self._uploads[key] = ranges
+            while len(self._uploads) > FONT_COVERAGE_UPLOADS:
+                evicted, _ = self._uploads.popitem(last=False)
+                self._patterns.pop(evicted, None)
+        return key, ranges
+
+    def codepoints(self, name):
+        """
+        font_assets 中字体支持的码位集合
+        :return: frozenset；字体不存在或没有 Unicode cmap 时返回 None
+        """
+        ranges = self._asset_ranges(name)
+        if ranges is None:
+            return None
+        with self._lock:
+            codepoints = self._sets.get(name)
+        if codepoints is None:
+            codepoints = _ranges_to_set(ranges)
+            with self._lock:
+                self._sets[name] = codepoints
+        return codepoints
+
+    def font_codepoints(self, font):
+        """PIL FreeTypeFont 支持的码位集合，无法确定时返回 None"""
+        path = font.path
+        if isinstance(path, str) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.font_dir):
+            return self.codepoints(os.path.basename(path))
+        _, ranges = self._font_ranges(font)
+        return _ranges_to_set(ranges) if ranges is not None else None
+
+    def filter_text(self, text, font):
+        """
+        去掉字体不支持的字符（换行、空格和制表符保留），由覆盖区间预编译的正则一次扫描完成
+        :return: (filtered, removed)，removed 为被去掉的字符数
+        """
+        key, ranges = self._font_ranges(font)
+        if ranges is None:
+            return text, 0
+        with self._lock:
+            pattern = self._patterns.get(key)
+        if pattern is None:
+            pattern = re.compile(ranges_char_class(_WHITESPACE_RANGES + list(ranges), negate=True))
+            with self._lock:
+                self._patterns[key] = pattern
+        filtered = pattern.sub("", text)
+        return filtered, len(text) - len(filtered)
+
+    def stats(self, name):
+        """字体覆盖统计：码位总数、CJK 统一汉字数、GB2312 常用汉字覆盖率"""
+        codepoints = self.codepoints(name)
+        if codepoints is None:
+            return None
+        return {
+            "codepoints": len(codepoints),
+            "cjk": sum(1 for cp in codepoints if 0x4E00 <= cp <= 0x9FFF),
+            "gb2312": round(len(_GB2312_HANZI & codepoints) / len(_GB2312_HANZI), 4),
+            "ascii": all(cp in codepoints for cp in range(0x21, 0x7F)),
+        }
+
+
+font_coverage = FontCoverage()
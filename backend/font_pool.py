@@ -0,0 +1,76 @@
+"""
+字体对象池模块
+中文手写字体每个有数 MB，每次请求都读取整个字体文件再由 FreeType 解析代价很高。
+这里按 (字体文件, 修改时间, 字号) 缓存解析好的 FreeTypeFont，LRU 淘汰，同一 worker 进程内跨请求共享；
+上传的字体按内容哈希缓存
+"""
+import os
+import io
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from PIL import ImageFont
+
+logger = logging.getLogger(__name__)
+
+# 缓存的字体对象数（每个 (字体, 字号) 一个）
+FONT_POOL_SIZE = int(os.getenv("FONT_POOL_SIZE", "32"))
+
+
+class FontPool(object):
+    """
+    FreeTypeFont 的 LRU 池；取出的字体对象会被多个请求共享，使用方不能修改它
+    """
+
+    def __init__(self, max_fonts=FONT_POOL_SIZE):
+        self.max_fonts = max_fonts
+        self._fonts = OrderedDict()  # key -> FreeTypeFont
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, path, size):
+        """
+        字体文件在字号 size 下的字体对象，文件被修改后自动重新加载
+        :param path: 字体文件路径
+        :param size: 字号
+        """
+        st = os.stat(path)
+        key = ("file", os.path.abspath(path), st.st_mtime_ns, st.st_size, size)
+        return self._get(key, lambda: ImageFont.truetype(path, size=size))
+
+    def get_bytes(self, data, size):
+        """
+        上传字体（字节内容）在字号 size 下的字体对象
+        :param data: 字体文件内容
+        """
+        key = ("bytes", hashlib.sha256(data).hexdigest(), size)
+        return self._get(key, lambda: ImageFont.truetype(io.BytesIO(data), size=size))
+
+    def _get(self, key, load):
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self._stats["hits"] += 1
+                return font
+            self._stats["misses"] += 1
+
+        font = load()
+        with self._lock:
+            # 并发加载同一字体时保留先放入的对象
+            font = self._fonts.setdefault(key, font)
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+        return font
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"fonts": len(self._fonts), "max_fonts": self.max_fonts})
+            return data
+
+
+font_pool = FontPool()
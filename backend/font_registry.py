@@ -0,0 +1,122 @@
+"""
+字体注册表模块
+统一扫描 font_assets 中的字体（扩展名不区分大小写），记录字体族名、字形数、文件大小和字符覆盖统计；
+按固定间隔检查目录和文件的修改时间，字体增删或替换后自动更新，无需重启服务。
+字体列表附带 ETag，接口据此返回 304
+"""
+import os
+import io
+import json
+import time
+import hashlib
+import threading
+import logging
+
+from PIL import ImageFont
+
+from font_coverage import FONT_ASSETS_DIR, FONT_EXTENSIONS, FontFormatError, font_coverage, read_glyph_count
+
+logger = logging.getLogger(__name__)
+
+# 检查字体目录变化的最短间隔（秒）
+FONT_REGISTRY_POLL = float(os.getenv("FONT_REGISTRY_POLL", "5"))
+
+
+class FontRegistry(object):
+    """
+    font_assets 字体注册表；只在文件修改时间或大小变化时重新读取元数据
+    """
+
+    def __init__(self, font_dir=FONT_ASSETS_DIR, poll_interval=FONT_REGISTRY_POLL, coverage=font_coverage):
+        self.font_dir = font_dir
+        self.poll_interval = poll_interval
+        self.coverage = coverage
+        self._fonts = {}  # filename -> {"signature": (mtime_ns, size), "info": {...}}
+        self._listing = []
+        self._etag = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _signatures(self):
+        signatures = {}
+        if not os.path.isdir(self.font_dir):
+            return signatures
+        for name in os.listdir(self.font_dir):
+            if not name.lower().endswith(FONT_EXTENSIONS):
+                continue
+            try:
+                st = os.stat(os.path.join(self.font_dir, name))
+            except OSError:
+                continue
+            if os.path.isfile(os.path.join(self.font_dir, name)):
+                signatures[name] = (st.st_mtime_ns, st.st_size)
+        return signatures
+
+    def _build_info(self, name, size):
+        path = os.path.join(self.font_dir, name)
+        family, style, glyphs = None, None, None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            glyphs = read_glyph_count(data)
+            family, style = ImageFont.truetype(io.BytesIO(data), size=12).getname()
+        except (OSError, FontFormatError) as e:
+            logger.warning(f"无法读取字体信息: {name} - {e}")
+        return {
+            "name": os.path.splitext(name)[0],
+            "filename": name,
+            "family": family,
+            "style": style,
+            "glyphs": glyphs,
+            "size": size,
+            "coverage": self.coverage.stats(name),  # 无法读取 cmap 时为 None
+        }
+
+    def refresh(self, force=False):
+        """距上次检查超过间隔（或 force）时重新扫描目录，只为变化的字体重新读取元数据"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._checked is not None and now - self._checked < self.poll_interval:
+                return
+            self._checked = now
+            fonts = dict(self._fonts)
+
+        signatures = self._signatures()
+        changed = set(fonts) != set(signatures)
+        for name, signature in signatures.items():
+            entry = fonts.get(name)
+            if entry is None or entry["signature"] != signature:
+                fonts[name] = {"signature": signature, "info": self._build_info(name, signature[1])}
+                changed = True
+        if not changed:
+            return
+        fonts = {name: fonts[name] for name in signatures}
+        listing = [fonts[name]["info"] for name in sorted(fonts)]
+        payload = json.dumps(listing, sort_keys=True, ensure_ascii=False)
+        etag = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        with self._lock:
+            self._fonts = fonts
+            self._listing = listing
+            self._etag = etag
+        logger.info(f"字体注册表已更新: {len(listing)} 个字体")
+
+    def fonts(self):
+        """:return: (字体信息列表, etag)"""
+        self.refresh()
+        with self._lock:
+            return list(self._listing), self._etag
+
+    def names(self):
+        """可用的字体文件名集合"""
+        self.refresh()
+        with self._lock:
+            return set(self._fonts)
+
+    def path(self, name):
+        """字体文件名对应的路径；不是已注册的字体时返回 None"""
+        if name not in self.names():
+            return None
+        return os.path.join(self.font_dir, name)
+
+
+font_registry = FontRegistry()
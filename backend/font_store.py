@@ -0,0 +1,71 @@
+"""
+上传字体存储模块
+用户自定义字体（中文字体通常 5-15 MB）只需上传一次：服务端按内容的 SHA-256 保存到磁盘，
+之后的预览和生成请求用哈希引用字体；按磁盘配额做 LRU 淘汰，多个 worker 进程共享同一目录
+"""
+import os
+import io
+import re
+import hashlib
+import logging
+
+from PIL import ImageFont
+
+from content_store import ContentStore, HASH_RE
+
+logger = logging.getLogger(__name__)
+
+FONT_UPLOAD_DIR = os.getenv("FONT_UPLOAD_DIR", "./cache/fonts")
+# 上传字体的磁盘配额（字节）
+FONT_UPLOAD_QUOTA_BYTES = int(os.getenv("FONT_UPLOAD_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+# 单个上传字体的大小上限（字节），超过时不计算哈希也不解析
+FONT_UPLOAD_MAX_BYTES = int(os.getenv("FONT_UPLOAD_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_NAME_RE = re.compile(r"^[0-9a-f]{64}\.ttf$")
+
+
+class FontStore(object):
+    """
+    按内容哈希保存的上传字体，文件名为 <sha256>.ttf；
+    只刷新访问时间、不改修改时间，字体池和字形缓存中以路径为键的字体对象因此保持有效
+    """
+
+    def __init__(self, directory=FONT_UPLOAD_DIR, quota=FONT_UPLOAD_QUOTA_BYTES, max_bytes=FONT_UPLOAD_MAX_BYTES):
+        self._files = ContentStore(directory, quota, _NAME_RE)
+        self.max_bytes = max_bytes
+
+    def put(self, data):
+        """
+        保存上传的字体
+        :param data: 字体文件内容
+        :return: (sha256, error)；字体无法解析或超过配额时 sha256 为 None
+        """
+        if len(data) > min(self.max_bytes, self._files.quota):
+            return None, "字体文件过大"
+        try:
+            ImageFont.truetype(io.BytesIO(data), size=12)
+        except OSError:
+            return None, "无法识别的字体文件"
+        digest = hashlib.sha256(data).hexdigest()
+        if self.path(digest) is not None:
+            return digest, None
+        if self._files.put(digest + ".ttf", data) is None:
+            return None, "保存字体失败"
+        return digest, None
+
+    def path(self, digest):
+        """
+        哈希对应的字体文件路径并刷新最近使用时间
+        :return: 路径；哈希无效或字体已被淘汰时返回 None（客户端需要重新上传）
+        """
+        if not isinstance(digest, str) or not HASH_RE.match(digest):
+            return None
+        return self._files.path(digest + ".ttf")
+
+    def stats(self):
+        data = self._files.stats()
+        data["fonts"] = data.pop("files")
+        return data
+
+
+font_store = FontStore()
@@ -1,8 +1,9 @@
 import os
 import io
 import unicodedata
-from PIL import Image, ImageDraw, ImageFont
 from handright import Template, handwrite, Feature
+from font_pool import font_pool
+from paper import create_notebook_image
 
 # Helper functions copied from app.py
 def clean_text_for_handwrite(text):
@@ -46,50 +47,6 @@ def filter_unsupported_chars(text, font):
         filtered.append(char)
     return ''.join(filtered)
 
-def create_notebook_image(
-    width,
-    height,
-    line_spacing,
-    top_margin,
-    bottom_margin,
-    left_margin,
-    right_margin,
-    font_size,
-    isUnderlined,
-    line_color="red",
-    paper_type="plain",
-):
-    if paper_type == "grid":
-        grid_color = (0, 180, 180)
-        paper_color = (255, 255, 255)
-        image = Image.new("RGB", (width, height), paper_color)
-        draw = ImageDraw.Draw(image)
-        cell_size = int(font_size * 1.15)
-        start_x = left_margin
-        start_y = top_margin
-        x = start_x
-        while x <= width - right_margin:
-            draw.line((x, start_y, x, height - bottom_margin), fill=grid_color, width=1)
-            x += cell_size
-        y = start_y
-        while y <= height - bottom_margin:
-            draw.line((start_x, y, width - right_margin, y), fill=grid_color, width=1)
-            y += cell_size
-            
-    elif paper_type == "lined" or isUnderlined == True or isUnderlined == "true":
-        paper_color = (255, 251, 240)
-        image = Image.new("RGB", (width, height), paper_color)
-        draw = ImageDraw.Draw(image)
-        y = top_margin + line_spacing
-        while y < height - bottom_margin:
-            draw.line((left_margin, y-1, width - right_margin, y-1), fill=line_color)
-            draw.line((left_margin, y, width - right_margin, y), fill=line_color)
-            draw.line((left_margin, y+1, width - right_margin, y+1), fill=line_color)
-            y += line_spacing
-    else:
-        image = Image.new("RGB", (width, height), "white")
-    return image
-
 # Main generation logic
 def generate_default_preview():
     text = """                        《东风破》
@@ -121,7 +78,7 @@ def generate_default_preview():
         print(f"Font not found: {font_path}")
         return
 
-    font = ImageFont.truetype(font_path, size=font_size)
+    font = font_pool.get(font_path, font_size)
     
     # Background
     background_image = create_notebook_image(
@@ -0,0 +1,112 @@
+"""
+字形栅格缓存模块
+handright 排版时每个字都通过 ImageDraw.text 由 FreeType 重新栅格化，字号扰动还会为每个字创建新的字体对象
+（font_variant 会重新加载整个字体文件）。中文文本通常只有几百个不同的字反复出现，
+这里按 (字体, 字号, 字符) 缓存栅格化后的字形掩码和字宽，按字节预算做 LRU 淘汰，在同一 worker 进程内跨请求复用
+"""
+import os
+import hashlib
+import threading
+import weakref
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 字形掩码的内存预算（字节）
+GLYPH_ATLAS_BYTES = int(os.getenv("GLYPH_ATLAS_BYTES", str(64 * 1024 * 1024)))
+# 缓存的字号变体数（每个变体持有一份 FreeType 字体）
+GLYPH_ATLAS_FONTS = int(os.getenv("GLYPH_ATLAS_FONTS", "32"))
+
+# 每个缓存条目除掩码像素外的大致开销
+_ENTRY_OVERHEAD = 200
+
+
+class GlyphAtlas(object):
+    """
+    字形掩码缓存：掩码和偏移与 ImageDraw.text 在整数坐标处绘制时使用的完全相同，
+    字宽与 handright 一致（字形包围盒宽度）
+    """
+
+    def __init__(self, budget=GLYPH_ATLAS_BYTES, max_fonts=GLYPH_ATLAS_FONTS):
+        self.budget = budget
+        self.max_fonts = max_fonts
+        self._glyphs = OrderedDict()  # (font_id, size, mode, char) -> (mask, offset, advance, nbytes)
+        self._used = 0
+        self._variants = OrderedDict()  # (font_id, size) -> FreeTypeFont
+        self._identities = weakref.WeakKeyDictionary()  # FreeTypeFont -> font_id
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def font_id(self, font):
+        """字体内容的标识：字体文件按路径和修改时间，从内存加载的字体按内容哈希"""
+        with self._lock:
+            font_id = self._identities.get(font)
+        if font_id is not None:
+            return font_id
+        if isinstance(font.path, (str, bytes)):
+            st = os.stat(font.path)
+            font_id = f"{os.path.abspath(font.path)}:{st.st_mtime_ns}:{st.st_size}"
+        else:
+            font_id = hashlib.sha1(font.font_bytes).hexdigest()
+        font_id = f"{font_id}:{font.index}:{font.layout_engine}"
+        with self._lock:
+            self._identities[font] = font_id
+        return font_id
+
+    def glyph(self, font, size, char, mode="1"):
+        """
+        返回 char 在字号 size 下的 (mask, offset, advance)
+        :param font: 基准字体，size 与其字号不同时使用对应的字号变体
+        :param mode: 栅格化模式，与绘制目标的 ImageDraw.fontmode 一致
+        """
+        key = (self.font_id(font), size, mode, char)
+        with self._lock:
+            entry = self._glyphs.get(key)
+            if entry is not None:
+                self._glyphs.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[:3]
+            self._stats["misses"] += 1
+
+        variant = font if size == font.size else self._variant(key[0], font, size)
+        mask, offset = variant.getmask2(char, mode)
+        left, _, right, _ = variant.getbbox(char)
+        nbytes = mask.size[0] * mask.size[1] + _ENTRY_OVERHEAD
+        entry = (mask, offset, right - left, nbytes)
+        with self._lock:
+            if key not in self._glyphs:
+                self._glyphs[key] = entry
+                self._used += nbytes
+                while self._used > self.budget and self._glyphs:
+                    _, evicted = self._glyphs.popitem(last=False)
+                    self._used -= evicted[3]
+        return entry[:3]
+
+    def _variant(self, font_id, font, size):
+        key = (font_id, size)
+        with self._lock:
+            variant = self._variants.get(key)
+            if variant is not None:
+                self._variants.move_to_end(key)
+                return variant
+        variant = font.font_variant(size=size)
+        with self._lock:
+            self._variants[key] = variant
+            while len(self._variants) > self.max_fonts:
+                self._variants.popitem(last=False)
+        return variant
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                "glyphs": len(self._glyphs),
+                "bytes": self._used,
+                "budget": self.budget,
+                "fonts": len(self._variants),
+            })
+            return data
+
+
+glyph_atlas = GlyphAtlas()
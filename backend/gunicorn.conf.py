@@ -0,0 +1,30 @@
+"""
+gunicorn 配置
+用法：gunicorn -c gunicorn.conf.py app:app
+
+preload_app 让 master 进程先导入应用并预热（字体池、字符覆盖索引、字形缓存、试渲染），
+再 fork 出 worker：字体文件由 FreeType mmap 映射、解析好的对象写时复制共享，
+worker 被回收重启时也直接继承预热好的状态，不会冷启动
+"""
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+# 定期回收 worker，避免长时间运行后内存增长；0 表示不回收
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server):
+    # master 进程已导入应用、尚未 fork worker
+    import app
+
+    app.warm_up()
+    # 把预热后的对象移出垃圾回收的跟踪范围，避免 worker 中的 GC 触碰它们导致共享内存页被复制
+    gc.freeze()
@@ -0,0 +1,158 @@
+"""
+页面图片编码模块
+渲染出的页面只有纸张颜色、线条颜色和墨水颜色几种（handright 绘制文字不做抗锯齿），
+按 24 位 RGB 保存既浪费编码时间又浪费下载流量。编码前先无损地把页面转换为最紧凑的模式：
+    1  只有纯黑和纯白
+    P  不超过 256 种颜色，使用精确调色板，位深按颜色数取 1/2/4/8
+    L  超过 16 种颜色但都是灰色
+颜色超过 256 种的页面（如照片背景、带半透明水印）保持 RGB，开启 PNG_QUANTIZE 时量化为 256 色调色板（有损）
+小程序接口还可以按请求参数输出其他格式（见 IMAGE_FORMATS），每页只编码一次：
+    png            上述 PNG
+    webp           有损 WebP，质量由 quality 指定
+    webp_lossless  无损 WebP
+    jpeg           JPEG，质量由 quality 指定
+    auto           颜色少的页面用 PNG（无损且编码最快），照片类页面在客户端支持时用有损 WebP，否则用 JPEG
+"""
+import io
+import os
+import time
+import threading
+import logging
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# PNG 的 zlib 压缩级别（0-9），级别越高文件越小、编码越慢
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+# 颜色超过 256 种的页面是否量化为 256 色调色板
+PNG_QUANTIZE = os.getenv("PNG_QUANTIZE", "false").lower() == "true"
+# 有损格式（webp、jpeg）的默认质量（1-100）
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+
+IMAGE_FORMATS = ("png", "webp", "webp_lossless", "jpeg", "auto")
+
+_BLACK_WHITE = {(0, 0, 0), (255, 255, 255)}
+
+
+def palette_bits(count):
+    """容纳 count 种颜色的调色板位深"""
+    for bits in (1, 2, 4):
+        if count <= 1 << bits:
+            return bits
+    return 8
+
+
+def _palette_image(colors):
+    palette = Image.new("P", (1, 1))
+    flat = [value for color in colors for value in color]
+    # 用第一种颜色补齐 256 项；精确匹配时总是取编号最小的项，像素不会映射到补齐的项
+    palette.putpalette(flat + flat[:3] * (256 - len(colors)))
+    return palette
+
+
+def reduce_page(im, quantize=PNG_QUANTIZE):
+    """
+    把页面转换为最紧凑的图片模式
+    :param im: RGB 或 L 模式的页面，其他模式原样返回
+    :param quantize: 颜色超过 256 种时是否量化为调色板（有损）
+    :return: (image, bits)；image 为 1/P/L/RGB 模式，bits 为 P 模式的位深（其他模式为 None）
+    """
+    if im.mode not in ("RGB", "L"):
+        return im, None
+    counts = im.getcolors(256)
+    if counts is None:
+        if quantize and im.mode == "RGB":
+            return im.quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE), 8
+        return im, None
+
+    if im.mode == "L":
+        colors = [(value, value, value) for _, value in counts]
+    else:
+        colors = [color for _, color in counts]
+    if set(colors) <= _BLACK_WHITE:
+        return im.convert("1", dither=Image.Dither.NONE), None
+    if len(colors) > 16 and all(r == g == b for r, g, b in colors):
+        return (im if im.mode == "L" else im.convert("L")), None
+    return im.quantize(palette=_palette_image(colors), dither=Image.Dither.NONE), palette_bits(len(colors))
+
+
+def image_mimetype(data):
+    """按文件头识别编码后页面的 MIME 类型"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    return "image/png"
+
+
+class PageEncoder(object):
+    """
+    页面编码器，统计每种格式（PNG 按模式区分）的页数、编码后大小和耗时
+    """
+
+    def __init__(self, compress_level=PNG_COMPRESS_LEVEL, quantize=PNG_QUANTIZE):
+        self.compress_level = compress_level
+        self.quantize = quantize
+        self._lock = threading.Lock()
+        self._stats = {"pages": 0, "bytes": 0, "raw_bytes": 0, "seconds": 0.0, "modes": {}}
+
+    def _png(self, page, bits, buffer):
+        params = {"compress_level": self.compress_level}
+        if bits is not None and bits < 8:
+            params["bits"] = bits
+        page.save(buffer, format="PNG", **params)
+        return "png:" + (page.mode if bits is None else f"P{bits}")
+
+    def encode(self, im, image_format="png", quality=IMAGE_QUALITY, webp=False):
+        """
+        把一页图片编码为指定格式
+        :param image_format: IMAGE_FORMATS 之一
+        :param quality: 有损格式的质量
+        :param webp: 客户端是否支持 WebP（只影响 auto）
+        :return: 编码后的数据
+        """
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        if image_format in ("png", "auto"):
+            page, bits = reduce_page(im, self.quantize if image_format == "png" else False)
+            if image_format == "png" or page.mode != "RGB":
+                mode = self._png(page, bits, buffer)
+            else:
+                image_format = "webp" if webp else "jpeg"
+        if image_format == "webp":
+            im.save(buffer, format="WEBP", quality=quality, method=0)
+            mode = "webp"
+        elif image_format == "webp_lossless":
+            # 颜色少的页面压缩效果好且快；照片类页面用较高的 method 耗时可达数秒，用最快的 0
+            page, _ = reduce_page(im, False)
+            im.save(buffer, format="WEBP", lossless=True, method=0 if page.mode == "RGB" else 4)
+            mode = "webp_lossless"
+        elif image_format == "jpeg":
+            im.convert("RGB").save(buffer, format="JPEG", quality=quality)
+            mode = "jpeg"
+        data = buffer.getvalue()
+        elapsed = time.perf_counter() - start
+
+        logger.debug(f"页面编码: {im.width}x{im.height} {mode} {len(data)} 字节 {elapsed * 1000:.0f} ms")
+        with self._lock:
+            self._stats["pages"] += 1
+            self._stats["bytes"] += len(data)
+            self._stats["raw_bytes"] += im.width * im.height * len(im.getbands())
+            self._stats["seconds"] += elapsed
+            self._stats["modes"][mode] = self._stats["modes"].get(mode, 0) + 1
+        return data
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["modes"] = dict(self._stats["modes"])
+        data["compress_level"] = self.compress_level
+        data["quantize"] = self.quantize
+        if data["pages"]:
+            data["avg_bytes"] = data["bytes"] // data["pages"]
+            data["avg_ms"] = round(data["seconds"] * 1000 / data["pages"], 1)
+        return data
+
+
+page_encoder = PageEncoder()
@@ -0,0 +1,118 @@
+"""
+渲染页面存储模块
+小程序接口可以不再把每页图片 base64 编码后放进 JSON，而是把编码好的页面放在这里，
+每页通过 /api/miniprogram/pages/<sha256> 单独下载，JSON 只返回地址和元数据。
+页面按内容哈希保存，同一页面多次渲染只存一份；内存中按字节预算 LRU 淘汰。
+配置了 PAGE_STORE_DIR 时每页保存时同时写入磁盘：多个 gunicorn worker 共享这个目录，
+下载请求落到其他 worker 或页面已从内存淘汰时，过期时间（PAGE_STORE_TTL）内仍可下载。
+PAGE_STORE_DIR 为空时页面只在本进程内存中，只适用于单个 worker
+"""
+import os
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from content_store import ContentStore, HASH_RE
+
+logger = logging.getLogger(__name__)
+
+# 内存中页面的字节预算
+PAGE_STORE_BYTES = int(os.getenv("PAGE_STORE_BYTES", str(128 * 1024 * 1024)))
+# 页面的有效期（秒），也是下载响应的缓存时间
+PAGE_STORE_TTL = int(os.getenv("PAGE_STORE_TTL", "3600"))
+# 页面写入的目录，多个 worker 必须共享；为空时不写磁盘
+PAGE_STORE_DIR = os.getenv("PAGE_STORE_DIR", "./cache/pages")
+PAGE_STORE_DISK_BYTES = int(os.getenv("PAGE_STORE_DISK_BYTES", str(1024 * 1024 * 1024)))
+
+
+class PageStore(object):
+    """
+    sha256 -> 编码后页面的存储，内存为第一层、磁盘为可选的第二层
+    """
+
+    def __init__(self, budget=PAGE_STORE_BYTES, ttl=PAGE_STORE_TTL,
+                 directory=PAGE_STORE_DIR, disk_quota=PAGE_STORE_DISK_BYTES):
+        self.budget = budget
+        self.ttl = ttl
+        self._pages = OrderedDict()  # sha256 -> (data, expires)
+        self._used = 0
+        self._disk = ContentStore(directory, disk_quota, HASH_RE) if directory else None
+        self._lock = threading.Lock()
+        self._stats = {"puts": 0, "hits": 0, "disk_hits": 0, "misses": 0, "written": 0}
+
+    def put(self, data):
+        """
+        保存一页，重复保存同一页面只刷新过期时间
+        :return: 页面的 sha256
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._stats["puts"] += 1
+            old = self._pages.pop(digest, None)
+            if old is not None:
+                self._used -= len(old[0])
+            self._pages[digest] = (data, now + self.ttl)
+            self._used += len(data)
+            while self._used > self.budget and len(self._pages) > 1:
+                _, (old_data, _) = self._pages.popitem(last=False)
+                self._used -= len(old_data)
+        if self._disk is not None:
+            self._write(digest, data, now)
+        return digest
+
+    def _write(self, digest, data, now):
+        # 按内容哈希命名，文件已存在时内容相同，只刷新修改时间（磁盘上的过期时间）
+        path = self._disk.path(digest)
+        if path is not None:
+            try:
+                os.utime(path, (now, now))
+                return
+            except OSError:
+                pass
+        if self._disk.put(digest, data) is not None:
+            with self._lock:
+                self._stats["written"] += 1
+
+    def get(self, digest):
+        """
+        :return: 页面数据；哈希无效、页面不存在或已过期时返回 None
+        """
+        if not isinstance(digest, str) or not HASH_RE.match(digest):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._pages.get(digest)
+            if entry is not None and entry[1] > now:
+                self._pages.move_to_end(digest)
+                self._stats["hits"] += 1
+                return entry[0]
+
+        path = self._disk.path(digest) if self._disk is not None else None
+        if path is not None:
+            try:
+                # 磁盘上的页面按写入时间计算过期
+                if os.path.getmtime(path) + self.ttl > now:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                    return data
+            except OSError as e:
+                logger.warning(f"读取页面失败: {path} - {e}")
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"pages": len(self._pages), "bytes": self._used, "budget": self.budget, "ttl": self.ttl})
+        if self._disk is not None:
+            data["disk"] = self._disk.stats()
+        return data
+
+
+page_store = PageStore()
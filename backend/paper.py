@@ -0,0 +1,178 @@
+"""
+纸张背景生成模块
+用 NumPy 数组切片一次写入整组横线、竖线或点，不再逐条调用 ImageDraw.line，任意分辨率下生成都只需几次向量化写入；
+画布为每像素一个 uint32（RGBX 字节序），与 Pillow 内部的 RGB 存储一致，最后一次 frombytes 即得到图片
+纸张类型：
+    plain     纯白纸
+    lined     横线信纸：淡黄色纸张 + 3 像素粗的彩色横线
+    grid      方格纸：白色纸张 + 青色方格，格子边长为字号的 1.15 倍
+    dotted    点阵纸：白色纸张 + 按行距排列的灰色圆点
+    cornell   康奈尔笔记纸：横线信纸，左边距为线索栏、上边距为标题栏、下边距为总结栏，用双线隔开
+    tianzige  田字格：白色纸张 + 彩色实线方格，格内为虚线十字
+"""
+import numpy as np
+from PIL import Image, ImageColor
+
+PAPER_TYPES = ("plain", "lined", "grid", "dotted", "cornell", "tianzige")
+# 按格子排版（handright 的 GRID_LAYOUT）的纸张类型
+GRID_PAPER_TYPES = ("grid", "tianzige")
+
+_WHITE = (255, 255, 255)
+_CREAM = (255, 251, 240)  # 淡黄色纸张
+_GRID_COLOR = (0, 180, 180)  # 青色方格线
+_DOT_COLOR = (170, 170, 170)
+
+
+def grid_cell_size(font_size):
+    """方格纸和田字格的格子边长：比字体稍大 15%"""
+    return max(1, int(font_size * 1.15))
+
+
+def _is_lined(paper_type, isUnderlined):
+    return paper_type == "lined" or isUnderlined == True or isUnderlined == "true"
+
+
+def paper_key(width, height, line_spacing, top_margin, bottom_margin, left_margin, right_margin,
+              font_size, isUnderlined, line_color="red", paper_type="plain"):
+    """
+    只包含对生成结果有影响的参数的规范化键，用于缓存背景
+    例如纯白纸与行距、边距无关，横线纸与字号无关
+    """
+    margins = (top_margin, bottom_margin, left_margin, right_margin)
+    if paper_type == "grid":
+        return ("grid", width, height, grid_cell_size(font_size)) + margins
+    if paper_type == "tianzige":
+        return ("tianzige", width, height, grid_cell_size(font_size), line_color) + margins
+    if paper_type in ("dotted", "cornell"):
+        return (paper_type, width, height, line_spacing, line_color) + margins
+    if _is_lined(paper_type, isUnderlined):
+        return ("lined", width, height, line_spacing, line_color) + margins
+    return ("plain", width, height)
+
+
+def _span(start, end, limit):
+    """闭区间 [start, end] 裁剪到 [0, limit) 后的切片"""
+    start, end = min(start, end), max(start, end)
+    return slice(max(start, 0), min(end, limit - 1) + 1)
+
+
+def _positions(start, stop, step, limit, inclusive=False):
+    """从 start 开始每隔 step 的坐标（小于 stop，inclusive 时可等于 stop），去掉画布外的"""
+    step = max(1, step)
+    positions = np.arange(start, stop + 1 if inclusive else stop, step)
+    return positions[(positions >= 0) & (positions < limit)]
+
+
+def _pack(color):
+    """RGB 颜色打包为画布使用的 uint32 像素值"""
+    return np.frombuffer(bytes(color) + b"\xff", dtype=np.uint32)[0]
+
+
+def _canvas(width, height, color):
+    pixels = np.empty((height, width), dtype=np.uint32)
+    pixels.fill(_pack(color))
+    return pixels
+
+
+def _rules(pixels, ys, x0, x1, color, thickness=3):
+    """在 ys 处画横线，thickness 为 3 时与旧版 y-1、y、y+1 三条线相同"""
+    height, width = pixels.shape
+    offsets = np.arange(thickness) - thickness // 2
+    rows = (ys[:, None] + offsets[None, :]).ravel()
+    rows = rows[(rows >= 0) & (rows < height)]
+    pixels[rows, _span(x0, x1, width)] = _pack(color)
+
+
+def _ruled(pixels, width, height, line_spacing, top_margin, bottom_margin, left_margin, right_margin, color):
+    ys = _positions(top_margin + line_spacing, height - bottom_margin, line_spacing, height)
+    _rules(pixels, ys, left_margin, width - right_margin, color)
+
+
+def _grid(pixels, width, height, cell, top_margin, bottom_margin, left_margin, right_margin, color):
+    xs = _positions(left_margin, width - right_margin, cell, width, inclusive=True)
+    ys = _positions(top_margin, height - bottom_margin, cell, height, inclusive=True)
+    pixels[_span(top_margin, height - bottom_margin, height), xs] = _pack(color)
+    pixels[ys, _span(left_margin, width - right_margin, width)] = _pack(color)
+    return xs, ys
+
+
+def _dashes(span, length):
+    """span 范围内的虚线坐标：画 length 像素、空 length 像素"""
+    positions = np.arange(span.start, span.stop)
+    return positions[((positions - span.start) // max(1, length)) % 2 == 0]
+
+
+def create_notebook_image(
+    width,
+    height,
+    line_spacing,
+    top_margin,
+    bottom_margin,
+    left_margin,
+    right_margin,
+    font_size,
+    isUnderlined,
+    line_color="red",  # 横线颜色，默认红色
+    paper_type="plain",  # 纸张类型，见 PAPER_TYPES
+):
+    """
+    生成纸张背景（RGB）
+    :param isUnderlined: 为 True 或 "true" 时，未知的纸张类型按横线信纸处理
+    """
+    color = ImageColor.getrgb(line_color)[:3]
+
+    if paper_type == "grid":
+        pixels = _canvas(width, height, _WHITE)
+        _grid(pixels, width, height, grid_cell_size(font_size),
+              top_margin, bottom_margin, left_margin, right_margin, _GRID_COLOR)
+
+    elif paper_type == "tianzige":
+        pixels = _canvas(width, height, _WHITE)
+        cell = grid_cell_size(font_size)
+        # 只在完整的格子内画虚线十字
+        xs = _positions(left_margin, width - right_margin, cell, width, inclusive=True)
+        ys = _positions(top_margin, height - bottom_margin, cell, height, inclusive=True)
+        dash = max(2, cell // 16)
+        light = tuple(int(c + (255 - c) * 0.5) for c in color)
+        if len(xs) > 1 and len(ys) > 1:
+            mid_xs = xs[:-1] + cell // 2
+            mid_ys = ys[:-1] + cell // 2
+            rows = _dashes(slice(ys[0], ys[-1] + 1), dash)
+            cols = _dashes(slice(xs[0], xs[-1] + 1), dash)
+            pixels[np.ix_(rows, mid_xs)] = _pack(light)
+            pixels[np.ix_(mid_ys, cols)] = _pack(light)
+        _grid(pixels, width, height, cell, top_margin, bottom_margin, left_margin, right_margin, color)
+
+    elif paper_type == "dotted":
+        pixels = _canvas(width, height, _WHITE)
+        ys = _positions(top_margin + line_spacing, height - bottom_margin, line_spacing, height)
+        xs = _positions(left_margin, width - right_margin, line_spacing, width, inclusive=True)
+        size = max(2, line_spacing // 30)
+        for dy in range(size):
+            for dx in range(size):
+                rows = ys + dy - size // 2
+                cols = xs + dx - size // 2
+                pixels[np.ix_(rows[(rows >= 0) & (rows < height)], cols[(cols >= 0) & (cols < width)])] = _pack(_DOT_COLOR)
+
+    elif paper_type == "cornell":
+        pixels = _canvas(width, height, _WHITE)
+        _ruled(pixels, width, height, line_spacing, top_margin, bottom_margin, left_margin, right_margin, color)
+        gap = max(3, line_spacing // 12)
+        # 线索栏：左边距处的竖直双线
+        rows = _span(top_margin, height - bottom_margin, height)
+        for x in (left_margin - gap, left_margin - 2 * gap):
+            pixels[rows, _span(x - 1, x + 1, width)] = _pack(color)
+        # 标题栏和总结栏：上下边距处的水平双线
+        for y in (top_margin, top_margin - gap, height - bottom_margin, height - bottom_margin + gap):
+            _rules(pixels, np.array([y]), 0, width - 1, color)
+
+    elif _is_lined(paper_type, isUnderlined):
+        # 显示横线模式：淡黄色纸张 + 彩色加粗横线（3 像素）
+        pixels = _canvas(width, height, _CREAM)
+        _ruled(pixels, width, height, line_spacing, top_margin, bottom_margin, left_margin, right_margin, color)
+
+    else:
+        # 不显示横线模式：纯白色纸张
+        return Image.new("RGB", (width, height), "white")
+
+    return Image.frombytes("RGB", (width, height), pixels, "raw", "RGBX")
@@ -1,71 +1,362 @@
-import fitz  # PyMuPDF
-from PIL import Image
+from PIL import Image, features
+import io
+import os
+import zlib
+import struct
 import tempfile
-import os, shutil
 
-def generate_pdf(image_sources, output_path=None):
+from page_encoder import reduce_page, PNG_COMPRESS_LEVEL
+
+# JPEG 支持的图片模式与 PDF 颜色空间的对应关系，其他模式先转换为 RGB
+_COLOR_SPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB"}
+
+# 页面渲染的分辨率：小程序和网页版的纸张尺寸都按 300 dpi 换算为像素（A4 为 2480x3508）
+RENDER_DPI = int(os.getenv("RENDER_DPI", "300"))
+
+# PDF 输出配置。页面按颜色数分两类：纸张类页面（不超过 256 种颜色，即普通信纸、方格纸上的手写）
+# 和照片类页面（上传照片作背景、带半透明水印），括号内为 A4 手写页面每页的大致大小
+#   print    原始分辨率；纸张类页面无损调色板（约 250 KB），照片类页面 JPEG 95（约 2.5 MB）
+#   screen   缩小到 1/2（150 dpi）；纸张类页面量化为 16 色调色板（约 140 KB），照片类页面 JPEG 75（约 450 KB）
+#   compact  纸张类页面为原始分辨率的黑白图片，CCITT G4 压缩（约 75 KB）；照片类页面缩小到 1/2 的灰度 JPEG 60（约 330 KB）
+PDF_PROFILES = {
+    "print": {"reduce": 1, "colors": None, "bilevel": False, "gray": False, "quality": 95},
+    "screen": {"reduce": 2, "colors": 16, "bilevel": False, "gray": False, "quality": 75},
+    "compact": {"reduce": 2, "colors": None, "bilevel": True, "gray": True, "quality": 60},
+}
+PDF_PROFILE = os.getenv("PDF_PROFILE", "print")
+
+# 黑白页面中亮度低于该值的像素为黑色（红、蓝色横线和墨水都保留为黑色，淡黄色纸张为白色）
+_BILEVEL_THRESHOLD = 160
+
+# 常用纸张的尺寸（毫米），按分辨率换算出的页面尺寸与之相差不到 1% 时使用标准尺寸
+_PAPER_MM = {
+    "A3": (297, 420), "A4": (210, 297), "A5": (148, 210),
+    "B4": (250, 353), "B5": (176, 250), "Letter": (215.9, 279.4),
+}
+
+
+def page_size(pixel_size, dpi=RENDER_DPI):
+    """
+    像素尺寸对应的页面尺寸（pt，1 pt = 1/72 英寸），接近常用纸张时取纸张的标准尺寸
+    :return: (width, height)
+    """
+    width, height = (v * 72.0 / dpi for v in pixel_size)
+    for paper in _PAPER_MM.values():
+        for w_mm, h_mm in (paper, paper[::-1]):
+            w, h = w_mm * 72 / 25.4, h_mm * 72 / 25.4
+            if abs(width - w) <= w * 0.01 and abs(height - h) <= h * 0.01:
+                return w, h
+    return width, height
+
+
+def _num(value):
+    """PDF 中的数值：最多保留两位小数"""
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def _ccitt_stream(bw):
+    """
+    1 位图片按 CCITT G4 压缩：Pillow（libtiff）写出单条带的 TIFF，取出其中的压缩数据
+    :return: (dict 条目, 数据)；Pillow 不支持 libtiff 时返回 None
+    """
+    if not features.check("libtiff"):
+        return None
+    buffer = io.BytesIO()
+    bw.save(buffer, format="TIFF", compression="group4", tiffinfo={278: bw.height})
+    with Image.open(buffer) as tiff:
+        offsets, counts = tiff.tag_v2.get(273), tiff.tag_v2.get(279)
+    if not offsets or len(offsets) != 1:
+        return None
+    data = buffer.getvalue()[offsets[0]:offsets[0] + counts[0]]
+    # TIFF 中 0 为黑（BlackIsZero），G4 编码的白色游程对应 0，因此解码时反转
+    return (
+        f"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /CCITTFaxDecode "
+        f"/DecodeParms << /K -1 /Columns {bw.width} /Rows {bw.height} /BlackIs1 true >>"
+    ), data
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_stream(data):
+    """
+    把 PNG 的 IDAT 数据原样作为 PDF 图片流：PDF 的 Flate 预测器（Predictor 15）与 PNG 的行过滤相同，无需解码再压缩
+    :return: ((width, height), dict 条目, 数据)；隔行扫描、16 位、带 Alpha 通道或透明色的 PNG 返回 None
+    """
+    if data[:8] != _PNG_SIGNATURE:
+        return None
+    header, palette, idat = None, None, []
+    pos = 8
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack_from(">I4s", data, pos)
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = body
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"tRNS":
+            return None
+        elif kind == b"IEND":
+            break
+    if header is None or not idat:
+        return None
+    width, height, depth, color_type, _, _, interlace = header
+    if interlace or depth > 8 or color_type not in (0, 2, 3) or (color_type == 3 and not palette):
+        return None
+    if color_type == 3:
+        space, colors = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]", 1
+    elif color_type == 2:
+        space, colors = "/DeviceRGB", 3
+    else:
+        space, colors = "/DeviceGray", 1
+    return (width, height), (
+        f"/ColorSpace {space} /BitsPerComponent {depth} /Filter /FlateDecode "
+        f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent {depth} /Columns {width} >>"
+    ), b"".join(idat)
+
+
+def _jpeg_stream(data):
+    """
+    JPEG 数据原样作为 DCTDecode 图片流（只读取文件头）
+    :return: ((width, height), dict 条目, 数据)；不是灰度或 RGB JPEG 时返回 None
+    """
+    if data[:3] != b"\xff\xd8\xff":
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.format != "JPEG" or img.mode not in _COLOR_SPACES:
+                return None
+            return img.size, f"/ColorSpace {_COLOR_SPACES[img.mode]} /BitsPerComponent 8 /Filter /DCTDecode", data
+    except OSError:
+        return None
+
+
+class PdfWriter(object):
     """
-    生成PDF文件
-    :param image_sources: 图片源列表，可以是PIL Image对象列表，也可以是文件路径列表
+    流式 PDF 写入器：每加入一页就把该页的图片、内容流和页面对象写入文件，不在内存中保留之前的页面，
+    页面树、目录和交叉引用表在 close 时写在文件末尾，内存占用与页数无关
+    页面可以是 PIL Image（编码一次后嵌入），也可以是已编码的 PNG/JPEG 数据（add_encoded，原样嵌入，不再解码和重新编码）
+    用法：
+        with open(path, "wb") as f, PdfWriter(f) as writer:
+            for im in images:
+                writer.add_page(im)
+    """
+
+    def __init__(self, fp, profile=PDF_PROFILE, compress_level=PNG_COMPRESS_LEVEL, dpi=RENDER_DPI):
+        """
+        :param fp: 以二进制方式写入的文件对象（只需要 write 方法）
+        :param profile: 输出配置，见 PDF_PROFILES
+        :param compress_level: 黑白和调色板页面的 zlib 压缩级别
+        :param dpi: 页面图片的分辨率，用于换算页面的实际尺寸
+        """
+        if profile not in PDF_PROFILES:
+            raise ValueError(f"未知的 PDF 配置: {profile}")
+        self.fp = fp
+        self.profile = profile
+        self.quality = PDF_PROFILES[profile]["quality"]
+        self.compress_level = compress_level
+        self.dpi = dpi
+        self.page_count = 0
+        self._offset = 0
+        self._offsets = {}  # 对象编号 -> 文件偏移
+        self._page_ids = []
+        # 1 号为目录，2 号为页面树，都在 close 时写入
+        self._next_id = 3
+        self._closed = False
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def _write(self, data):
+        self.fp.write(data)
+        self._offset += len(data)
+
+    def _object(self, obj_id, body, stream=None):
+        self._offsets[obj_id] = self._offset
+        self._write(f"{obj_id} 0 obj\n".encode("ascii") + body)
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def _allocate(self, count):
+        first = self._next_id
+        self._next_id += count
+        return range(first, first + count)
+
+    def _flate_stream(self, page, bits):
+        """1 位或调色板图片以 Flate 无损压缩"""
+        if page.mode == "1":
+            # 1 位图片中 0 为黑、1 为白，与 DeviceGray 一致
+            return "/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode", \
+                zlib.compress(page.tobytes(), self.compress_level)
+        colors = page.getpalette()[:3 << bits]
+        raw = page.tobytes("raw", "P" if bits == 8 else f"P;{bits}")
+        return (
+            f"/ColorSpace [/Indexed /DeviceRGB {len(colors) // 3 - 1} <{bytes(colors).hex()}>] "
+            f"/BitsPerComponent {bits} /Filter /FlateDecode"
+        ), zlib.compress(raw, self.compress_level)
+
+    def _jpeg_stream(self, img):
+        if img.mode not in _COLOR_SPACES:
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=self.quality)
+        return f"/ColorSpace {_COLOR_SPACES[img.mode]} /BitsPerComponent 8 /Filter /DCTDecode", buffer.getvalue()
+
+    def _image_stream(self, img):
+        """
+        按输出配置编码页面图片
+        :return: (图片像素尺寸, dict 条目, 数据)
+        """
+        settings = PDF_PROFILES[self.profile]
+        if self.profile == "print":
+            # 黑白和不超过 256 色的页面无损嵌入，其余页面以 JPEG 嵌入
+            page, bits = reduce_page(img, quantize=False)
+            if page.mode in ("1", "P"):
+                return (img.size,) + self._flate_stream(page, bits)
+            return (img.size,) + self._jpeg_stream(img)
+
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        paper_like = img.getcolors(256) is not None
+        if paper_like and settings["bilevel"]:
+            bw = img.convert("L").point(lambda v: 0 if v < _BILEVEL_THRESHOLD else 255, "1")
+            stream = _ccitt_stream(bw) or self._flate_stream(bw, None)
+            return (bw.size,) + stream
+        if settings["reduce"] > 1:
+            img = img.reduce(settings["reduce"])
+        if paper_like and settings["colors"]:
+            page = img.quantize(settings["colors"], method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+            return (img.size,) + self._flate_stream(page, 8 if settings["colors"] > 16 else 4)
+        if settings["gray"]:
+            img = img.convert("L")
+        return (img.size,) + self._jpeg_stream(img)
+
+    def add_page(self, img):
+        """
+        嵌入一页图片，页面尺寸按图片的像素尺寸和分辨率换算为实际尺寸（300 dpi 的 A4 页面为 210x297 mm）
+        :param img: PIL Image；写入后调用方可以立即释放
+        """
+        size, image_dict, data = self._image_stream(img)
+        self._add_image(page_size(img.size, self.dpi), size, image_dict, data)
+
+    def add_encoded(self, data):
+        """
+        嵌入一页已编码的图片（如渲染缓存中的 PNG）；print 配置下 PNG 和 JPEG 原样嵌入，
+        其他格式或其他配置解码后按 add_page 处理
+        :param data: 图片文件内容
+        """
+        stream = None
+        if self.profile == "print":
+            stream = _png_stream(data) or _jpeg_stream(data)
+        if stream is None:
+            with Image.open(io.BytesIO(data)) as img:
+                self.add_page(img)
+            return
+        size = stream[0]
+        self._add_image(page_size(size, self.dpi), *stream)
+
+    def _add_image(self, page, size, image_dict, data):
+        """
+        :param page: 页面尺寸（pt）
+        :param size: 图片的像素尺寸
+        """
+        width, height = (_num(v) for v in page)
+        image_id, content_id, page_id = self._allocate(3)
+        self._object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {size[0]} /Height {size[1]} "
+            f"{image_dict} /Length {len(data)} >>"
+        ).encode("ascii"), data)
+        content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode("ascii")
+        self._object(content_id, f"<< /Length {len(content)} >>".encode("ascii"), content)
+        self._object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode("ascii"))
+        self._page_ids.append(page_id)
+        self.page_count += 1
+
+    def close(self):
+        """写入页面树、目录、交叉引用表和文件尾；不关闭 fp"""
+        if self._closed:
+            return
+        self._closed = True
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode("ascii"))
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref_offset = self._offset
+        size = self._next_id
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for obj_id in range(1, size):
+            lines.append(f"{self._offsets[obj_id]:010d} 00000 n \n")
+        self._write("".join(lines).encode("ascii"))
+        self._write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+
+
+def write_pdf(image_sources, fp, profile=PDF_PROFILE):
+    """
+    把页面逐页写入已打开的文件对象（可以是 BytesIO），不产生任何临时文件
+    :param image_sources: 图片源的可迭代对象：PIL Image 对象、已编码的图片数据（bytes）或图片文件路径
+    :param fp: 以二进制方式写入的文件对象
+    :param profile: 输出配置，见 PDF_PROFILES
+    :return: 页数
+    """
+    writer = PdfWriter(fp, profile)
+    for source in image_sources:
+        if isinstance(source, str):
+            # 如果是文件路径，读出文件内容原样嵌入
+            with open(source, "rb") as f:
+                writer.add_encoded(f.read())
+        elif isinstance(source, (bytes, bytearray)):
+            writer.add_encoded(source)
+        else:
+            writer.add_page(source)
+        # 释放当前页，避免下一页渲染时两页同时占用内存
+        del source
+    writer.close()
+    return writer.page_count
+
+
+def generate_pdf(image_sources, output_path=None, profile=PDF_PROFILE):
+    """
+    生成PDF文件，逐页写入：image_sources 可以是生成器（如 render_pages 的返回值），每页写入后即释放
+    :param image_sources: 图片源的可迭代对象，见 write_pdf
     :param output_path: 输出PDF文件的路径。如果为None，则生成临时文件
+    :param profile: 输出配置，见 PDF_PROFILES
     :return: PDF文件路径
     """
-    # 创建项目内的临时目录，避免使用系统临时目录
     project_temp_base = "./temp"
-    os.makedirs(project_temp_base, exist_ok=True)
-    temp_dir = tempfile.mkdtemp(dir=project_temp_base)
-    
-    try:
-        pdf_document = fitz.open()  # 创建一个新的空白PDF文档
-
-        for i, source in enumerate(image_sources):
-            # 处理图片源
-            if isinstance(source, str):
-                # 如果是文件路径
-                img = Image.open(source)
-                should_close = True
-            else:
-                # 如果是PIL Image对象
-                img = source
-                should_close = False
-                
-            width, height = img.size  # 获取图片原始宽高（单位：像素）
-            
-            # 保存每张图像到临时目录 (PyMuPDF insert_image 需要文件路径或流)
-            temp_img_path = os.path.join(temp_dir, f'image{i}.jpg')
-            img.save(temp_img_path, format="JPEG", quality=95)
-            
-            if should_close:
-                img.close()
-
-            # 创建新页面
-            pdf_page = pdf_document.new_page(width=width, height=height)
-
-            # 定义插入图像的矩形区域
-            rect = fitz.Rect(0, 0, width, height)
-            # 插入图像到PDF页面
-            pdf_page.insert_image(rect, filename=temp_img_path)
-            
-        # 确定输出路径
-        if output_path:
-            final_path = output_path
-        else:
-            final_path = tempfile.mktemp(suffix='.pdf', dir=project_temp_base)
+    if output_path:
+        final_path = output_path
+    else:
+        os.makedirs(project_temp_base, exist_ok=True)
+        fd, final_path = tempfile.mkstemp(suffix='.pdf', dir=project_temp_base)
+        os.close(fd)
 
-        # 保存PDF文档
-        pdf_document.save(final_path)
-        pdf_document.close()
-        
+    try:
+        with open(final_path, "wb") as f:
+            write_pdf(image_sources, f, profile)
         return final_path
-        
+
     except Exception as e:
         print(f"Error generating PDF: {e}")
+        try:
+            os.remove(final_path)
+        except OSError:
+            pass
         raise e
-    finally:
-        # 清理临时目录及其内容
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
 
 # 调用示例
-# 假设 images 是一个包含PIL Image对象的列表
+# 假设 images 是一个包含PIL Image对象的列表或生成器
 # pdf_path = generate_pdf(images)
+# 直接在内存中生成：
+# buffer = io.BytesIO(); write_pdf(pages, buffer)
@@ -0,0 +1,410 @@
+"""
+渲染结果缓存模块
+以完整渲染参数（文本、字体、背景、模板参数、随机种子）的规范化哈希作为键，缓存每页编码后的 PNG 数据
+分内存和磁盘两级，均按字节预算做 LRU 淘汰；磁盘级在多个 worker 进程之间共享
+另外按布局（不含文本的渲染参数）记录最近渲染过的文档的分页检查点，文本修改后只需从改动所在页重新渲染；
+相同参数的并发请求合并为一次渲染（single-flight）
+"""
+import os
+import json
+import time
+import struct
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 内存缓存字节预算
+RENDER_CACHE_MEMORY_BYTES = int(os.getenv("RENDER_CACHE_MEMORY_BYTES", str(256 * 1024 * 1024)))
+# 磁盘缓存字节预算，0 表示不使用磁盘缓存
+RENDER_CACHE_DISK_BYTES = int(os.getenv("RENDER_CACHE_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "./cache/render")
+# 记录分页检查点的布局数，以及每个布局保留的最近文档数（只保存在内存中）
+RENDER_HISTORY_LAYOUTS = int(os.getenv("RENDER_HISTORY_LAYOUTS", "128"))
+RENDER_HISTORY_DOCUMENTS = int(os.getenv("RENDER_HISTORY_DOCUMENTS", "4"))
+# 合并请求等待下一页的最长时间（秒），超时视为负责渲染的请求已放弃
+RENDER_FLIGHT_TIMEOUT = int(os.getenv("RENDER_FLIGHT_TIMEOUT", "120"))
+
+# 参与缓存键计算的模板参数（背景和字体单独计算）
+_TEMPLATE_FIELDS = (
+    "line_spacing",
+    "fill",
+    "left_margin",
+    "top_margin",
+    "right_margin",
+    "bottom_margin",
+    "word_spacing",
+    "line_spacing_sigma",
+    "font_size_sigma",
+    "word_spacing_sigma",
+    "start_chars",
+    "end_chars",
+    "perturb_x_sigma",
+    "perturb_y_sigma",
+    "perturb_theta_sigma",
+    "strikethrough_length_sigma",
+    "strikethrough_angle_sigma",
+    "strikethrough_width_sigma",
+    "strikethrough_probability",
+    "strikethrough_width",
+    "ink_depth_sigma",
+)
+
+
+def template_spec(template):
+    """提取模板中影响渲染结果的参数（不含背景图和字体对象）"""
+    spec = {name: getattr(template, "get_" + name)() for name in _TEMPLATE_FIELDS}
+    spec["features"] = sorted(template.get_features())
+    spec["font_size"] = template.get_font().size
+    spec["size"] = list(template.get_size())
+    return spec
+
+
+def spec_key(spec):
+    """渲染参数的规范化哈希（键顺序无关）"""
+    payload = json.dumps(spec, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def seed_from_key(key):
+    """客户端未指定 seed 时，由渲染参数的哈希推导出确定的种子"""
+    return int(key[:8], 16)
+
+
+def _pack_pages(pages):
+    header = struct.pack(">I", len(pages)) + b"".join(struct.pack(">Q", len(p)) for p in pages)
+    return header + b"".join(pages)
+
+
+def _unpack_pages(blob):
+    (count,) = struct.unpack_from(">I", blob, 0)
+    lengths = struct.unpack_from(">" + "Q" * count, blob, 4)
+    offset = 4 + 8 * count
+    pages = []
+    for length in lengths:
+        pages.append(blob[offset:offset + length])
+        offset += length
+    return pages
+
+
+class RenderCache(object):
+    """
+    两级渲染缓存：键为 spec_key，值为每页编码后数据（bytes）的列表
+    """
+
+    def __init__(self, memory_bytes=RENDER_CACHE_MEMORY_BYTES, disk_bytes=RENDER_CACHE_DISK_BYTES,
+                 cache_dir=RENDER_CACHE_DIR):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.cache_dir = cache_dir
+        self._memory = OrderedDict()  # key -> (pages, nbytes)
+        self._memory_used = 0
+        self._disk_index = None  # key -> [nbytes, last_used]，首次使用时扫描目录建立
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def get(self, key):
+        """返回缓存的页面列表，未命中返回 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry[0]
+        pages = self._disk_get(key)
+        with self._lock:
+            if pages is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._memory_put_locked(key, pages)
+        return pages
+
+    def put(self, key, pages):
+        pages = list(pages)
+        with self._lock:
+            self._memory_put_locked(key, pages)
+        self._disk_put(key, pages)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "memory_budget": self.memory_bytes,
+                "disk_entries": len(self._disk_index or {}),
+                "disk_bytes": self._disk_used,
+                "disk_budget": self.disk_bytes,
+            })
+            return data
+
+    # ---------- 内存级 ----------
+
+    def _memory_put_locked(self, key, pages):
+        nbytes = sum(len(p) for p in pages)
+        if nbytes > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= old[1]
+        self._memory[key] = (pages, nbytes)
+        self._memory_used += nbytes
+        while self._memory_used > self.memory_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_used -= evicted
+
+    # ---------- 磁盘级 ----------
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".bin")
+
+    def _load_disk_index_locked(self):
+        if self._disk_index is not None:
+            return
+        self._disk_index = {}
+        self._disk_used = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".bin"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                self._disk_index[name[:-4]] = [st.st_size, st.st_mtime]
+                self._disk_used += st.st_size
+
+    def _disk_get(self, key):
+        if self.disk_bytes <= 0:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            os.utime(path)  # 刷新最近使用时间，供 LRU 淘汰参考
+        except OSError:
+            return None
+        try:
+            pages = _unpack_pages(blob)
+        except struct.error:
+            logger.warning(f"渲染缓存文件损坏，已删除: {path}")
+            self._disk_remove(key)
+            return None
+        with self._lock:
+            self._load_disk_index_locked()
+            entry = self._disk_index.get(key)
+            if entry is None:
+                # 其他 worker 进程写入的条目
+                self._disk_index[key] = [len(blob), time.time()]
+                self._disk_used += len(blob)
+            else:
+                entry[1] = time.time()
+        return pages
+
+    def _disk_put(self, key, pages):
+        if self.disk_bytes <= 0:
+            return
+        blob = _pack_pages(pages)
+        if len(blob) > self.disk_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入渲染缓存失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._load_disk_index_locked()
+            old = self._disk_index.get(key)
+            if old is not None:
+                self._disk_used -= old[0]
+            self._disk_index[key] = [len(blob), time.time()]
+            self._disk_used += len(blob)
+            evicted = []
+            if self._disk_used > self.disk_bytes:
+                for old_key, _ in sorted(self._disk_index.items(), key=lambda item: item[1][1]):
+                    if self._disk_used <= self.disk_bytes:
+                        break
+                    if old_key == key:
+                        continue
+                    evicted.append(old_key)
+                    self._disk_used -= self._disk_index.pop(old_key)[0]
+        for old_key in evicted:
+            self._disk_remove(old_key, update_index=False)
+
+    def _disk_remove(self, key, update_index=True):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        if update_index:
+            with self._lock:
+                if self._disk_index is not None and key in self._disk_index:
+                    self._disk_used -= self._disk_index.pop(key)[0]
+
+
+class LayoutHistory(object):
+    """
+    最近渲染过的文档的分页记录，用于编辑后的增量重渲染
+    键为布局键，值为该布局下最近几份文档的 (layout, cache_key)；layout 为 render_engine.PageLayout，
+    页面数据本身仍保存在渲染缓存中，被淘汰后对应文档就不再复用
+    """
+
+    def __init__(self, cache, max_layouts=RENDER_HISTORY_LAYOUTS, max_documents=RENDER_HISTORY_DOCUMENTS):
+        self.cache = cache
+        self.max_layouts = max_layouts
+        self.max_documents = max_documents
+        self._layouts = OrderedDict()  # layout_key -> [(layout, cache_key), ...]，最近的在前
+        self._lock = threading.Lock()
+        self._stats = {"resumed": 0, "reused_pages": 0}
+
+    def put(self, layout_key, layout, cache_key):
+        if self.max_layouts <= 0:
+            return
+        with self._lock:
+            documents = [doc for doc in self._layouts.pop(layout_key, []) if doc[1] != cache_key]
+            documents.insert(0, (layout, cache_key))
+            self._layouts[layout_key] = documents[:self.max_documents]
+            while len(self._layouts) > self.max_layouts:
+                self._layouts.popitem(last=False)
+
+    def resume(self, layout_key, text):
+        """
+        在该布局的最近文档中找出排版不变的页数最多的一份
+        :return: (layout, pages)：layout 为从第一张改动页继续排版的 PageLayout，pages 为可直接复用的页面；
+                 没有可复用的页面时返回 (None, [])
+        """
+        with self._lock:
+            documents = list(self._layouts.get(layout_key, ()))
+            if documents:
+                self._layouts.move_to_end(layout_key)
+        best = None
+        for layout, cache_key in documents:
+            reusable = layout.reusable_pages(text)
+            if reusable and (best is None or reusable > best[0]):
+                best = (reusable, layout, cache_key)
+        if best is None:
+            return None, []
+        reusable, layout, cache_key = best
+        pages = self.cache.get(cache_key)
+        if not pages:
+            return None, []
+        # 只渲染了前几页的文档（如网页版首页预览）缓存的页数可能少于排版记录
+        reusable = min(reusable, len(pages))
+        with self._lock:
+            self._stats["resumed"] += 1
+            self._stats["reused_pages"] += reusable
+        return layout.derive(text, reusable), pages[:reusable]
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["layouts"] = len(self._layouts)
+            return data
+
+
+class _Flight(object):
+    """一次进行中的渲染，逐页发布结果"""
+
+    def __init__(self):
+        self.pages = []
+        self.done = False
+        self.ok = False
+        self.cond = threading.Condition()
+
+
+class SingleFlight(object):
+    """
+    合并相同渲染参数的并发请求：第一个请求（leader）负责渲染并逐页发布，
+    其余请求（follower）等待并共享已发布的页面，无需等整份渲染完成
+    """
+
+    def __init__(self, timeout=RENDER_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0, "saved_pages": 0, "abandoned": 0}
+
+    def join(self, key):
+        """
+        加入 key 对应的渲染
+        :return: (flight, leader)；leader 为 True 时调用方负责渲染，并调用 publish / finish
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["followers"] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self._stats["leaders"] += 1
+            return flight, True
+
+    def active(self, key):
+        """key 对应的渲染是否正在进行"""
+        with self._lock:
+            return key in self._flights
+
+    def publish(self, flight, page):
+        with flight.cond:
+            flight.pages.append(page)
+            flight.cond.notify_all()
+
+    def finish(self, key, flight, ok):
+        """渲染结束；ok 为 False 表示 leader 中途放弃（如客户端断开或渲染失败）"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if not ok:
+                self._stats["abandoned"] += 1
+        with flight.cond:
+            flight.done = True
+            flight.ok = ok
+            flight.cond.notify_all()
+
+    def follow(self, flight):
+        """
+        逐页返回 leader 发布的页面；结束后通过 flight.ok 判断是否完整
+        等待超时同样视为不完整
+        """
+        index = 0
+        while True:
+            with flight.cond:
+                if index >= len(flight.pages) and not flight.done:
+                    flight.cond.wait(self.timeout)
+                if index >= len(flight.pages) and not flight.done:
+                    logger.warning("等待合并的渲染超时")
+                    return
+                pages = flight.pages[index:]
+                done = flight.done
+            for page in pages:
+                index += 1
+                with self._lock:
+                    self._stats["saved_pages"] += 1
+                yield page
+            if done and index >= len(flight.pages):
+                return
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["in_flight"] = len(self._flights)
+            return data
+
+
+render_cache = RenderCache()
+layout_history = LayoutHistory(render_cache)
+render_flight = SingleFlight()
@@ -0,0 +1,468 @@
+"""
+多进程手写渲染引擎
+handright 的渲染分为两步：排版（把文字按页切分并画到黑白草稿上）和笔画扰动（逐像素提取笔画并随机偏移，
+纯 Python、最耗时）。排版依赖同一个随机数序列，只能按顺序执行；笔画扰动每页独立播种，可以按页并行。
+这里在当前进程排版，把每页的笔画扰动分发到进程池，结果按页序返回；指定 seed 时输出与顺序渲染完全一致
+
+排版时记录每页开始处的文本位置和随机数状态（PageLayout），文本修改后可以从第一处改动所在的页继续排版，
+之前的页面直接复用上次的渲染结果
+
+排版时的字形从 glyph_atlas 取出栅格化好的掩码直接贴到草稿上，不再逐字调用 FreeType
+
+estimate_layout 只按字形宽度计算换行和分页、不绘制任何字形，用于估算页数和渲染耗时
+"""
+import os
+import copy
+import time
+import random
+import threading
+import logging
+import multiprocessing
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+from handright import Feature, LayoutError
+from handright._core import (
+    _Renderer, _check_template, _draw_strikethrough, _preprocess_text, _INTERNAL_MODE, _BLACK, _WHITE, _LF
+)
+from handright._util import Page, gauss
+
+from glyph_atlas import glyph_atlas
+from background_cache import background_cache
+
+logger = logging.getLogger(__name__)
+
+# 渲染进程数，0 或 1 表示在当前进程顺序渲染
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(os.cpu_count() or 1)))
+
+# 子进程只画墨迹层，再在主进程合成到背景上；目前只支持 RGB 背景
+_INK_MODES = {"RGB": "RGBA"}
+
+# 低分辨率预览时同比缩放的模板参数：像素长度取整，位移扰动的标准差保持浮点；角度扰动和墨水深度与尺寸无关
+_SCALED_LENGTHS = ("line_spacing", "left_margin", "top_margin", "right_margin", "bottom_margin", "word_spacing")
+_SCALED_SIGMAS = (
+    "line_spacing_sigma",
+    "font_size_sigma",
+    "word_spacing_sigma",
+    "perturb_x_sigma",
+    "perturb_y_sigma",
+    "strikethrough_length_sigma",
+    "strikethrough_width_sigma",
+    "strikethrough_width",
+)
+
+# 每单位字形面积（字数 × 字号²）的渲染耗时（秒），按实际渲染结果滑动平均，用于估算渲染时间
+_render_cost = float(os.getenv("RENDER_COST_PER_GLYPH_PIXEL", "2e-6"))
+_render_cost_lock = threading.Lock()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class _InkCanvas(object):
+    """
+    代替模板背景传给子进程，避免每页都序列化整张背景图
+    handright 渲染时只会读取背景的 size 并调用 copy() 作为画布，这里返回透明画布，只记录墨迹
+    """
+
+    __slots__ = ("mode", "size")
+
+    def __init__(self, mode, size):
+        self.mode = mode
+        self.size = size
+
+    def copy(self):
+        return Image.new(self.mode, self.size, (0, 0, 0, 0))
+
+
+class _Checkpoint(object):
+    """某页开始排版时的状态：页号、文本起始位置、随机数状态"""
+
+    __slots__ = ("num", "start", "state")
+
+    def __init__(self, num, start, rand):
+        self.num = num
+        self.start = start
+        version, internal, gauss_next = rand.getstate()
+        # 以 array 保存 Mersenne Twister 的 625 个状态字，比元组省内存
+        self.state = (version, array("I", internal), gauss_next)
+
+    def restore(self, rand):
+        version, internal, gauss_next = self.state
+        rand.setstate((version, tuple(internal), gauss_next))
+
+
+class PageLayout(object):
+    """
+    一次排版的分页记录：checkpoints[i] 是第 i 页开始排版时的状态，排完一页就追加下一页的起点，
+    因此第 i 页使用的文本为 text[checkpoints[i].start:checkpoints[i + 1].start]
+    """
+
+    def __init__(self, text, checkpoints=None):
+        self.text = _preprocess_text(text)
+        self.checkpoints = list(checkpoints or [])
+
+    def reusable_pages(self, text):
+        """
+        换成 text 后前多少页的排版不变
+        第 i 页的排版只取决于页首的随机数状态和它读取过的文本；换行判断还会读取下一页的第一个字符，
+        所以要求公共前缀覆盖到下一页起点（含）
+        """
+        text = _preprocess_text(text)
+        prefix = 0
+        for a, b in zip(self.text, text):
+            if a != b:
+                break
+            prefix += 1
+        pages = 0
+        while pages + 1 < len(self.checkpoints) and self.checkpoints[pages + 1].start < prefix:
+            pages += 1
+        return pages
+
+    def derive(self, text, pages):
+        """为 text 创建新的排版记录，前 pages 页沿用本次的检查点，从第 pages 页继续排版"""
+        return PageLayout(text, self.checkpoints[:pages + 1])
+
+    def page_count(self):
+        return max(len(self.checkpoints) - 1, 0)
+
+
+def scale_template(template, scale, background_key=None):
+    """
+    按比例缩小模板，用于低分辨率快速预览：纸张、字号、边距、间距和位移扰动同比缩放，
+    每页像素数约为原来的 scale² 倍。由于取整，分页可能与原分辨率略有不同
+    :param scale: 缩放比例，不小于 1 时原样返回
+    :param background_key: 背景图的可哈希键；指定时缩小后的背景缓存在 background_cache 中，
+                           同一背景再次预览时不再缩放原分辨率的背景
+    """
+    if scale >= 1:
+        return template
+    scaled = copy.copy(template)
+    background = template.get_background()
+    size = (max(1, round(background.width * scale)), max(1, round(background.height * scale)))
+    if background_key is None:
+        scaled.set_background(background.resize(size, Image.Resampling.LANCZOS))
+    else:
+        scaled.set_background(background_cache.get(
+            ("scaled", background_key, background.size, background.mode, size),
+            lambda: background.resize(size, Image.Resampling.LANCZOS),
+        ))
+    font = template.get_font()
+    scaled.set_font(font.font_variant(size=max(1, round(font.size * scale))))
+    for name in _SCALED_LENGTHS:
+        getattr(scaled, "set_" + name)(round(getattr(template, "get_" + name)() * scale))
+    for name in _SCALED_SIGMAS:
+        getattr(scaled, "set_" + name)(getattr(template, "get_" + name)() * scale)
+    return scaled
+
+
+def _draw_page(page, text, start, tpl, rand):
+    """与 handright._core._draw_page 相同的排版和随机数序列，字形改为从 glyph_atlas 取出后贴到草稿上"""
+    _check_template(page, tpl)
+
+    width = page.width()
+    height = page.height()
+    top_margin = tpl.get_top_margin()
+    bottom_margin = tpl.get_bottom_margin()
+    left_margin = tpl.get_left_margin()
+    right_margin = tpl.get_right_margin()
+    line_spacing = tpl.get_line_spacing()
+    font_size = tpl.get_font().size
+    start_chars = tpl.get_start_chars()
+    end_chars = tpl.get_end_chars()
+    grid = Feature.GRID_LAYOUT in tpl.get_features()
+    layout_char = _grid_char if grid else _flow_char
+
+    draw = page.draw()
+    ink = draw.draw.draw_ink(_WHITE)
+    y = top_margin + line_spacing - font_size
+    while y <= height - bottom_margin - font_size:
+        x = left_margin
+        while True:
+            if text[start] == _LF:
+                start += 1
+                if start == len(text):
+                    return start
+                break
+            if x > width - right_margin - 2 * font_size and text[start] in start_chars:
+                break
+            if x > width - right_margin - font_size and text[start] not in end_chars:
+                break
+
+            # 随机写错一个字再划掉（与 handright 一致，错字的选取使用全局 random）
+            if rand.random() < tpl.get_strikethrough_probability():
+                wrong_char_index = random.randint(0, len(text) - 1)
+                wrong_end_chars = end_chars + " "
+                while text[wrong_char_index] in wrong_end_chars:
+                    wrong_char_index = random.randint(0, len(text) - 1)
+                origin_x = x
+                x = layout_char(draw, ink, x, y, text[wrong_char_index], tpl, rand)
+                _draw_strikethrough(draw, origin_x, y, tpl, rand)
+
+            x = layout_char(draw, ink, x, y, text[start], tpl, rand)
+            start += 1
+            if start == len(text):
+                return start
+        y += line_spacing
+    return start
+
+
+def _flow_char(draw, ink, x, y, char, tpl, rand):
+    xy = (round(x), round(gauss(rand, y, tpl.get_line_spacing_sigma())))
+    advance = _draw_glyph(draw, ink, xy, char, tpl, rand)
+    return x + gauss(rand, tpl.get_word_spacing() + advance, tpl.get_word_spacing_sigma())
+
+
+def _grid_char(draw, ink, x, y, char, tpl, rand):
+    xy = (
+        round(gauss(rand, x, tpl.get_word_spacing_sigma())),
+        round(gauss(rand, y, tpl.get_line_spacing_sigma())),
+    )
+    _draw_glyph(draw, ink, xy, char, tpl, rand)
+    return x + tpl.get_word_spacing() + tpl.get_font().size
+
+
+def _draw_glyph(draw, ink, xy, char, tpl, rand):
+    """按随机字号从字形缓存取出掩码绘制，返回字宽"""
+    font = tpl.get_font()
+    size = max(round(gauss(rand, font.size, tpl.get_font_size_sigma())), 0)
+    mask, offset, advance = glyph_atlas.glyph(font, size, char, draw.fontmode)
+    draw.draw.draw_bitmap((xy[0] + offset[0], xy[1] + offset[1]), mask, ink)
+    return advance
+
+
+def _draft(layout, templates, seed=None):
+    """
+    与 handright._core._draft 相同的排版过程，从 layout 的最后一个检查点开始，并记录每页的检查点
+    """
+    text = layout.text
+    rand = random.Random(x=seed)
+    if not layout.checkpoints:
+        layout.checkpoints.append(_Checkpoint(0, 0, rand))
+    checkpoint = layout.checkpoints[-1]
+    checkpoint.restore(rand)
+    num, start = checkpoint.num, checkpoint.start
+    while start < len(text):
+        template = templates[num % len(templates)]
+        page = Page(_INTERNAL_MODE, template.get_size(), _BLACK, num)
+        start = _draw_page(page, text, start, template, rand)
+        num += 1
+        layout.checkpoints.append(_Checkpoint(num, start, rand))
+        yield page
+
+
+def _render_ink(renderer, page):
+    """子进程中执行：渲染一页的墨迹层，只返回有内容的区域"""
+    ink = renderer(page)
+    bbox = ink.getbbox()
+    if bbox is None:
+        return None, None
+    return bbox, ink.crop(bbox)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 使用 spawn 启动子进程，避免 fork 多线程的 web 进程带来的锁问题
+            _executor = ProcessPoolExecutor(
+                max_workers=RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info(f"渲染进程池已启动，进程数: {RENDER_PROCESSES}")
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _ink_templates(templates):
+    ink_templates = []
+    for template in templates:
+        background = template.get_background()
+        ink_template = copy.copy(template)
+        ink_template.set_background(_InkCanvas(_INK_MODES[background.mode], background.size))
+        ink_templates.append(ink_template)
+    return tuple(ink_templates)
+
+
+def render_pages(text, template, seed=None, lookahead=None, on_total=None, layout=None):
+    """
+    渲染手写图片，按页序逐页返回 PIL Image，用法与 handright.handwrite 相同
+    :param text: 要渲染的文本
+    :param template: Template 或 Template 序列（按页循环使用）
+    :param seed: 随机种子（建议用整数），相同 seed 输出相同
+    :param lookahead: 最多提前排版并提交渲染的页数；None 为进程数的 2 倍，0 为不限制
+    :param on_total: 排版全部完成后回调总页数（包括 layout 中沿用的页）
+    :param layout: PageLayout，用于记录分页检查点；由 PageLayout.derive 得到时只渲染沿用页之后的页面，
+                   seed 和模板必须与原排版相同
+    """
+    templates = (template,) if not isinstance(template, (list, tuple)) else tuple(template)
+    if layout is None:
+        layout = PageLayout(text)
+    start = layout.checkpoints[-1].start if layout.checkpoints else 0
+    started = time.time()
+    yield from _render_pages(layout, templates, seed, lookahead, on_total)
+    # 只统计完整渲染（中途停止的不计入）
+    _record_render_cost(layout.text[start:], templates[0].get_font().size, time.time() - started)
+
+
+def _render_pages(layout, templates, seed, lookahead, on_total):
+    pages = _draft(layout, templates, seed)
+
+    parallel = RENDER_PROCESSES > 1 and all(
+        t.get_background().mode in _INK_MODES for t in templates
+    )
+    if not parallel:
+        yield from _render_sequential(pages, templates, seed, on_total, layout)
+        return
+
+    # 先排两页：只有一页时没有并行的必要，直接在当前进程渲染
+    head = []
+    for page in pages:
+        head.append(page)
+        if len(head) == 2:
+            break
+    if len(head) < 2:
+        yield from _render_sequential(head, templates, seed, on_total, layout)
+        return
+
+    if lookahead is None:
+        lookahead = RENDER_PROCESSES * 2
+    backgrounds = [t.get_background() for t in templates]
+    ink_renderer = _Renderer(_ink_templates(templates), seed)
+    executor = _get_executor()
+    pending = deque()
+
+    def merge(page_num, future):
+        try:
+            bbox, ink = future.result()
+        except BrokenProcessPool:
+            _reset_executor()
+            raise
+        canvas = backgrounds[page_num % len(backgrounds)].copy()
+        if ink is not None:
+            canvas.paste(ink, bbox[:2], ink)
+        return canvas
+
+    try:
+        total = 0
+        for page in _chain(head, pages):
+            total += 1
+            pending.append((page.num, executor.submit(_render_ink, ink_renderer, page)))
+            # 队首已完成或提前量已满时先交付，保证首页尽快返回
+            while pending and (pending[0][1].done() or (lookahead and len(pending) >= lookahead)):
+                yield merge(*pending.popleft())
+        if on_total is not None:
+            on_total(layout.page_count())
+        while pending:
+            yield merge(*pending.popleft())
+    finally:
+        # 调用方提前停止（如客户端断开）时取消尚未开始的页面
+        for _, future in pending:
+            future.cancel()
+
+
+def _glyph_area(text, font_size):
+    return (len(text) - text.count(" ") - text.count(_LF)) * font_size * font_size
+
+
+def _record_render_cost(text, font_size, seconds):
+    global _render_cost
+    area = _glyph_area(text, font_size)
+    if area <= 0:
+        return
+    with _render_cost_lock:
+        _render_cost = _render_cost * 0.8 + seconds / area * 0.2
+
+
+def estimate_layout(text, template):
+    """
+    只排版不绘制：与 handright 相同的换行和分页规则（边距、间距、start_chars / end_chars），
+    字宽取字形包围盒宽度，随机扰动取期望值且不考虑删除线，因此页数可能与实际渲染相差一页左右
+    :return: {"pages", "lines", "chars", "estimated_seconds"}
+    """
+    templates = (template,) if not isinstance(template, (list, tuple)) else tuple(template)
+    text = _preprocess_text(text)
+    advances = [{} for _ in templates]
+    pages = lines = start = 0
+    while start < len(text):
+        index = pages % len(templates)
+        end, page_lines = _estimate_page(text, start, templates[index], advances[index])
+        if end == start:
+            raise LayoutError("no line fits in the page")
+        start = end
+        pages += 1
+        lines += page_lines
+    font_size = templates[0].get_font().size
+    return {
+        "pages": pages,
+        "lines": lines,
+        "chars": len(text) - text.count(" ") - text.count(_LF),
+        "estimated_seconds": round(_glyph_area(text, font_size) * _render_cost, 2),
+    }
+
+
+def _estimate_page(text, start, tpl, advances):
+    """按 handright._core._draw_page 的规则排一页，返回 (下一页起始位置, 行数)"""
+    width, height = tpl.get_size()
+    font = tpl.get_font()
+    font_size = font.size
+    right_limit = width - tpl.get_right_margin()
+    line_spacing = tpl.get_line_spacing()
+    word_spacing = tpl.get_word_spacing()
+    start_chars = tpl.get_start_chars()
+    end_chars = tpl.get_end_chars()
+    grid = Feature.GRID_LAYOUT in tpl.get_features()
+
+    lines = 0
+    y = tpl.get_top_margin() + line_spacing - font_size
+    while y <= height - tpl.get_bottom_margin() - font_size:
+        x = tpl.get_left_margin()
+        lines += 1
+        while True:
+            char = text[start]
+            if char == _LF:
+                start += 1
+                if start == len(text):
+                    return start, lines
+                break
+            if x > right_limit - 2 * font_size and char in start_chars:
+                break
+            if x > right_limit - font_size and char not in end_chars:
+                break
+            if grid:
+                x += word_spacing + font_size
+            else:
+                advance = advances.get(char)
+                if advance is None:
+                    left, _, right, _ = font.getbbox(char)
+                    advance = advances[char] = right - left
+                x += word_spacing + advance
+            start += 1
+            if start == len(text):
+                return start, lines
+        y += line_spacing
+    return start, lines
+
+
+def _render_sequential(pages, templates, seed, on_total, layout):
+    renderer = _Renderer(templates, seed)
+    if on_total is not None:
+        pages = list(pages)
+        on_total(layout.page_count())
+    for page in pages:
+        yield renderer(page)
+
+
+def _chain(head, pages):
+    yield from head
+    yield from pages
@@ -0,0 +1,302 @@
+"""
+渲染任务队列模块
+把耗时的手写渲染和打包放到后台线程池中执行，请求线程只负责提交任务并立即返回任务ID，
+客户端通过轮询或订阅（SSE）获取任务状态和进度（已完成页数 / 总页数）。
+任务在提交它的 worker 进程中执行，状态每次变化时写入 RENDER_JOB_DIR，多个 gunicorn worker 共享这个目录，
+轮询或订阅请求落到其他 worker 时从目录读取状态；RENDER_JOB_DIR 为空时状态只在本进程内存中，只适用于单个 worker
+"""
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 后台渲染线程数（同时执行的渲染任务数）
+RENDER_JOB_WORKERS = int(os.getenv("RENDER_JOB_WORKERS", "2"))
+# 排队中的任务上限，超过后拒绝提交
+RENDER_JOB_MAX_PENDING = int(os.getenv("RENDER_JOB_MAX_PENDING", "20"))
+# 任务结果保留时间（秒），与下载文件的过期时间一致
+RENDER_JOB_TTL = int(os.getenv("RENDER_JOB_TTL", "3600"))
+# 任务状态文件的目录，多个 worker 必须共享；为空时不写文件
+RENDER_JOB_DIR = os.getenv("RENDER_JOB_DIR", "./cache/jobs")
+# 订阅（SSE）连接的最长时间（秒），超过后推送 timeout 事件并关闭，客户端改为轮询或重新订阅
+RENDER_JOB_EVENTS_MAX_SECONDS = int(os.getenv("RENDER_JOB_EVENTS_MAX_SECONDS", "300"))
+# 订阅其他 worker 的任务时读取状态文件的间隔（秒）
+RENDER_JOB_POLL_INTERVAL = 0.5
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+    pass
+
+
+class RenderJob(object):
+    """单个渲染任务的状态"""
+
+    def __init__(self, job_id, on_change=None):
+        """
+        :param on_change: 状态变化后的回调 on_change(job)，在锁外调用
+        """
+        self.id = job_id
+        self.state = JOB_QUEUED
+        self.pages_done = 0
+        self.pages_total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # 每次状态变化递增，订阅者据此判断是否有新进度
+        self.version = 0
+        self._on_change = on_change
+        self._cond = threading.Condition()
+
+    def _touch(self):
+        self.version += 1
+        self.updated_at = time.time()
+        self._cond.notify_all()
+
+    def set_state(self, state, result=None, error=None):
+        with self._cond:
+            self.state = state
+            if result is not None:
+                self.result = result
+            if error is not None:
+                self.error = error
+            self._touch()
+        self._changed()
+
+    def set_total(self, pages_total):
+        """设置总页数（排版完成后才能确定）"""
+        with self._cond:
+            self.pages_total = pages_total
+            self._touch()
+        self._changed()
+
+    def advance(self, pages=1):
+        """完成若干页"""
+        with self._cond:
+            self.pages_done += pages
+            self._touch()
+        self._changed()
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def is_finished(self):
+        return self.state in (JOB_DONE, JOB_FAILED)
+
+    def wait_for_update(self, version, timeout=15):
+        """
+        阻塞直到任务版本号大于 version 或超时
+        :return: 当前版本号
+        """
+        with self._cond:
+            if self.version <= version and not self.is_finished():
+                self._cond.wait(timeout)
+            return self.version
+
+    def to_dict(self):
+        with self._cond:
+            data = {
+                "job_id": self.id,
+                "state": self.state,
+                "pages_done": self.pages_done,
+                "pages_total": self.pages_total,
+                "created_at": int(self.created_at),
+                "updated_at": int(self.updated_at),
+            }
+            if self.pages_total:
+                data["progress"] = round(min(self.pages_done / self.pages_total, 1.0), 4)
+            else:
+                data["progress"] = 1.0 if self.state == JOB_DONE else 0.0
+            if self.state == JOB_DONE and self.result is not None:
+                data["result"] = self.result
+            if self.state == JOB_FAILED:
+                data["error"] = self.error
+            return data
+
+
+class StoredJob(object):
+    """
+    其他 worker 进程提交的任务，状态从任务目录中的文件读取（只读）
+    """
+
+    def __init__(self, path, data):
+        self._path = path
+        self._load(data)
+
+    def _load(self, data):
+        self.version = data["version"]
+        self._data = data["job"]
+        self.id = self._data["job_id"]
+        self.state = self._data["state"]
+
+    def is_finished(self):
+        return self.state in (JOB_DONE, JOB_FAILED)
+
+    def wait_for_update(self, version, timeout=15):
+        """
+        定期重新读取状态文件，直到版本号大于 version 或超时
+        :return: 当前版本号
+        """
+        deadline = time.time() + timeout
+        while self.version <= version and not self.is_finished() and time.time() < deadline:
+            time.sleep(RENDER_JOB_POLL_INTERVAL)
+            data = _read_job_file(self._path)
+            if data is not None:
+                self._load(data)
+        return self.version
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def _read_job_file(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class RenderJobQueue(object):
+    """
+    有界的后台渲染任务队列
+    任务函数签名为 fn(job)，通过 job.set_total / job.advance 上报进度，返回值作为任务结果
+    """
+
+    def __init__(self, max_workers=RENDER_JOB_WORKERS, max_pending=RENDER_JOB_MAX_PENDING,
+                 ttl=RENDER_JOB_TTL, directory=RENDER_JOB_DIR):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.directory = directory
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        # 延迟创建线程池，避免在 gunicorn master 进程（preload）中启动线程
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="render-job"
+            )
+        return self._executor
+
+    def submit(self, fn):
+        """
+        提交任务，立即返回 RenderJob
+        队列已满时抛出 QueueFullError
+        """
+        with self._lock:
+            self._cleanup_locked()
+            pending = sum(1 for job in self._jobs.values() if not job.is_finished())
+            if pending >= self.max_pending:
+                raise QueueFullError(f"render queue is full ({pending} pending)")
+            job = RenderJob(str(uuid.uuid4()), self._save)
+            self._jobs[job.id] = job
+            executor = self._get_executor()
+        self._save(job)
+        executor.submit(self._run, job, fn)
+        logger.info(f"渲染任务已提交: {job.id}, 当前排队 {pending + 1}")
+        return job
+
+    def _run(self, job, fn):
+        job.set_state(JOB_RUNNING)
+        start = time.time()
+        try:
+            result = fn(job)
+            job.set_state(JOB_DONE, result=result)
+            logger.info(f"渲染任务完成: {job.id}, 共 {job.pages_done} 页, 耗时 {time.time() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"渲染任务失败: {job.id} - {e}", exc_info=True)
+            job.set_state(JOB_FAILED, error=str(e))
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _save(self, job):
+        """把任务状态原子地写入任务目录"""
+        if not self.directory:
+            return
+        data = {"version": job.version, "job": job.to_dict()}
+        path = self._path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"写入任务状态失败: {path} - {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def get(self, job_id):
+        """
+        :return: 本进程的 RenderJob，或其他 worker 提交的 StoredJob；任务不存在或已过期时返回 None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not self.directory or not _JOB_ID_RE.match(job_id):
+            return job
+        path = self._path(job_id)
+        data = _read_job_file(path)
+        if data is None:
+            return None
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+        except OSError:
+            return None
+        return StoredJob(path, data)
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "jobs": states,
+            }
+
+    def _cleanup_locked(self):
+        # 清理过期的已完成任务
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.is_finished() and now - job.updated_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        # 任务目录中长时间未更新的状态文件（包括已退出的 worker 留下的）
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+render_job_queue = RenderJobQueue()
+
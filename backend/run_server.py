@@ -1,6 +1,6 @@
 import subprocess
 import threading
-from app import app
+from app import app, warm_up
 import os
 import sys
 
@@ -32,5 +32,6 @@ if __name__ == '__main__':
     frontend_thread = threading.Thread(target=start_frontend, daemon=True)
     frontend_thread.start()
     
-    # 启动后端服务器（主线程）
+    # 预热字体和渲染路径，然后启动后端服务器（主线程）
+    warm_up()
     start_backend()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+from PIL import Image, ImageDraw, ImageFont, ImageChops
+
+# Add current directory to path so we can import font_coverage
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from font_coverage import FontCoverage
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "font_assets")
+FONT_NAME = "郭敬明手写体.TTF"
+
+
+# 字体中肯定没有的字符（补充私用区），用来画出缺字时的 .notdef 字形
+MISSING_CHAR = "\U0010FFFD"
+
+
+def draw_char(font, char):
+    # getbbox 只统计非零像素，所以黑底白字
+    im = Image.new("L", (80, 80), color=0)
+    ImageDraw.Draw(im).text((10, 10), char, font=font, fill=255)
+    return im
+
+
+def renders_glyph(font, char):
+    """旧的检测方式：画出来看是否为空，或者与缺字时的 .notdef 字形相同"""
+    im = draw_char(font, char)
+    return im.getbbox() is not None and ImageChops.difference(im, draw_char(font, MISSING_CHAR)).getbbox() is not None
+
+
+def test_index_matches_font_and_persists():
+    index_path = os.path.join(tempfile.mkdtemp(), "coverage.json")
+    coverage = FontCoverage(FONT_DIR, index_path)
+    coverage.load()
+    assert os.path.exists(index_path)
+
+    codepoints = coverage.codepoints(FONT_NAME)
+    font = ImageFont.truetype(os.path.join(FONT_DIR, FONT_NAME), 40)
+    # 索引中的字符都能画出来
+    for char in "我能吞下玻璃而不伤身体，。ABCxyz123":
+        assert ord(char) in codepoints
+        assert renders_glyph(font, char)
+
+    text = "我能吞下玻璃\n而不伤身体 ☃\U0001F600"
+    filtered, removed = coverage.filter_text(text, font)
+    assert filtered == "我能吞下玻璃\n而不伤身体 "
+    assert removed == 2
+    # 不在索引中的字符画不出来
+    for char in "☃\U0001F600" + MISSING_CHAR:
+        assert ord(char) not in codepoints
+        assert not renders_glyph(font, char)
+
+    # 重新加载时直接使用磁盘上的索引
+    reloaded = FontCoverage(FONT_DIR, index_path)
+    reloaded.load()
+    assert reloaded.codepoints(FONT_NAME) == codepoints
+    print(f"{FONT_NAME}: {coverage.stats(FONT_NAME)}")
+
+
+if __name__ == "__main__":
+    test_index_matches_font_and_persists()
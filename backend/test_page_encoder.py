@@ -0,0 +1,86 @@
+import os
+import sys
+import io
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageChops
+
+# Add current directory to path so we can import page_encoder
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from page_encoder import PageEncoder, reduce_page, image_mimetype
+from pdf import PdfWriter
+
+
+def make_page(paper, ink, size=(600, 800)):
+    im = Image.new("RGB", size, paper)
+    draw = ImageDraw.Draw(im)
+    for y in range(60, size[1], 40):
+        draw.line((20, y, size[0] - 20, y), fill=(255, 0, 0) if paper != (255, 255, 255) else ink)
+        for x in range(30, size[0] - 40, 24):
+            draw.rectangle((x, y - 28, x + 14, y - 6), outline=ink, width=2)
+    return im
+
+
+def test_reduce_modes():
+    cases = [
+        (make_page((255, 255, 255), (0, 0, 0)), "1"),
+        (make_page((255, 251, 240), (0, 0, 0)), "P"),
+        (Image.linear_gradient("L").resize((600, 800)).convert("RGB"), "L"),
+        (Image.merge("RGB", [Image.radial_gradient("L")] * 2 + [Image.linear_gradient("L")]), "RGB"),
+    ]
+    encoder = PageEncoder()
+    for im, mode in cases:
+        page, bits = reduce_page(im)
+        assert page.mode == mode, (page.mode, mode)
+        if mode == "P":
+            assert bits == 2 and page.getextrema()[1] < 4
+        data = encoder.encode(im)
+        decoded = Image.open(io.BytesIO(data)).convert("RGB")
+        assert ImageChops.difference(decoded, im).getbbox() is None, mode
+        rgb = io.BytesIO()
+        im.save(rgb, format="PNG")
+        print(f"{mode:<4} {len(data):>7} bytes (RGB {len(rgb.getvalue())})")
+    stats = encoder.stats()
+    assert stats["pages"] == 4 and stats["modes"] == {"png:1": 1, "png:P2": 1, "png:L": 1, "png:RGB": 1}
+
+
+def test_output_formats():
+    text_page = make_page((255, 251, 240), (0, 0, 0))
+    photo = Image.merge("RGB", [Image.radial_gradient("L")] * 2 + [Image.linear_gradient("L")])
+    encoder = PageEncoder()
+    cases = [
+        (text_page, "auto", True, "image/png"),
+        (photo, "auto", True, "image/webp"),
+        (photo, "auto", False, "image/jpeg"),
+        (photo, "jpeg", True, "image/jpeg"),
+        (text_page, "webp", False, "image/webp"),
+    ]
+    for im, image_format, webp, mimetype in cases:
+        data = encoder.encode(im, image_format, 80, webp)
+        assert image_mimetype(data) == mimetype, (image_format, webp)
+        assert Image.open(io.BytesIO(data)).size == im.size
+    lossless = encoder.encode(text_page, "webp_lossless")
+    decoded = Image.open(io.BytesIO(lossless)).convert("RGB")
+    assert image_mimetype(lossless) == "image/webp"
+    assert ImageChops.difference(decoded, text_page).getbbox() is None
+
+
+def test_pdf_lossless_pages():
+    pages = [make_page((255, 255, 255), (0, 0, 0)), make_page((255, 251, 240), (20, 40, 200))]
+    buffer = io.BytesIO()
+    with PdfWriter(buffer) as writer:
+        for im in pages:
+            writer.add_page(im)
+    doc = fitz.open(stream=buffer.getvalue(), filetype="pdf")
+    assert doc.page_count == 2
+    for page, im in zip(doc, pages):
+        pix = page.get_pixmap(dpi=300)
+        rendered = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        assert ImageChops.difference(rendered, im).getbbox() is None
+    print(f"PDF {len(buffer.getvalue())} bytes")
+
+
+if __name__ == "__main__":
+    test_reduce_modes()
+    test_output_formats()
+    test_pdf_lossless_pages()
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+# Add current directory to path so we can import page_store
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from page_store import PageStore
+
+
+def test_shared_between_workers():
+    directory = tempfile.mkdtemp()
+    # 两个实例模拟两个 gunicorn worker
+    first = PageStore(budget=1024 * 1024, ttl=60, directory=directory)
+    second = PageStore(budget=1024 * 1024, ttl=60, directory=directory)
+    page = b"\x89PNG\r\n\x1a\n" + os.urandom(1000)
+    digest = first.put(page)
+    assert second.get(digest) == page
+    assert second.stats()["disk_hits"] == 1
+
+    # 重复保存同一页面不再写文件
+    first.put(page)
+    assert first.stats()["written"] == 1
+    assert first.get(digest) == page and first.stats()["hits"] == 1
+
+
+def test_memory_only():
+    store = PageStore(budget=3000, ttl=60, directory="")
+    digests = [store.put(os.urandom(1000)) for _ in range(4)]
+    assert store.get(digests[0]) is None
+    assert store.get(digests[-1]) is not None
+    assert store.get("not-a-digest") is None
+
+
+if __name__ == "__main__":
+    test_shared_between_workers()
+    test_memory_only()
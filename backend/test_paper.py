@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+from PIL import Image, ImageDraw, ImageChops
+
+# Add current directory to path so we can import paper
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from paper import create_notebook_image, PAPER_TYPES
+
+
+def draw_notebook_image(width, height, line_spacing, top_margin, bottom_margin, left_margin, right_margin,
+                        font_size, isUnderlined, line_color="red", paper_type="plain"):
+    """逐条 ImageDraw.line 的旧实现，作为对照"""
+    if paper_type == "grid":
+        image = Image.new("RGB", (width, height), (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        cell_size = int(font_size * 1.15)
+        x = left_margin
+        while x <= width - right_margin:
+            draw.line((x, top_margin, x, height - bottom_margin), fill=(0, 180, 180), width=1)
+            x += cell_size
+        y = top_margin
+        while y <= height - bottom_margin:
+            draw.line((left_margin, y, width - right_margin, y), fill=(0, 180, 180), width=1)
+            y += cell_size
+    elif paper_type == "lined" or isUnderlined == True or isUnderlined == "true":
+        image = Image.new("RGB", (width, height), (255, 251, 240))
+        draw = ImageDraw.Draw(image)
+        y = top_margin + line_spacing
+        while y < height - bottom_margin:
+            draw.line((left_margin, y-1, width - right_margin, y-1), fill=line_color)
+            draw.line((left_margin, y, width - right_margin, y), fill=line_color)
+            draw.line((left_margin, y+1, width - right_margin, y+1), fill=line_color)
+            y += line_spacing
+    else:
+        image = Image.new("RGB", (width, height), "white")
+    return image
+
+
+def test_matches_imagedraw():
+    cases = [
+        (2480, 3508, 120, 150, 150, 150, 150, 90, "true", "red", "lined"),
+        (2480, 3508, 120, 150, 150, 150, 150, 90, "false", "blue", "plain"),
+        (1748, 2480, 97, 0, 0, 0, 0, 40, "true", "green", "plain"),
+        (800, 600, 61, 1, 599, 30, 10, 50, "false", "red", "lined"),
+        (2480, 3508, 120, 150, 150, 150, 150, 90, "false", "red", "grid"),
+        (800, 600, 40, 0, 0, 0, 0, 52, "false", "red", "grid"),
+        (800, 600, 40, 13, 7, 800, 5, 30, "false", "red", "grid"),
+    ]
+    for case in cases:
+        expected = draw_notebook_image(*case)
+        actual = create_notebook_image(*case)
+        assert actual.size == expected.size and actual.mode == expected.mode
+        assert ImageChops.difference(actual, expected).getbbox() is None, case
+
+
+def test_new_paper_types():
+    for paper_type in PAPER_TYPES:
+        start = time.perf_counter()
+        image = create_notebook_image(2480, 3508, 120, 150, 150, 150, 150, 90, "false", "red", paper_type)
+        elapsed = time.perf_counter() - start
+        assert image.size == (2480, 3508) and image.mode == "RGB"
+        colors = image.getcolors(16)
+        assert colors is not None
+        if paper_type != "plain":
+            assert len(colors) > 1, paper_type
+        print(f"{paper_type:<10} {elapsed * 1000:6.1f} ms, {len(colors)} colors")
+
+
+if __name__ == "__main__":
+    test_matches_imagedraw()
+    test_new_paper_types()
@@ -0,0 +1,127 @@
+import os
+import sys
+import io
+import weakref
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageChops
+
+# Add current directory to path so we can import pdf
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pdf import PdfWriter, generate_pdf, write_pdf
+from page_encoder import PageEncoder
+
+
+def test_streaming_writer_keeps_one_page_alive():
+    refs = []
+    peak = [0]
+
+    def pages(count):
+        for i in range(count):
+            im = Image.new("RGB", (600, 800), (255, 255 - i * 8, 240))
+            refs.append(weakref.ref(im))
+            peak[0] = max(peak[0], sum(1 for ref in refs if ref() is not None))
+            yield im
+
+    buffer = io.BytesIO()
+    writer = PdfWriter(buffer)
+    for im in pages(20):
+        writer.add_page(im)
+        del im
+    writer.close()
+
+    assert writer.page_count == 20
+    assert peak[0] <= 2
+    doc = fitz.open(stream=buffer.getvalue(), filetype="pdf")
+    assert doc.page_count == 20
+    # 300 dpi 的页面：600x800 像素为 144x192 pt
+    assert (doc[0].rect.width, doc[0].rect.height) == (144, 192)
+    pixel = doc[19].get_pixmap(dpi=300).pixel(300, 400)
+    assert all(abs(a - b) <= 3 for a, b in zip(pixel, (255, 103, 240)))
+    print(f"{doc.page_count} pages, at most {peak[0]} alive")
+
+
+def test_generate_pdf_mixed_modes(tmp_dir="./temp"):
+    os.makedirs(tmp_dir, exist_ok=True)
+    sources = [Image.new("L", (300, 400), 128), Image.new("RGBA", (400, 300), (0, 0, 255, 255))]
+    path = generate_pdf(sources)
+    try:
+        doc = fitz.open(path)
+        assert doc.page_count == 2
+        assert (doc[1].rect.width, doc[1].rect.height) == (96, 72)
+        doc.close()
+    finally:
+        os.remove(path)
+
+
+def test_encoded_pages_embedded_without_reencoding():
+    page = Image.new("RGB", (300, 200), (255, 251, 240))
+    draw = ImageDraw.Draw(page)
+    for y in range(20, 200, 30):
+        draw.line((10, y, 290, y), fill=(255, 0, 0), width=3)
+        draw.rectangle((20, y - 15, 60, y - 5), fill=(0, 0, 0))
+    bw = page.convert("L").point(lambda v: 0 if v < 128 else 255).convert("RGB")
+    gray = Image.linear_gradient("L").resize((300, 200)).convert("RGB")
+    photo = Image.merge("RGB", [Image.radial_gradient("L")] * 2 + [Image.linear_gradient("L")])
+    encoder = PageEncoder()
+    sources = [encoder.encode(bw), encoder.encode(page), encoder.encode(gray), encoder.encode(photo)]
+    rgb_png = io.BytesIO()
+    page.save(rgb_png, format="PNG")
+    sources.append(rgb_png.getvalue())
+    jpeg = encoder.encode(photo, "jpeg", 90)
+    sources.append(jpeg)
+    expected = [bw, page, gray, photo, page, Image.open(io.BytesIO(jpeg)).convert("RGB")]
+
+    buffer = io.BytesIO()
+    assert write_pdf(sources, buffer) == len(sources)
+    data = buffer.getvalue()
+    # 已编码的数据原样出现在 PDF 中
+    assert jpeg in data
+    doc = fitz.open(stream=data, filetype="pdf")
+    for i, im in enumerate(expected):
+        pix = doc[i].get_pixmap(dpi=300)
+        rendered = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        diff = ImageChops.difference(rendered, im).getextrema()
+        # JPEG 由 PyMuPDF 解码，允许与 Pillow 的解码结果有极小差异
+        assert max(high for _, high in diff) <= (0 if i < 5 else 8), (i, diff)
+
+
+def test_profiles():
+    # A4 300 dpi 的纸张类页面和照片类页面
+    page = Image.new("RGB", (2480, 3508), (255, 251, 240))
+    draw = ImageDraw.Draw(page)
+    for y in range(270, 3358, 120):
+        draw.line((150, y, 2330, y), fill=(255, 0, 0), width=3)
+        for x in range(160, 2300, 90):
+            draw.rectangle((x, y - 80, x + 50, y - 20), outline=(0, 0, 0), width=6)
+    photo = Image.merge("RGB", [Image.radial_gradient("L")] * 2 + [Image.linear_gradient("L")]).resize(page.size)
+
+    sizes = {}
+    for profile in ("print", "screen", "compact"):
+        buffer = io.BytesIO()
+        write_pdf([page, photo], buffer, profile)
+        doc = fitz.open(stream=buffer.getvalue(), filetype="pdf")
+        for pdf_page in doc:
+            # A4：210x297 mm
+            assert (round(pdf_page.rect.width, 1), round(pdf_page.rect.height, 1)) == (595.3, 841.9)
+        image_sizes = [(info[2], info[3]) for info in doc[0].get_images()]
+        rendered = doc[0].get_pixmap(dpi=300)
+        rendered = Image.frombytes("RGB", (rendered.width, rendered.height), rendered.samples)
+        # 墨水保持黑色，纸张不会变黑
+        ink = rendered.getpixel((163, 270 - 50))
+        paper = rendered.getpixel((120, 200))
+        assert max(ink) < 80 and min(paper) > 200, (profile, ink, paper)
+        sizes[profile] = len(buffer.getvalue())
+        print(f"{profile:<8} {image_sizes[0]} {sizes[profile] / 1024:7.0f} KB")
+        if profile == "screen":
+            assert image_sizes[0] == (1240, 1754)
+        else:
+            assert image_sizes[0] == (2480, 3508)
+    assert sizes["compact"] < sizes["screen"] < sizes["print"]
+
+
+if __name__ == "__main__":
+    test_streaming_writer_keeps_one_page_alive()
+    test_generate_pdf_mixed_modes()
+    test_encoded_pages_embedded_without_reencoding()
+    test_profiles()
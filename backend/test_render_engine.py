@@ -0,0 +1,108 @@
+import os
+import sys
+from PIL import Image, ImageFont, ImageChops
+from handright import Template, Feature, handwrite
+from handright._core import _draft
+
+# Add current directory to path so we can import render_engine
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import render_engine
+from render_engine import render_pages, PageLayout, scale_template
+from glyph_atlas import glyph_atlas
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "font_assets", "神韵英子楷书.ttf")
+
+
+def make_template():
+    background = Image.new("RGB", (800, 600), (255, 251, 240))
+    font = ImageFont.truetype(FONT_PATH, 40)
+    return Template(
+        background=background,
+        font=font,
+        line_spacing=60,
+        left_margin=50,
+        top_margin=50,
+        right_margin=50,
+        bottom_margin=50,
+        word_spacing=2,
+        line_spacing_sigma=2,
+        font_size_sigma=1,
+        word_spacing_sigma=2,
+        perturb_x_sigma=2,
+        perturb_y_sigma=2,
+        perturb_theta_sigma=0.05,
+        ink_depth_sigma=10,
+    )
+
+
+def test_parallel_matches_sequential():
+    text = "我能吞下玻璃而不伤身体。" * 40
+    expected = list(handwrite(text, make_template(), seed=7))
+    assert len(expected) > 1
+
+    original = render_engine.RENDER_PROCESSES
+    render_engine.RENDER_PROCESSES = 2
+    try:
+        totals = []
+        pages = list(render_pages(text, make_template(), seed=7, on_total=totals.append))
+    finally:
+        render_engine.RENDER_PROCESSES = original
+
+    assert totals == [len(expected)]
+    assert len(pages) == len(expected)
+    for a, b in zip(expected, pages):
+        assert ImageChops.difference(a, b).getbbox() is None
+    print(f"{len(pages)} pages identical to sequential rendering")
+
+
+def test_resume_after_edit_matches_full_render():
+    text = "我能吞下玻璃而不伤身体。" * 40
+    edited = text[:-20] + "最后一页改了几个字。" + text[-10:]
+
+    layout = PageLayout(text)
+    original = list(render_pages(text, make_template(), seed=7, layout=layout))
+    reusable = layout.reusable_pages(edited)
+    assert 0 < reusable < len(original)
+
+    resumed = layout.derive(edited, reusable)
+    rest = list(render_pages(edited, make_template(), seed=7, layout=resumed))
+    expected = list(handwrite(edited, make_template(), seed=7))
+
+    pages = original[:reusable] + rest
+    assert len(pages) == len(expected)
+    assert resumed.page_count() == len(expected)
+    for a, b in zip(expected, pages):
+        assert ImageChops.difference(a, b).getbbox() is None
+    print(f"reused {reusable} of {len(pages)} pages after edit")
+
+
+def test_glyph_atlas_draft_matches_handright():
+    text = "Hello, world! 我能吞下玻璃而不伤身体。\n" * 30
+    for features in (set(), {Feature.GRID_LAYOUT}):
+        template = make_template()
+        template.set_features(features)
+        expected = list(_draft(text, (template,), 3))
+        pages = list(render_engine._draft(PageLayout(text), (template,), 3))
+        assert len(pages) == len(expected)
+        for a, b in zip(expected, pages):
+            assert ImageChops.difference(a.image, b.image).getbbox() is None
+    assert glyph_atlas.stats()["hits"] > 0
+    print(f"atlas drafts identical to handright: {glyph_atlas.stats()}")
+
+
+def test_scaled_background_cached():
+    template = make_template()
+    first = scale_template(template, 0.5, "test-background").get_background()
+    second = scale_template(make_template(), 0.5, "test-background").get_background()
+    assert first is second and first.size == (400, 300)
+    expected = template.get_background().resize((400, 300), Image.Resampling.LANCZOS)
+    assert ImageChops.difference(first, expected).getbbox() is None
+    assert scale_template(template, 0.25, "test-background").get_background().size == (200, 150)
+
+
+if __name__ == "__main__":
+    test_parallel_matches_sequential()
+    test_resume_after_edit_matches_full_render()
+    test_glyph_atlas_draft_matches_handright()
+    test_scaled_background_cached()
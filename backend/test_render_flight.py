@@ -0,0 +1,94 @@
+import os
+import sys
+import shutil
+import tempfile
+from contextlib import contextmanager
+from PIL import Image, ImageFont
+from handright import Template
+
+# Add current directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from render_cache import RenderCache, LayoutHistory, SingleFlight
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "font_assets", "神韵英子楷书.ttf")
+TEXT = "我能吞下玻璃而不伤身体。" * 40
+
+
+def make_template():
+    return Template(
+        background=Image.new("RGB", (800, 600), (255, 251, 240)),
+        font=ImageFont.truetype(FONT_PATH, 40),
+        line_spacing=60, left_margin=50, top_margin=50, right_margin=50, bottom_margin=50,
+    )
+
+
+@contextmanager
+def isolated_render_state():
+    """
+    把 app 的渲染缓存、排版记录和合并渲染换成新的实例，缓存目录为临时目录，
+    避免命中之前运行留在 ./cache/render 中的结果而绕过合并渲染
+    """
+    cache_dir = tempfile.mkdtemp()
+    cache = RenderCache(cache_dir=cache_dir)
+    state = {"render_cache": cache, "layout_history": LayoutHistory(cache), "render_flight": SingleFlight()}
+    original = {name: getattr(app, name) for name in state}
+    for name, value in state.items():
+        setattr(app, name, value)
+    try:
+        yield state
+    finally:
+        for name, value in original.items():
+            setattr(app, name, value)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_error_before_iteration():
+    def broken_resume(layout_key, text):
+        raise RuntimeError("resume failed")
+
+    with isolated_render_state() as state:
+        state["layout_history"].resume = broken_resume
+        try:
+            app.render_png_pages(TEXT, make_template(), 7, "flight-error", "flight-error-layout")
+            assert False, "expected RuntimeError"
+        except RuntimeError:
+            pass
+        assert not state["render_flight"].active("flight-error")
+        assert state["render_flight"].stats()["in_flight"] == 0
+
+
+def test_unstarted_iterator_closed():
+    with isolated_render_state() as state:
+        flight = state["render_flight"]
+        pages, info = app.render_png_pages(TEXT, make_template(), 7, "flight-unstarted")
+        assert not info["cached"]
+        pages.close()
+        assert flight.stats()["in_flight"] == 0 and flight.stats()["leaders"] == 0
+
+        # 之后相同参数的请求仍由自己渲染，不会等待不存在的 leader
+        pages, info = app.render_png_pages(TEXT, make_template(), 7, "flight-unstarted")
+        assert not info["cached"] and not info["coalesced"]
+        assert len(list(pages)) > 1
+        assert flight.stats()["leaders"] == 1 and flight.stats()["followers"] == 0
+        assert state["render_cache"].get("flight-unstarted") is not None
+        assert flight.stats()["in_flight"] == 0
+
+
+def test_closed_during_iteration():
+    with isolated_render_state() as state:
+        flight = state["render_flight"]
+        pages, info = app.render_png_pages(TEXT, make_template(), 7, "flight-partial")
+        assert not info["cached"]
+        next(pages)
+        assert flight.active("flight-partial")
+        pages.close()
+        assert flight.stats()["in_flight"] == 0 and flight.stats()["abandoned"] == 1
+        assert state["render_cache"].get("flight-partial") is None
+
+
+if __name__ == "__main__":
+    test_error_before_iteration()
+    test_unstarted_iterator_closed()
+    test_closed_during_iteration()
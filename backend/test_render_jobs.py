@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+
+# Add current directory to path so we can import render_jobs
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from render_jobs import RenderJobQueue, StoredJob, JOB_DONE, JOB_RUNNING
+
+
+def test_job_visible_from_other_worker():
+    directory = tempfile.mkdtemp()
+    # 两个队列模拟两个 gunicorn worker
+    first = RenderJobQueue(max_workers=1, directory=directory)
+    second = RenderJobQueue(max_workers=1, directory=directory)
+    step = threading.Event()
+
+    def render(job):
+        job.set_total(2)
+        job.advance()
+        step.wait(5)
+        job.advance()
+        return {"status": "success", "page_count": 2}
+
+    job = first.submit(render)
+    deadline = time.time() + 5
+    while job.pages_done < 1 and time.time() < deadline:
+        time.sleep(0.01)
+
+    remote = second.get(job.id)
+    assert isinstance(remote, StoredJob)
+    assert remote.state == JOB_RUNNING and remote.to_dict()["pages_done"] == 1
+
+    version = remote.version
+    step.set()
+    while not remote.is_finished() and time.time() < deadline:
+        version = remote.wait_for_update(version, timeout=1)
+    data = remote.to_dict()
+    assert data["state"] == JOB_DONE and data["progress"] == 1.0
+    assert data["result"] == {"status": "success", "page_count": 2}
+
+    assert second.get("00000000-0000-4000-8000-000000000000") is None
+    assert second.get("../" + job.id) is None
+
+
+def test_memory_only():
+    queue = RenderJobQueue(max_workers=1, directory="")
+    job = queue.submit(lambda job: {"status": "success"})
+    job.wait_for_update(0, timeout=5)
+    assert queue.get(job.id) is job
+    assert RenderJobQueue(max_workers=1, directory="").get(job.id) is None
+
+
+if __name__ == "__main__":
+    test_job_visible_from_other_worker()
+    test_memory_only()
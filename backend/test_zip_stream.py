@@ -0,0 +1,58 @@
+import os
+import sys
+import io
+import zipfile
+from PIL import Image
+
+# Add current directory to path so we can import zip_stream
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from zip_stream import iter_zip, iter_page_zip
+
+
+def encoded(image_format, color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 400), color).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_pages_stored():
+    pages = [encoded("PNG", "white"), encoded("WEBP", "red"), encoded("JPEG", "blue")]
+    chunks = list(iter_page_zip(pages))
+    # 每页一块，最后一块为中央目录
+    assert len(chunks) == len(pages) + 1
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.testzip() is None
+    assert archive.namelist() == ["page_1.png", "page_2.webp", "page_3.jpg"]
+    for info, page in zip(archive.infolist(), pages):
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert archive.read(info) == page
+
+
+def test_text_deflated():
+    text = "春眠不觉晓，处处闻啼鸟。".encode("utf-8") * 100
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip([("text.txt", text)]))))
+    info = archive.getinfo("text.txt")
+    assert info.compress_type == zipfile.ZIP_DEFLATED and info.compress_size < len(text)
+    assert archive.read(info) == text
+
+
+def test_pages_read_lazily():
+    consumed = []
+
+    def pages():
+        for i in range(3):
+            consumed.append(i)
+            yield encoded("PNG", (i, i, i))
+
+    stream = iter_page_zip(pages())
+    first = next(stream)
+    assert consumed == [0] and first.startswith(b"PK\x03\x04")
+    stream.close()
+    assert consumed == [0]
+
+
+if __name__ == "__main__":
+    test_pages_stored()
+    test_text_deflated()
+    test_pages_read_lazily()
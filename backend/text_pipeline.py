@@ -0,0 +1,92 @@
+"""
+文本规范化模块
+把渲染前的文本处理合并为一条预编译的流水线：转换表和正则在导入时构建，
+换行、制表符和不可见字符由同一张转换表一次 str.translate 完成，不再逐字调用 unicodedata
+阶段（均可单独开关）：
+    newlines         统一换行符（\\r\\n、\\r -> \\n）
+    invisible        去掉会渲染成方块的字符：控制/格式/私有区/代理/未分配字符、方块和几何图形（U+2580-25FF）、
+                     U+1F000 及以上（emoji 等）
+    tabs             制表符转换为空格
+    english_spacing  相邻两个英文单词之间的单个空格改为两个空格（中文不变）
+    font             去掉字体不支持的字符（调用时传入字体）
+"""
+import re
+import unicodedata
+import logging
+
+from font_coverage import font_coverage
+
+logger = logging.getLogger(__name__)
+
+TAB_WIDTH = 4
+
+# 会渲染成方块的 Unicode 类别：Cc=控制字符, Cf=格式字符, Co=私有区, Cs=代理对, Cn=未分配
+_REMOVED_CATEGORIES = frozenset(("Cc", "Cf", "Co", "Cs", "Cn"))
+# 换行和制表符由其他阶段处理
+_KEPT_CONTROLS = frozenset(map(ord, "\n\t\r"))
+# 英文单词允许的字符
+_ENGLISH_CHARS = r"[a-zA-Z0-9.,!?;:'\"()\-_]"
+
+
+def _invisible_table():
+    # U+1F000 以下需要去掉的码位；以上的整段由 _ASTRAL_RE 处理，避免转换表过大
+    table = {}
+    for cp in range(0x1F000):
+        if cp in _KEPT_CONTROLS:
+            continue
+        if (
+            0x2580 <= cp <= 0x25FF
+            or 0xE000 <= cp <= 0xF8FF
+            or unicodedata.category(chr(cp)) in _REMOVED_CATEGORIES
+        ):
+            table[cp] = None
+    return table
+
+
+_INVISIBLE_TABLE = _invisible_table()
+_ASTRAL_RE = re.compile("[\U0001F000-\U0010FFFF]")
+# 前后都以空格、换行或文本边界分隔的英文单词之间的单个空格
+_ENGLISH_GAP_RE = re.compile(
+    rf"(?<![^ \n])({_ENGLISH_CHARS}+) (?={_ENGLISH_CHARS}+(?![^ \n]))"
+)
+
+
+class TextPipeline(object):
+    """
+    预编译的文本规范化流水线，构造时确定启用的阶段
+    """
+
+    def __init__(self, newlines=True, invisible=True, tabs=True, english_spacing=False, tab_width=TAB_WIDTH):
+        self.newlines = newlines
+        self.invisible = invisible
+        self.tabs = tabs
+        self.english_spacing = english_spacing
+        table = dict(_INVISIBLE_TABLE) if invisible else {}
+        if newlines:
+            table[ord("\r")] = "\n"
+        if tabs:
+            table[ord("\t")] = " " * tab_width
+        self._table = table
+
+    def __call__(self, text, font=None):
+        """
+        :param font: PIL 字体，传入时去掉该字体不支持的字符
+        :return: 规范化后的文本
+        """
+        if self.newlines:
+            text = text.replace("\r\n", "\n")
+        if self._table:
+            text = text.translate(self._table)
+        if self.invisible and not text.isascii():
+            text = _ASTRAL_RE.sub("", text)
+        if self.english_spacing:
+            text = _ENGLISH_GAP_RE.sub(r"\1  ", text)
+        if font is not None:
+            text, _ = font_coverage.filter_text(text, font)
+        return text
+
+
+# 渲染前默认的文本处理
+default_pipeline = TextPipeline()
+# 网页版开启“英文单词间距”时使用
+english_spacing_pipeline = TextPipeline(english_spacing=True)
@@ -412,6 +412,7 @@ def add_watermark_to_image(image, watermark_text=None):
     水印会在整个图片上斜着重复出现
     """
     from PIL import Image, ImageDraw, ImageFont
+    from font_pool import font_pool
     import math
     
     if watermark_text is None:
@@ -452,7 +453,7 @@ def add_watermark_to_image(image, watermark_text=None):
             
         if font_path:
             logger.info(f"Using watermark font: {font_path}")
-            font = ImageFont.truetype(font_path, font_size)
+            font = font_pool.get(font_path, font_size)
         else:
             logger.warning("No font file found for watermark, using default.")
             font = ImageFont.load_default()
@@ -0,0 +1,70 @@
+"""
+流式 ZIP 打包模块
+页面渲染并编码一页就写入一页，ZIP 内容按条目分块产出，可以边渲染边发送给客户端或写入下载文件，
+不需要临时目录，也不在内存中保留整个压缩包（只保留中央目录）。
+输出没有 tell/seek，zipfile 按不可定位的流写入：每个条目后附数据描述符，读取时与普通 ZIP 没有区别。
+PNG、WebP、JPEG 本身已经压缩，再用 deflate 几乎不会变小，只浪费 CPU，这些条目直接存储（ZIP_STORED）
+"""
+import zipfile
+
+from page_encoder import image_mimetype
+
+# 已压缩格式的文件头
+_COMPRESSED_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"%PDF")
+
+_EXTENSIONS = {"image/png": "png", "image/webp": "webp", "image/jpeg": "jpg"}
+
+
+def compress_type(data):
+    """条目的压缩方式：已压缩的图片直接存储，其他内容用 deflate"""
+    if data.startswith(_COMPRESSED_SIGNATURES) or (data[:4] == b"RIFF" and data[8:12] == b"WEBP"):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def page_filename(index, page):
+    """第 index 页（从 0 开始）在压缩包中的文件名，扩展名按编码格式确定"""
+    return f"page_{index + 1}.{_EXTENSIONS[image_mimetype(page)]}"
+
+
+class _ChunkSink(object):
+    """
+    只追加的输出，取走已写入的数据后即释放
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    把 (文件名, 数据) 流式打包为 ZIP
+    :param entries: (文件名, 数据) 的可迭代对象，按需逐个读取
+    :return: ZIP 内容的分块迭代器，每写完一个条目产出一块，最后一块为中央目录
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for name, data in entries:
+            zf.writestr(name, data, compress_type=compress_type(data))
+            yield sink.take()
+    yield sink.take()
+
+
+def iter_page_zip(pages):
+    """
+    把编码后的页面流式打包为 ZIP，文件名为 page_<页码>.<扩展名>
+    :param pages: 编码后页面的可迭代对象
+    """
+    return iter_zip((page_filename(i, page), page) for i, page in enumerate(pages))